@@ -0,0 +1,19 @@
+"""
+ASGI config for mutrack project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Read-only tracker views are served by their async versions (see
+tracker/async_views.py).
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mutrack.settings")
+os.environ.setdefault("MUTRACK_ASYNC_VIEWS", "1")
+
+application = get_asgi_application()
@@ -0,0 +1,15 @@
+"""mutrack URL Configuration under ASGI
+
+The same as urls.py, but serving the tracker's read-only views with their
+async versions (see tracker/async_urls.py). Chosen by mutrack/asgi.py through
+the MUTRACK_ASYNC_VIEWS environment variable.
+"""
+from django.conf.urls import url, include
+
+from . import urls
+
+urlpatterns = [
+    url(r'^tracker/', include('tracker.async_urls'))
+    if getattr(pattern, 'namespace', None) == 'tracker' else pattern
+    for pattern in urls.urlpatterns
+]
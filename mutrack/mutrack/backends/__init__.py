@@ -0,0 +1,6 @@
+"""
+Database backends for mutrack, selected in settings.DATABASES by
+MUTRACK_DB_PROFILE.
+
+Each is a thin subclass of the Django backend of the same name.
+"""
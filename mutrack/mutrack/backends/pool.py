@@ -0,0 +1,83 @@
+"""
+pool.py
+
+A thread-safe database connection pool which waits for a free connection
+rather than failing when they're all in use.
+
+Independent of the database driver: connections are opened by a function
+passed in, and only need a closed attribute and a close method.
+"""
+import threading
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free in time."""
+
+
+class PoolClosed(Exception):
+    """Raised when taking a connection from a closed pool."""
+
+
+class ConnectionPool:
+    """Pool of at most max_size connections.
+
+    getconn waits up to timeout seconds (forever if None) for one of the
+    max_size connections to be returned with putconn. reset is called with
+    each connection returned, and should return False if it can't be reused.
+    """
+    def __init__(self, connect, max_size, timeout=None, reset=None):
+        if max_size < 1:
+            raise ValueError('A pool needs at least one connection.')
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.reset = reset
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.lock = threading.Lock()
+        self.idle = []
+        self.closed = False
+
+    def getconn(self):
+        """Take a connection, opening one if none are idle."""
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(
+                'No database connection free after {} seconds; all {} are in '
+                'use. Raise the pool size or lower CONN_MAX_AGE.'.format(
+                    self.timeout, self.max_size))
+        try:
+            with self.lock:
+                if self.closed:
+                    raise PoolClosed('The connection pool is closed.')
+                connection = self.idle.pop() if self.idle else None
+            if connection is None or connection.closed:
+                connection = self.connect()
+        except BaseException:
+            self.slots.release()
+            raise
+        return connection
+
+    def putconn(self, connection, close=False):
+        """Return a connection taken with getconn, closing it if close is
+        true, it's broken or the pool has been closed.
+        """
+        try:
+            keep = (not close and not connection.closed
+                    and (self.reset is None or self.reset(connection)))
+            with self.lock:
+                keep = keep and not self.closed
+                if keep:
+                    self.idle.append(connection)
+            if not keep and not connection.closed:
+                connection.close()
+        finally:
+            self.slots.release()
+
+    def close(self):
+        """Close the idle connections, and the ones in use as they're
+        returned. The pool can't be used afterwards.
+        """
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
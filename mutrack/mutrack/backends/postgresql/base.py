@@ -0,0 +1,113 @@
+"""
+PostgreSQL backend which takes its connections from a pool.
+
+Closing a connection returns it to the pool rather than disconnecting, so
+requests which don't keep a persistent connection (see CONN_MAX_AGE) don't
+pay for a new one either. Pools are shared by all threads and sized by
+'pool_max_size' in the database's OPTIONS. When every connection is in use,
+a thread waits up to 'pool_timeout' seconds for one to be returned.
+"""
+import threading
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+from django.db.backends.postgresql import base, creation
+
+from mutrack.backends.pool import ConnectionPool
+
+POOL_OPTIONS = ('pool_max_size', 'pool_timeout')
+
+# Maps (alias, connection parameters) -> pool
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def close_pools():
+    """Disconnect every pooled connection, e.g. before dropping a database.
+
+    Connections in use are closed as they're returned.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for connection_pool in pools:
+        connection_pool.close()
+
+
+def reset_connection(connection):
+    """Roll back anything uncommitted on a connection returned to the pool.
+
+    Returns False if the connection is broken.
+    """
+    status = connection.info.transaction_status
+    if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        connection.rollback()
+    return True
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Pooled connections to the test database would stop it being dropped
+        close_pools()
+        super(DatabaseCreation, self)._destroy_test_db(test_database_name,
+                                                       verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_connection_params(self):
+        params = super(DatabaseWrapper, self).get_connection_params()
+        # Not arguments to psycopg2.connect
+        for option in POOL_OPTIONS:
+            params.pop(option, None)
+        return params
+
+    def get_pool(self, conn_params):
+        """Return the pool for this database, creating it if needed.
+
+        Pools are kept per set of connection parameters, so e.g. the test
+        database doesn't share a pool with the real one.
+        """
+        key = (self.alias, tuple(sorted(
+            (name, str(value)) for name, value in conn_params.items())))
+        with _pools_lock:
+            if key not in _pools:
+                options = self.settings_dict['OPTIONS']
+                _pools[key] = ConnectionPool(
+                    lambda: psycopg2.connect(**conn_params),
+                    options.get('pool_max_size', 10),
+                    timeout=options.get('pool_timeout', 30),
+                    reset=reset_connection)
+            return _pools[key]
+
+    def get_new_connection(self, conn_params):
+        """Get a connection from the pool.
+
+        Otherwise the same as base.DatabaseWrapper.get_new_connection.
+        """
+        self.pool = self.get_pool(conn_params)
+        connection = self.pool.getconn()
+
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        psycopg2.extras.register_default_jsonb(conn_or_curs=connection,
+                                               loads=lambda x: x)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                # The pool rolls back anything uncommitted, and closes the
+                # connection if it's broken
+                self.pool.putconn(self.connection)
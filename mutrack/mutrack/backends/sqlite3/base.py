@@ -0,0 +1,39 @@
+"""
+SQLite backend which tunes each new connection with PRAGMA statements.
+
+The pragmas are given as a dict in the database's OPTIONS under 'pragmas',
+e.g. {'journal_mode': 'WAL', 'synchronous': 'NORMAL'}, and run in order
+right after connecting.
+"""
+import re
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+# Pragma names and values are put straight into SQL, so only simple words
+# and numbers are allowed
+PRAGMA_RE = re.compile(r'-?\w+')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super(DatabaseWrapper, self).get_connection_params()
+        # Not an argument to sqlite3.connect
+        params.pop('pragmas', None)
+        return params
+
+    def pragmas(self):
+        pragmas = self.settings_dict['OPTIONS'].get('pragmas', {})
+        for name, value in pragmas.items():
+            if not (PRAGMA_RE.fullmatch(name)
+                    and PRAGMA_RE.fullmatch(str(value))):
+                raise ImproperlyConfigured(
+                    'Invalid SQLite pragma: {} = {}'.format(name, value))
+        return pragmas
+
+    def get_new_connection(self, conn_params):
+        conn = super(DatabaseWrapper, self).get_new_connection(conn_params)
+        for name, value in self.pragmas().items():
+            conn.execute('PRAGMA {} = {}'.format(name, value))
+        return conn
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/1.11/ref/settings/
 
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -43,6 +45,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     # 'debug_toolbar.middleware.DebugToolbarMiddleware', # requires Django>=2.2, but that breaks prod b/c of sqlite version
+    'tracker.middleware.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,7 +56,12 @@ MIDDLEWARE = [
     'django.middleware.locale.LocaleMiddleware',
 ]
 
-ROOT_URLCONF = 'mutrack.urls'
+# Under ASGI (see asgi.py), read-only tracker views are served by async
+# versions instead
+if os.getenv('MUTRACK_ASYNC_VIEWS', '0') == '1':
+    ROOT_URLCONF = 'mutrack.async_urls'
+else:
+    ROOT_URLCONF = 'mutrack.urls'
 
 TEMPLATES = [
     {
@@ -72,17 +80,132 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'mutrack.wsgi.application'
+ASGI_APPLICATION = 'mutrack.asgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+#
+# Chosen with MUTRACK_DB_PROFILE (see mutrack/backends):
+#
+# - sqlite (the default): plain SQLite in db.sqlite3.
+# - sqlite-tuned: SQLite with write-ahead logging, a larger page cache and
+#   memory-mapped reads, set on each connection. WAL needs the database on a
+#   local disk, not a network filesystem.
+# - postgres: PostgreSQL with a connection pool, configured with
+#   MUTRACK_DB_NAME, _USER, _PASSWORD, _HOST and _PORT. Connections go back
+#   to the pool after each request, so MUTRACK_DB_POOL_SIZE connections are
+#   shared by every thread; one with none free waits up to
+#   MUTRACK_DB_POOL_TIMEOUT seconds for one.
+#
+# MUTRACK_DB_CONN_MAX_AGE overrides how many seconds connections are kept
+# between requests. With the pool, a connection a thread keeps is one other
+# threads wait for.
+
+DB_PROFILE = os.getenv('MUTRACK_DB_PROFILE', 'sqlite')
+
+if DB_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'mutrack.backends.postgresql',
+            'NAME': os.getenv('MUTRACK_DB_NAME', 'mutrack'),
+            'USER': os.getenv('MUTRACK_DB_USER', ''),
+            'PASSWORD': os.getenv('MUTRACK_DB_PASSWORD', ''),
+            'HOST': os.getenv('MUTRACK_DB_HOST', ''),
+            'PORT': os.getenv('MUTRACK_DB_PORT', ''),
+            'CONN_MAX_AGE': int(os.getenv('MUTRACK_DB_CONN_MAX_AGE', '0')),
+            'OPTIONS': {
+                'pool_max_size': int(os.getenv('MUTRACK_DB_POOL_SIZE', '10')),
+                'pool_timeout': float(
+                    os.getenv('MUTRACK_DB_POOL_TIMEOUT', '30')),
+            },
+        }
+    }
+elif DB_PROFILE == 'sqlite-tuned':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'mutrack.backends.sqlite3',
+            'NAME': os.getenv('MUTRACK_DB_NAME',
+                              os.path.join(BASE_DIR, 'db.sqlite3')),
+            'CONN_MAX_AGE': int(os.getenv('MUTRACK_DB_CONN_MAX_AGE', '300')),
+            'OPTIONS': {
+                # Seconds to wait for a lock held by another connection
+                'timeout': 20,
+                'pragmas': {
+                    'journal_mode': 'WAL',
+                    # Safe with WAL: a power cut can lose the last
+                    # transactions but not corrupt the database
+                    'synchronous': 'NORMAL',
+                    # Negative sizes are in KiB: 64 MiB
+                    'cache_size': -64 * 1024,
+                    'mmap_size': 256 * 1024 * 1024,
+                    'temp_store': 'MEMORY',
+                },
+            },
+        }
+    }
+elif DB_PROFILE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('MUTRACK_DB_NAME',
+                              os.path.join(BASE_DIR, 'db.sqlite3')),
+            'CONN_MAX_AGE': int(os.getenv('MUTRACK_DB_CONN_MAX_AGE', '0')),
+        }
+    }
+else:
+    raise ImproperlyConfigured(
+        'Unknown MUTRACK_DB_PROFILE: {}'.format(DB_PROFILE))
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+#
+# Rendered pages are cached under a data version kept in the cache itself (see
+# tracker/caching.py), so when running more than one server process, set
+# MUTRACK_CACHE_DIR to share a file-based cache between them.
+
+if os.getenv('MUTRACK_CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('MUTRACK_CACHE_DIR'),
+        }
     }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Seconds to keep the rendered album table on the index page. Old versions
+# stop being used as soon as data changes, so this only limits how long they
+# take up space.
+TRACKER_TABLE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Weights of the parts of each album's score on the recommendations page
+# (see tracker/recommendations.py), and the number of days of listens its
+# genre matching looks at
+TRACKER_RECOMMENDATION_WEIGHTS = {
+    'rating': 1.0,
+    'plays': 0.25,
+    'recency': 1.0,
+    'genre': 1.5,
 }
+TRACKER_RECOMMENDATION_WINDOW = 90
+
+# Similar albums and artists (see tracker/similarity.py): how many of each
+# are kept, how many days apart listens can be and still be in the same
+# listening session, and how much shared genres count against co-listens
+TRACKER_SIMILAR_COUNT = 10
+TRACKER_SESSION_DAYS = 1
+TRACKER_SIMILARITY_GENRE_WEIGHT = 0.5
+
+# Number of recent listens shown on album pages, and listens per page of an
+# album's full listen history
+TRACKER_RECENT_LISTENS = int(os.getenv('MUTRACK_RECENT_LISTENS', '5'))
+TRACKER_LISTEN_HISTORY_PAGE_SIZE = 100
 
 
 # Password validation
@@ -124,8 +247,76 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
+# collectstatic gives files content-hashed names, and minifies and
+# compresses them. See storage.py.
+STATICFILES_STORAGE = 'mutrack.storage.CompressedManifestStaticFilesStorage'
+
+# Serve collected static files from Django, with far-future cache headers,
+# when no web server in front of the site does. Set MUTRACK_SERVE_STATIC=1.
+SERVE_STATIC = os.getenv('MUTRACK_SERVE_STATIC', '0') == '1'
+
 LOGIN_REDIRECT_URL = '/tracker/'
 
+# Threads running the database work of async views (see
+# tracker/async_views.py), and so the most database connections they use
+TRACKER_ASYNC_THREADS = int(os.getenv('MUTRACK_ASYNC_THREADS', '8'))
+
+# How background jobs keeping derived data up to date run (see
+# tracker/jobs.py): 'thread' on a pool of MUTRACK_JOB_THREADS threads in the
+# server process, 'sync' in the request that enqueues them, or 'manual' only
+# with the run_jobs management command. Set with MUTRACK_JOBS.
+TRACKER_JOBS = os.getenv('MUTRACK_JOBS', 'thread')
+if TRACKER_JOBS not in ('thread', 'sync', 'manual'):
+    raise ImproperlyConfigured(
+        'Unknown MUTRACK_JOBS: {}'.format(TRACKER_JOBS))
+TRACKER_JOB_THREADS = int(os.getenv('MUTRACK_JOB_THREADS', '2'))
+
+# Request timing (queries, database, template and total time) sent in a
+# Server-Timing header and logged. See tracker/middleware.py. Off unless
+# MUTRACK_TIMING=1.
+TRACKER_TIMING_ENABLED = os.getenv('MUTRACK_TIMING', '0') == '1'
+
+# Directory for log files. Without one, logs go to standard error.
+LOG_DIR = os.getenv('MUTRACK_LOG_DIR')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {},
+    'formatters': {
+        'timing': {
+            'format': '%(asctime)s %(message)s',
+        },
+    },
+    'loggers': {},
+}
+
+if TRACKER_TIMING_ENABLED:
+    if LOG_DIR:
+        LOGGING['handlers']['timing'] = {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': os.path.join(LOG_DIR, 'timing.log'),
+            'maxBytes': 5 * 1024 * 1024,
+            'backupCount': 3,
+            'delay': True,
+            'formatter': 'timing',
+        }
+    else:
+        LOGGING['handlers']['timing'] = {
+            'class': 'logging.StreamHandler',
+            'formatter': 'timing',
+        }
+    LOGGING['loggers']['tracker.timing'] = {
+        'handlers': ['timing'],
+        'level': 'INFO',
+        'propagate': False,
+    }
+
+# JSON Lines format for dumpdata/loaddata and library exports
+SERIALIZATION_MODULES = {
+    'jsonl': 'tracker.jsonl_serializer',
+}
+
 # For django-debug-toolbar
 INTERNAL_IPS = [
     '127.0.0.1',
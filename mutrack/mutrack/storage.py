@@ -0,0 +1,147 @@
+"""
+storage.py
+
+Static files storage for the site.
+
+collectstatic gives every file a content-hashed name (as Django's
+ManifestStaticFilesStorage does), so browsers can cache them forever and
+still pick up changes, then minifies the hashed CSS and Javascript and
+writes gzip and brotli compressed copies alongside them (e.g.
+style.3d2f8c1e.css.gz) for the web server to send instead.
+
+Minifying Javascript needs the rjsmin package and brotli compression the
+brotli package; without them those steps are skipped.
+"""
+import gzip
+import re
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+# Extensions of files worth compressing
+COMPRESSED_EXTENSIONS = ('.css', '.js', '.json', '.svg', '.txt', '.html',
+                         '.map', '.xml')
+
+# Compressed copies not at least this much smaller are left out
+MIN_COMPRESSION = 0.95
+
+# Compressed copies are served in this order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+CSS_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+CSS_STRING_RE = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')''')
+# Not ':', as 'a :hover' and 'a:hover' are different selectors
+CSS_SPACE_RE = re.compile(r'\s*([{};,>])\s*')
+
+
+def minify_css(text):
+    """Remove comments and unneeded whitespace from a stylesheet.
+
+    Only whitespace next to punctuation and runs of whitespace are touched,
+    and strings are left alone, so selectors and values mean the same as
+    before.
+    """
+    text = CSS_COMMENT_RE.sub('', text)
+    # Strings are every other part
+    parts = CSS_STRING_RE.split(text)
+    for i in range(0, len(parts), 2):
+        parts[i] = CSS_SPACE_RE.sub(r'\1', re.sub(r'\s+', ' ', parts[i]))
+    return ''.join(parts).replace(';}', '}').strip()
+
+
+def minify_js(text):
+    """Minify Javascript with rjsmin, if it's installed."""
+    if rjsmin is None:
+        return text
+    return rjsmin.jsmin(text)
+
+
+MINIFIERS = {
+    '.css': minify_css,
+    '.js': minify_js,
+}
+
+
+def compress(data):
+    """Return {file suffix: compressed data} for each encoding available
+    that makes data meaningfully smaller.
+    """
+    compressed = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressed['.br'] = brotli.compress(data)
+    return {suffix: content for suffix, content in compressed.items()
+            if len(content) < len(data) * MIN_COMPRESSION}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Manifest storage which also minifies and pre-compresses the hashed
+    files.
+
+    Without a manifest (collectstatic hasn't been run, e.g. in development
+    or tests) or a manifest entry, files are served under their plain names
+    rather than raising an error.
+    """
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super(CompressedManifestStaticFilesStorage,
+                         self).post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted(set(self.hashed_files.values())):
+            self.optimize(name)
+
+    def optimize(self, name):
+        """Minify a collected file in place and write compressed copies.
+        """
+        extension = re.search(r'(\.[^./]*)?$', name).group(0).lower()
+        minify = MINIFIERS.get(extension)
+        if minify is None and extension not in COMPRESSED_EXTENSIONS:
+            return
+
+        with self.open(name) as f:
+            data = f.read()
+        if minify is not None and not re.search(r'[.-]min\.', name):
+            try:
+                minified = minify(data.decode()).encode()
+            except UnicodeDecodeError:
+                minified = data
+            if minified != data:
+                data = minified
+                self.replace(name, data)
+
+        for suffix, content in compress(data).items():
+            self.replace(name + suffix, content)
+
+    def replace(self, name, content):
+        if self.exists(name):
+            self.delete(name)
+        self._save(name, ContentFile(content))
+
+    def stored_name(self, name):
+        try:
+            return super(CompressedManifestStaticFilesStorage,
+                         self).stored_name(name)
+        except ValueError:
+            # Not collected yet
+            return name
+
+    def is_hashed(self, name):
+        """Return whether name is the hashed name of a collected file, which
+        never changes.
+        """
+        return name in self.hashed_names()
+
+    def hashed_names(self):
+        if getattr(self, '_hashed_names_for', None) is not self.hashed_files:
+            self._hashed_names = set(self.hashed_files.values())
+            self._hashed_names_for = self.hashed_files
+        return self._hashed_names
@@ -13,13 +13,16 @@ Including another URLconf
     1. Import the include() function: from django.conf.urls import url, include
     2. Add a URL to urlpatterns:  url(r'^blog/', include('blog.urls'))
 """
+import re
+
 import debug_toolbar
+from django.conf import settings
 from django.urls import path
 from django.conf.urls import url, include
 from django.contrib.auth import views as auth_views
 from django.contrib import admin
 
-from .views import index
+from .views import index, static
 
 urlpatterns = [
     url(r'^$', index, name='index'),
@@ -29,3 +32,7 @@ urlpatterns = [
     url(r'^tracker/', include('tracker.urls')),
     path('debug/', include(debug_toolbar.urls)),
 ]
+
+if settings.SERVE_STATIC:
+    urlpatterns.append(url(r'^{}(?P<path>.+)$'.format(
+        re.escape(settings.STATIC_URL.lstrip('/'))), static, name='static'))
@@ -3,10 +3,122 @@ views.py
 
 Top-level views module for the site.
 """
+import mimetypes
+import os
 
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
 from django.shortcuts import render
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from .storage import ENCODINGS
+
+# Cache lifetime for files with hashed names, which never change
+HASHED_MAX_AGE = 365 * 24 * 60 * 60
+
+# Cache lifetime for anything else
+UNHASHED_MAX_AGE = 5 * 60
+
 
 def index(request):
     """Index view for the whole site.
     """
     return render(request, 'index.html')
+
+
+def accepted_encodings(header):
+    """Parse an Accept-Encoding header into a dict of content codings (in
+    lower case) to their q-values, leaving out the ones refused with q=0.
+
+    A '*' entry stands for any coding not otherwise listed. Codings with
+    a malformed q-value are left out.
+    """
+    accepted = {}
+    refused = set()
+    for item in header.split(','):
+        name, *params = [part.strip() for part in item.split(';')]
+        name = name.lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value.strip())
+                except ValueError:
+                    quality = 0.0
+        if 0 < quality <= 1:
+            accepted[name] = quality
+        else:
+            refused.add(name)
+    if '*' in accepted:
+        for name, suffix in ENCODINGS:
+            if name not in accepted and name not in refused:
+                accepted[name] = accepted['*']
+    return accepted
+
+
+def patch_static_headers(response, path, stat):
+    """Set the caching headers for a static file, on both full and 304
+    responses.
+    """
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    is_hashed = getattr(staticfiles_storage, 'is_hashed', None)
+    if is_hashed is not None and is_hashed(path):
+        patch_cache_control(response, public=True, max_age=HASHED_MAX_AGE,
+                            immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=UNHASHED_MAX_AGE)
+
+
+def static(request, path):
+    """Serve a collected static file, for when no web server in front of the
+    site does it (settings.SERVE_STATIC).
+
+    Sends the brotli or gzip compressed copy written by collectstatic (see
+    storage.py) if the browser accepts it, preferring the one with the
+    highest q-value in Accept-Encoding, and lets browsers cache files with
+    hashed names for a year without checking back.
+    """
+    try:
+        filename = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Not found.')
+    if not os.path.isfile(filename):
+        raise Http404('Not found.')
+
+    accepted = accepted_encodings(
+        request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    # Highest q-value first, then in our order of preference (sorted is
+    # stable)
+    candidates = sorted((item for item in ENCODINGS if item[0] in accepted),
+                        key=lambda item: -accepted[item[0]])
+    encoding = None
+    for name, suffix in candidates:
+        if os.path.isfile(filename + suffix):
+            encoding = name
+            filename += suffix
+            break
+
+    stat = os.stat(filename)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'),
+                              stat.st_mtime, stat.st_size):
+        response = HttpResponseNotModified()
+        patch_static_headers(response, path, stat)
+        return response
+
+    content_type, _ = mimetypes.guess_type(path)
+    response = FileResponse(open(filename, 'rb'),
+                            content_type=content_type or
+                            'application/octet-stream')
+    if encoding is not None:
+        response['Content-Encoding'] = encoding
+    patch_static_headers(response, path, stat)
+    return response
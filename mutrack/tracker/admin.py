@@ -1,6 +1,122 @@
 from django.contrib import admin
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from tracker.models import (Artist, Album, Job, PrimaryGenre, Listen,
+                            normalize_name, prefix_range)
+
+# Unfiltered tables estimated to have at least this many rows aren't counted
+ESTIMATED_COUNT_MIN = 10000
+
+
+def estimated_count(queryset):
+    """Return roughly how many rows an unfiltered queryset has, without
+    counting them, or None if it's filtered or there's no estimate.
+
+    Estimates come from PostgreSQL's table statistics, or with SQLite from
+    those ANALYZE writes to sqlite_stat1, falling back to the highest rowid
+    (an upper bound, from the end of the table's b-tree) if it hasn't been
+    run. Other databases' tables are counted.
+    """
+    query = queryset.query
+    if (query.where or query.distinct or query.low_mark
+            or query.high_mark is not None):
+        return None
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class '
+                           'WHERE oid = %s::regclass', [table])
+            row = cursor.fetchone()
+        # -1 or 0 until the table has been analyzed
+        if row is not None and row[0] > 0:
+            return int(row[0])
+        return None
+    if connection.vendor == 'sqlite':
+        return sqlite_estimated_count(connection, table)
+    return None
+
+
+def sqlite_estimated_count(connection, table):
+    """Return the number of rows in an SQLite table as of the last ANALYZE,
+    or if it's never been analyzed, its highest rowid. None if it's empty.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master "
+                       "WHERE type = 'table' AND name = 'sqlite_stat1'")
+        row = None
+        if cursor.fetchone() is not None:
+            # The row count comes first, followed by index statistics
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s',
+                           [table])
+            row = cursor.fetchone()
+        if row is not None:
+            rows = int(row[0].split()[0])
+        else:
+            cursor.execute('SELECT MAX(rowid) FROM {}'.format(
+                connection.ops.quote_name(table)))
+            rows = cursor.fetchone()[0]
+    return rows or None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator for the change lists of large tables, which estimates the
+    number of rows when nothing is filtered rather than counting them all.
+
+    If the estimate is too high, the count is corrected when a page turns
+    out to be the last one, or counted exactly when it's past the end. If
+    it's too low (e.g. statistics from before rows were added), it's
+    counted exactly when a page past the estimated end is asked for.
+    """
+    estimated = False
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if estimate is not None and estimate >= ESTIMATED_COUNT_MIN:
+            self.estimated = True
+            return estimate
+        return super(EstimatedCountPaginator, self).count
+
+    def count_exactly(self, count=None):
+        """Replace the estimate with the given or counted number of rows."""
+        self.estimated = False
+        self.__dict__.pop('num_pages', None)
+        if count is None:
+            count = super(EstimatedCountPaginator, self).count
+        self.count = count
+
+    def validate_number(self, number):
+        try:
+            return super(EstimatedCountPaginator, self).validate_number(
+                number)
+        except EmptyPage:
+            if not self.estimated:
+                raise
+        # Past the estimated end, but there may be more rows than estimated
+        self.count_exactly()
+        return super(EstimatedCountPaginator, self).validate_number(number)
+
+    def page(self, number):
+        page = super(EstimatedCountPaginator, self).page(number)
+        if not self.estimated:
+            return page
+        bottom = (page.number - 1) * self.per_page
+        rows = len(page.object_list)
+        if rows >= min(self.per_page, self.count - bottom):
+            return page
+
+        # Fewer rows than the estimate says there are
+        if rows:
+            # Ending on this page
+            self.count_exactly(bottom + rows)
+            return page
+        self.count_exactly()
+        return super(EstimatedCountPaginator, self).page(number)
 
-from tracker.models import Artist, Album, PrimaryGenre, Listen
 
 # Register your models here.
 admin.site.register(Artist)
@@ -9,7 +125,36 @@ admin.site.register(PrimaryGenre)
 
 class AlbumAdmin(admin.ModelAdmin):
     list_display = ['name', 'artist_name', 'year', 'rating']
+    list_select_related = ['artist']
+    # Searched by get_search_results, but needed for the search box and
+    # album autocomplete
     search_fields = ['name', 'artist__name']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # With artists for the albums' labels in autocomplete too
+        return super(AlbumAdmin, self).get_queryset(request).select_related(
+            'artist')
+
+    def get_search_results(self, request, queryset, search_term):
+        """Find albums as the admin normally does, where each word of the
+        search term appears somewhere in the album or artist name, plus
+        those whose name or whose artist's name starts with the whole term.
+
+        The prefix matches come from the name key indexes, and ignore case
+        for any letters rather than just ASCII ones as SQLite's LIKE does.
+        """
+        results, may_have_duplicates = super(
+            AlbumAdmin, self).get_search_results(request, queryset,
+                                                 search_term)
+        key = normalize_name(search_term.strip())
+        if not key:
+            return results, may_have_duplicates
+        artists = Artist.objects.filter(**prefix_range('name_key', key))
+        prefixed = queryset.filter(Q(**prefix_range('name_key', key))
+                                   | Q(artist__in=artists))
+        return results | prefixed, may_have_duplicates
 
 
 admin.site.register(Album, AlbumAdmin)
@@ -17,5 +162,18 @@ admin.site.register(Album, AlbumAdmin)
 
 class ListenAdmin(admin.ModelAdmin):
     list_display = ['listen_date', 'artist_name', 'album_name']
+    list_select_related = ['album__artist']
+    # Drilled down from the listen_date index--see ListenQuerySet
+    date_hierarchy = 'listen_date'
+    autocomplete_fields = ['album']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 admin.site.register(Listen, ListenAdmin)
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['task', 'object_id', 'requests', 'attempts', 'created']
+    list_filter = ['task']
+
+admin.site.register(Job, JobAdmin)
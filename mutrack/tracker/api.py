@@ -0,0 +1,293 @@
+"""
+api.py
+
+Functions building the JSON data served by the tracker's API views, and
+the album table data embedded in the index page.
+
+The album table is served in pages using keyset pagination: each page ends
+with a cursor holding the sort key of its last album, and the next page
+starts right after that key. Fetching a deep page is then an indexed range
+query rather than an ever-growing OFFSET.
+"""
+import base64
+import binascii
+import datetime
+import json
+import re
+
+from django.db.models import Q
+from django.urls import reverse
+
+from .filters import COLUMNS, filter_albums
+from .genres import DEFAULT_FACET_COUNT, genre_facets
+from .models import Album
+from . import recommendations, search
+
+# Same as Album.Meta.ordering, which the album_ordering_idx index matches
+ALBUM_TABLE_ORDERING = ('-rating', 'sort_artist_name', 'name')
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+MAX_FACET_COUNT = 200
+
+DEFAULT_AUTOCOMPLETE_SIZE = 10
+MAX_AUTOCOMPLETE_SIZE = 50
+
+# Stand-ins for the quoted names in the URL templates sent with the album
+# table payload
+ARTIST_PLACEHOLDER = 'ARTIST_NAME'
+ALBUM_PLACEHOLDER = 'ALBUM_NAME'
+
+EPOCH = datetime.date(1970, 1, 1)
+
+# Separates the artist from the album in an autocomplete query, as in the
+# labels from Album.label
+AUTOCOMPLETE_SEPARATOR = re.compile(r'\s+[-\u2013\u2014]\s*')
+
+
+class InvalidParameter(ValueError):
+    """Raised when a query parameter for the API can't be used."""
+
+
+def encode_cursor(album):
+    """Get the cursor pointing just after the given album.
+    """
+    key = [album.rating, album.sort_artist_name, album.name]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Get (rating, artist name, album name) back out of a cursor.
+    """
+    try:
+        rating, artist_name, name = json.loads(
+            base64.urlsafe_b64decode(cursor.encode()))
+        return float(rating), str(artist_name), str(name)
+    except (binascii.Error, TypeError, ValueError):
+        raise InvalidParameter('Invalid cursor.')
+
+
+def after_cursor(cursor):
+    """Get a Q object selecting albums sorted after the cursor.
+    """
+    rating, artist_name, name = decode_cursor(cursor)
+    # The redundant rating__lte lets the database seek to the cursor in the
+    # ordering index, rather than scan it from the start
+    return Q(rating__lte=rating) & (
+        Q(rating__lt=rating)
+        | Q(rating=rating, sort_artist_name__gt=artist_name)
+        | Q(rating=rating, sort_artist_name=artist_name, name__gt=name))
+
+
+def page_size(params, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Get the requested page size from params, within sensible limits.
+    """
+    try:
+        size = int(params.get('limit', default))
+    except ValueError:
+        raise InvalidParameter('limit must be a number.')
+    return max(1, min(size, maximum))
+
+
+def album_row(album):
+    """Get the data for one row of the album table.
+
+    album should come from AlbumQuerySet.for_table, so this doesn't query the
+    database.
+    """
+    artist_name = album.artist.quoted_name()
+    album_name = album.quoted_name()
+    if album.last_listen_date is not None:
+        last_listen = album.last_listen_date.isoformat()
+    else:
+        last_listen = None
+
+    return {
+        'id': album.pk,
+        'artist': album.artist.name,
+        'album': album.name,
+        'year': album.year,
+        'rating': album.rating,
+        'genres': album.secondary_genres,
+        'comments': album.comments,
+        'plays': album.play_count,
+        'last_listen': last_listen,
+        'last_listen_label': album.last_listen_date_mdy(),
+        'url': reverse('tracker:album', args=[artist_name, album_name]),
+        'artist_url': reverse('tracker:artist', args=[artist_name]),
+        'add_listen_url': reverse('tracker:listen-create-for-album',
+                                  args=[artist_name, album_name]),
+    }
+
+
+def album_table_payload(albums):
+    """Get the album table for the index page as compact columnar data.
+
+    albums is a queryset of albums in table order. Rather than a row per
+    album, there is a list per column: numbers stay numbers, artists are
+    listed once and referred to by index, genres and comments are indexes
+    into a list of unique strings, and the last listen date is a day number
+    (days since 1970-01-01). URLs are built in the browser from templates
+    with the placeholder names in, quoted as Artist.quoted_name and
+    Album.quoted_name do (see script.js).
+    """
+    rows = (albums.prefetch_related(None).values_list(
+        'pk', 'artist_id', 'artist__name', 'name', 'year', 'rating',
+        'play_count', 'last_listen_date', 'secondary_genres', 'comments'))
+
+    artists = {'id': [], 'name': []}
+    artist_index = {}
+    strings = []
+    string_index = {}
+    columns = {name: [] for name in (
+        'id', 'artist', 'name', 'year', 'rating', 'plays', 'last_listen',
+        'genres', 'comments')}
+
+    def string_id(text):
+        if text not in string_index:
+            string_index[text] = len(strings)
+            strings.append(text)
+        return string_index[text]
+
+    for (album_id, artist_id, artist_name, name, year, rating, plays,
+         last_listen, genres, comments) in rows.iterator():
+        if artist_id not in artist_index:
+            artist_index[artist_id] = len(artists['id'])
+            artists['id'].append(artist_id)
+            artists['name'].append(artist_name)
+        columns['id'].append(album_id)
+        columns['artist'].append(artist_index[artist_id])
+        columns['name'].append(name)
+        columns['year'].append(year)
+        columns['rating'].append(rating)
+        columns['plays'].append(plays)
+        columns['last_listen'].append(
+            None if last_listen is None else (last_listen - EPOCH).days)
+        columns['genres'].append(string_id(genres))
+        columns['comments'].append(string_id(comments))
+
+    names = [ARTIST_PLACEHOLDER, ALBUM_PLACEHOLDER]
+    return {
+        'urls': {
+            'artist': reverse('tracker:artist', args=names[:1]),
+            'album': reverse('tracker:album', args=names),
+            'add_listen': reverse('tracker:listen-create-for-album',
+                                  args=names),
+        },
+        'strings': strings,
+        'artists': artists,
+        'albums': columns,
+    }
+
+
+def album_table_page(params):
+    """Get one page of the album table.
+
+    params is a mapping (like request.GET) which may hold the column filters
+    from filters.py, a page size as 'limit', and the 'after' cursor returned
+    with the previous page. The returned 'next' cursor is None on the last
+    page.
+    """
+    size = page_size(params)
+    albums = filter_albums(Album.objects.for_table(), params)
+    if params.get('after'):
+        albums = albums.filter(after_cursor(params['after']))
+
+    # Fetch one extra album to find out if there's another page
+    albums = list(albums.order_by(*ALBUM_TABLE_ORDERING)[:size + 1])
+    if len(albums) > size:
+        albums = albums[:size]
+        next_cursor = encode_cursor(albums[-1])
+    else:
+        next_cursor = None
+
+    return {
+        'albums': [album_row(album) for album in albums],
+        'next': next_cursor,
+    }
+
+
+def recommendation_results(params):
+    """Get the best albums to listen to next (see recommendations.py).
+
+    params may hold weights for the parts of the score, named as in
+    recommendations.COMPONENTS, and the number of albums as 'limit'.
+    """
+    limit = page_size(params, recommendations.DEFAULT_LIMIT,
+                      recommendations.MAX_LIMIT)
+    try:
+        weights = recommendations.parse_weights(params)
+    except ValueError:
+        raise InvalidParameter('Weights must be finite numbers.')
+
+    results = []
+    for album, score, components in recommendations.recommendations(
+            weights, limit):
+        row = album_row(album)
+        row.update(score=score, components=components)
+        results.append(row)
+    return {'weights': weights, 'results': results}
+
+
+def search_results(params):
+    """Get search results for the query in params['q'].
+
+    Results are artists and albums, best match first; see search.py.
+    """
+    limit = page_size(params, search.DEFAULT_LIMIT, search.MAX_LIMIT)
+    query = params.get('q', '')
+    return {'query': query, 'results': search.search(query, limit)}
+
+
+def album_autocomplete(params):
+    """Get albums matching the partly typed label in params['q'].
+
+    'Artist - Album' (with a hyphen or dash) matches artist and album name
+    prefixes together. Anything else matches either name's prefix. Each
+    case is answered from the name key indexes, so this stays fast however
+    many albums there are.
+    """
+    size = page_size(params, DEFAULT_AUTOCOMPLETE_SIZE, MAX_AUTOCOMPLETE_SIZE)
+    query = params.get('q', '').strip()
+    if not query:
+        return {'results': []}
+
+    albums = Album.objects.select_related('artist').order_by(
+        'artist__name_key', 'name_key')
+    parts = AUTOCOMPLETE_SEPARATOR.split(query, maxsplit=1)
+    if len(parts) == 2:
+        matches = list(albums.with_name_prefix(*parts)[:size])
+    else:
+        # Two queries rather than an OR, so each can use its own index
+        matches = {album.pk: album for album in
+                   albums.with_name_prefix(artist_prefix=query)[:size]}
+        matches.update((album.pk, album) for album in
+                       albums.with_name_prefix(album_prefix=query)[:size])
+        matches = sorted(matches.values(),
+                         key=lambda album: (album.artist.name_key,
+                                            album.name_key))[:size]
+
+    return {'results': [
+        {'id': album.pk, 'label': album.label(), 'artist': album.artist.name,
+         'album': album.name, 'year': album.year}
+        for album in matches]}
+
+
+def genre_facet_counts(params):
+    """Get the number of albums with each genre tag and primary genre.
+
+    params may hold column filters as for the album table, to count only
+    the albums shown, and the number of tags to return as 'limit'.
+    """
+    count = page_size(params, DEFAULT_FACET_COUNT, MAX_FACET_COUNT)
+    albums = None
+    if any(params.get(column, '').strip() for column in COLUMNS):
+        albums = filter_albums(Album.objects.all(), params)
+    facets = genre_facets(albums, count)
+    return {
+        'tags': [{'name': name, 'albums': total}
+                 for name, total in facets['tags']],
+        'primary': [{'name': name, 'albums': total}
+                    for name, total in facets['primary']],
+    }
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class TrackerConfig(AppConfig):
     name = 'tracker'
+
+    def ready(self):
+        # Connect signal receivers
+        from . import signals
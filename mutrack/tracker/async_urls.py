@@ -0,0 +1,29 @@
+"""
+URLs for the tracker application under ASGI: the same as urls.py, with the
+read-only views swapped for their async versions (see async_views.py).
+"""
+from django.conf.urls import url
+
+from . import async_views, urls
+
+app_name = urls.app_name
+
+# Maps URL name -> async view
+ASYNC_VIEWS = {
+    'index': async_views.index,
+    'api-albums': async_views.album_table_data,
+    'api-genres': async_views.genre_facets,
+    'api-search': async_views.search,
+    'api-recommendations': async_views.recommendation_data,
+    'stats': async_views.stats,
+    'recommendations': async_views.recommendations,
+    'artist': async_views.artist,
+    'album': async_views.album,
+    'album-listens': async_views.listen_history,
+}
+
+urlpatterns = [
+    url(str(pattern.pattern), ASYNC_VIEWS[pattern.name], name=pattern.name)
+    if pattern.name in ASYNC_VIEWS else pattern
+    for pattern in urls.urlpatterns
+]
@@ -0,0 +1,154 @@
+"""
+async_views.py
+
+Async versions of the tracker's read-only views, served under ASGI (see
+mutrack/asgi.py and mutrack/async_urls.py).
+
+Django's ORM is synchronous, so the views do their database work on a
+dedicated thread pool through database_sync_to_async. The event loop stays
+free meanwhile, and requests run side by side instead of queuing for the one
+thread Django runs sync views on under ASGI.
+"""
+import asyncio
+import contextlib
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import close_old_connections, connection, connections
+from django.http import HttpResponseNotAllowed, JsonResponse
+
+from . import views
+from .api import (InvalidParameter, album_table_page, genre_facet_counts,
+                  recommendation_results, search_results)
+from .middleware import current_timing
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the database thread pool, sized by
+    settings.TRACKER_ASYNC_THREADS.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(settings.TRACKER_ASYNC_THREADS,
+                                           thread_name_prefix='tracker-db')
+        return _executor
+
+
+def close_thread_connections(executor, threads):
+    """Close the database connections held by each of an executor's threads.
+    """
+    barrier = threading.Barrier(threads)
+
+    def close():
+        # Wait so that each thread runs exactly one of these
+        barrier.wait()
+        connections.close_all()
+    for future in [executor.submit(close) for _ in range(threads)]:
+        future.result()
+
+
+def shutdown_executor():
+    """Close the database thread pool and its threads' connections.
+
+    A new pool is started by the next database_sync_to_async call.
+    """
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        close_thread_connections(executor, executor._max_workers)
+        executor.shutdown()
+
+
+def run_with_connection(func, *args, **kwargs):
+    """Call func, treating the call like a request for the thread's database
+    connection.
+
+    Connections are kept between calls up to CONN_MAX_AGE, as with sync
+    requests, and queries count towards the request's timings if
+    TimingMiddleware is on.
+    """
+    close_old_connections()
+    timing = current_timing.get()
+    try:
+        with (connection.execute_wrapper(timing.database_wrapper)
+              if timing is not None else contextlib.nullcontext()):
+            return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def database_sync_to_async(func):
+    """Turn a function using the database into a coroutine function running
+    it on the database thread pool.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        # Copied so the thread sees context variables such as current_timing
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            get_executor(), functools.partial(
+                context.run, run_with_connection, func, *args, **kwargs))
+    return wrapper
+
+
+def async_view(view):
+    """Return an async version of a sync view, running it on the database
+    thread pool.
+
+    Template responses are rendered there too, as templates can run queries.
+    """
+    @database_sync_to_async
+    def get_response(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    async def wrapper(request, *args, **kwargs):
+        return await get_response(request, *args, **kwargs)
+    functools.update_wrapper(wrapper, view)
+    return wrapper
+
+
+def json_view(get_data):
+    """Return an async view serving get_data(request.GET) as JSON to logged
+    in users, like the sync JSON views.
+    """
+    @database_sync_to_async
+    def get_user_data(request):
+        if not request.user.is_authenticated:
+            raise PermissionDenied
+        return get_data(request.GET)
+
+    async def view(request):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        try:
+            data = await get_user_data(request)
+        except InvalidParameter as err:
+            return JsonResponse({'error': str(err)}, status=400)
+        return JsonResponse(data)
+    view.__name__ = get_data.__name__
+    return view
+
+
+index = async_view(views.IndexView.as_view())
+album = async_view(views.AlbumView.as_view())
+artist = async_view(views.ArtistView.as_view())
+stats = async_view(views.StatsView.as_view())
+listen_history = async_view(views.ListenHistoryView.as_view())
+recommendations = async_view(views.RecommendationsView.as_view())
+
+album_table_data = json_view(album_table_page)
+genre_facets = json_view(genre_facet_counts)
+search = json_view(search_results)
+recommendation_data = json_view(recommendation_results)
@@ -0,0 +1,235 @@
+"""
+benchmarks.py
+
+Benchmarks for the tracker's views and Album helper methods.
+
+Each benchmark is timed over several runs, with its query count and peak
+memory recorded from a separate run (tracemalloc slows things down). Results
+are plain dicts, saved as JSON by the benchmark management command so runs
+from different versions can be compared.
+"""
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import django
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+
+from .models import Album, Artist
+
+# Maps size name -> (artists, albums, listens) for synthetic.generate_library
+LIBRARY_SIZES = {
+    'tiny': (10, 40, 200),
+    'small': (50, 250, 2500),
+    'medium': (250, 2500, 25000),
+    'large': (1000, 10000, 100000),
+}
+
+# Relative slowdown in median time counted as a regression by
+# compare_results
+DEFAULT_THRESHOLD = 0.2
+
+# Slowdowns smaller than this are timing noise, whatever the threshold
+MIN_REGRESSION_MS = 1.0
+
+
+class Benchmark:
+    """A named operation to time.
+
+    setup, if given, runs before every call of func and isn't timed.
+    """
+    def __init__(self, name, func, setup=None):
+        self.name = name
+        self.func = func
+        self.setup = setup
+
+    def call(self):
+        if self.setup is not None:
+            self.setup()
+        start = time.perf_counter()
+        self.func()
+        return time.perf_counter() - start
+
+    def run(self, repeat):
+        """Run the benchmark, returning a dict of results.
+        """
+        # Warm up
+        self.call()
+        times = [self.call() for _ in range(repeat)]
+
+        # Counted with a wrapper rather than CaptureQueriesContext, as the
+        # query log is reset at the start of each request
+        queries = []
+        if self.setup is not None:
+            self.setup()
+        with connection.execute_wrapper(
+                lambda execute, sql, *args: queries.append(sql)
+                or execute(sql, *args)):
+            self.func()
+
+        if self.setup is not None:
+            self.setup()
+        tracemalloc.start()
+        try:
+            self.func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'median_ms': statistics.median(times) * 1000,
+            'min_ms': min(times) * 1000,
+            'max_ms': max(times) * 1000,
+            'queries': len(queries),
+            'peak_kib': peak / 1024,
+        }
+
+
+def get_view(client, url, params=None):
+    """Return a function requesting url, checking the response is OK."""
+    def func():
+        response = client.get(url, params or {})
+        if response.status_code != 200:
+            raise RuntimeError('{} returned {}'.format(
+                url, response.status_code))
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+    return func
+
+
+def library_benchmarks(client):
+    """Return the benchmarks for the library in the database.
+
+    Detail pages use the most played album and the artist with the most
+    albums, the worst cases for those pages.
+    """
+    album = Album.objects.select_related('artist').order_by(
+        '-play_count').first()
+    artist = Artist.objects.annotate(
+        num_albums=Count('album')).order_by('-num_albums').first()
+    album_args = [album.artist.quoted_name(), album.quoted_name()]
+
+    api_url = reverse('tracker:api-albums')
+    deep_cursor = None
+    page = client.get(api_url, {'limit': 100}).json()
+    for _ in range(5):
+        if page['next'] is None:
+            break
+        deep_cursor = page['next']
+        page = client.get(api_url, {'limit': 100, 'after': deep_cursor}).json()
+
+    index_url = reverse('tracker:index')
+    benchmarks = [
+        Benchmark('view:index', get_view(client, index_url),
+                  setup=cache.clear),
+        Benchmark('view:index-cached', get_view(client, index_url)),
+        Benchmark('view:index-filtered',
+                  get_view(client, index_url,
+                           {'genres': 'rock | jazz, !post', 'year': '>1990'}),
+                  setup=cache.clear),
+        Benchmark('view:api-albums', get_view(client, api_url,
+                                              {'limit': 100})),
+        Benchmark('view:album',
+                  get_view(client, reverse('tracker:album', args=album_args)),
+                  setup=cache.clear),
+        Benchmark('view:artist',
+                  get_view(client, reverse('tracker:artist',
+                                           args=[artist.quoted_name()])),
+                  setup=cache.clear),
+        Benchmark('view:album-autocomplete',
+                  get_view(client, reverse('tracker:api-album-autocomplete'),
+                           {'q': 'synthetic 0 artist 00'})),
+        Benchmark('view:search',
+                  get_view(client, reverse('tracker:api-search'),
+                           {'q': 'synthetic art'})),
+        Benchmark('view:stats', get_view(client, reverse('tracker:stats')),
+                  setup=cache.clear),
+        Benchmark('view:listen-create',
+                  get_view(client, reverse('tracker:listen-create'))),
+        Benchmark('view:listen-create-for-album',
+                  get_view(client, reverse('tracker:listen-create-for-album',
+                                           args=album_args))),
+    ]
+    if deep_cursor is not None:
+        benchmarks.append(Benchmark(
+            'view:api-albums-deep',
+            get_view(client, api_url, {'limit': 100, 'after': deep_cursor})))
+
+    def forget_recent_listens():
+        album.__dict__.pop('_recent_listens', None)
+
+    for method in ('number_of_plays', 'last_listen', 'last_listen_date_mdy',
+                   'last_five_listens_label'):
+        benchmarks.append(Benchmark('model:Album.' + method,
+                                    getattr(album, method),
+                                    setup=forget_recent_listens))
+    return benchmarks
+
+
+def run_benchmarks(repeat=5, names=None):
+    """Run the benchmarks against the library in the database.
+
+    names optionally restricts which benchmarks run. Returns a dict mapping
+    benchmark name to results.
+    """
+    user, _ = User.objects.get_or_create(username='benchmark')
+    client = Client()
+    client.force_login(user)
+
+    results = {}
+    for benchmark in library_benchmarks(client):
+        if names and benchmark.name not in names:
+            continue
+        results[benchmark.name] = benchmark.run(repeat)
+    return results
+
+
+def environment():
+    """Describe where the benchmarks ran, to store with the results."""
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        'revision': revision,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'platform': platform.platform(),
+    }
+
+
+def compare_results(old, new, threshold=DEFAULT_THRESHOLD):
+    """Compare two sets of saved results.
+
+    Returns a list of messages, one per benchmark which got slower by more
+    than threshold (as a fraction of the old median) or ran more queries.
+    Slowdowns under MIN_REGRESSION_MS are ignored.
+    """
+    regressions = []
+    for size, size_results in new['sizes'].items():
+        old_results = old.get('sizes', {}).get(size, {}).get('results', {})
+        for name, result in size_results['results'].items():
+            if name not in old_results:
+                continue
+            before = old_results[name]
+            slowdown = result['median_ms'] - before['median_ms']
+            if (slowdown > before['median_ms'] * threshold
+                    and slowdown >= MIN_REGRESSION_MS):
+                regressions.append(
+                    '{} [{}]: median {:.1f}ms -> {:.1f}ms'.format(
+                        name, size, before['median_ms'], result['median_ms']))
+            if result['queries'] > before['queries']:
+                regressions.append('{} [{}]: queries {} -> {}'.format(
+                    name, size, before['queries'], result['queries']))
+    return regressions
@@ -0,0 +1,111 @@
+"""
+caching.py
+
+Tracks a version number for the tracker's data, used to cache rendered pages.
+
+The version is the time of the last change to an Album, Artist, Listen or
+PrimaryGenre in nanoseconds, and is kept in the default cache. It is bumped
+by the receivers in signals.py, so anything cached under the current version
+is known to be up to date. With more than one server process, the cache
+needs to be shared between them (e.g. file-based) for this to work.
+
+A second version, the source version, is only bumped by changes to those
+models and by the background jobs updating what's worked out from them in
+memory (see jobs.SOURCE_TASKS), not by the other jobs. Data kept in memory,
+like the recommender's arrays, is checked against it, so those other jobs
+finishing don't make it stale.
+
+The search version is bumped by the in-memory search index (see search.py)
+as artists and albums change, so other processes know to reread theirs.
+"""
+import functools
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+DATA_VERSION_KEY = 'tracker:data-version'
+SOURCE_VERSION_KEY = 'tracker:source-version'
+SEARCH_VERSION_KEY = 'tracker:search-version'
+
+
+def get_version(key):
+    """Return the current version stored under key.
+
+    If the cache has lost it (e.g. after a restart), the current time is used,
+    which makes anything cached under an older version stale.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def data_version():
+    """Return the current data version."""
+    return get_version(DATA_VERSION_KEY)
+
+
+def source_version():
+    """Return the current source version, of the models' data alone."""
+    return get_version(SOURCE_VERSION_KEY)
+
+
+def search_version():
+    """Return the current search version."""
+    return get_version(SEARCH_VERSION_KEY)
+
+
+def data_last_modified():
+    """Return the time of the last change to tracker data, in seconds since
+    the epoch.
+    """
+    return data_version() // 1000000000
+
+
+def bump_version(key):
+    """Set a new version under key, and return the previous and new versions.
+    """
+    previous = cache.get(key, 0)
+    version = max(time.time_ns(), previous + 1)
+    cache.set(key, version, timeout=None)
+    return previous, version
+
+
+def bump_data_version(keys=(DATA_VERSION_KEY, SOURCE_VERSION_KEY)):
+    """Set new versions, marking everything cached so far as stale.
+
+    Returns a dict mapping each key to its previous and new versions.
+    """
+    return {key: bump_version(key) for key in keys}
+
+
+def data_changed(committed=None):
+    """Record that tracker data changed.
+
+    The version is bumped straight away, and again once the transaction
+    commits, so that a page rendered from the old data while the transaction
+    was open can't be cached under the final version.
+
+    If given, committed is called after the second bump with what
+    bump_data_version returned for each, so data kept up to date in memory
+    can tell whether the versions it would adopt include changes of anyone
+    else's.
+    """
+    changed = bump_data_version()
+
+    def bump():
+        versions = bump_data_version()
+        if committed is not None:
+            committed(changed, versions)
+    transaction.on_commit(bump)
+
+
+def derived_data_changed():
+    """Record that data derived from the tracker data changed, bumping the
+    data version (as data_changed does) but not the source version.
+    """
+    bump = functools.partial(bump_data_version, (DATA_VERSION_KEY,))
+    bump()
+    transaction.on_commit(bump)
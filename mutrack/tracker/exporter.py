@@ -0,0 +1,126 @@
+"""
+exporter.py
+
+Streaming export of the whole library.
+
+Exports are generated a chunk of rows at a time, so memory use stays flat
+whatever the size of the library. Formats:
+
+- jsonl: genres, artists, albums and listens as serialized objects, one per
+  line, using natural keys. Load back with `manage.py loaddata <file>.jsonl`.
+- json: the same objects as a single JSON array, as dumpdata would write.
+- csv: the listen history, one row per listen. Load back with
+  `manage.py import_listens --create-missing <file>.csv`.
+"""
+import csv
+import io
+import json
+
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Album, Artist, Listen, PrimaryGenre
+
+# Maps export format -> content type
+EXPORT_FORMATS = {
+    'jsonl': 'application/x-ndjson',
+    'json': 'application/json',
+    'csv': 'text/csv',
+}
+
+CSV_COLUMNS = ('artist', 'album', 'year', 'rating', 'date')
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+def library_querysets():
+    """Return querysets for everything in the library, in loading order.
+    """
+    return [
+        PrimaryGenre.objects.order_by('pk'),
+        Artist.objects.order_by('pk'),
+        Album.objects.select_related('artist')
+        .prefetch_related('primary_genres').order_by('pk'),
+        Listen.objects.select_related('album__artist').order_by('pk'),
+    ]
+
+
+def iter_chunks(queryset, chunk_size):
+    """Yield lists of up to chunk_size objects from a queryset ordered by pk.
+
+    Each chunk is a separate query starting after the last primary key of the
+    previous one. Unlike QuerySet.iterator, this keeps prefetch_related
+    working.
+    """
+    last_pk = None
+    while True:
+        chunk_queryset = queryset
+        if last_pk is not None:
+            chunk_queryset = queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk_queryset[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def library_records(chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield every object in the library as a serialized dict.
+    """
+    for queryset in library_querysets():
+        for chunk in iter_chunks(queryset, chunk_size):
+            yield from serializers.serialize(
+                'python', chunk, use_natural_foreign_keys=True,
+                use_natural_primary_keys=True)
+
+
+def dump_record(record):
+    return json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False)
+
+
+def jsonl_export(chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the library in JSON Lines format, a line at a time.
+    """
+    for record in library_records(chunk_size):
+        yield dump_record(record) + '\n'
+
+
+def json_export(chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the library as a JSON array, an object at a time.
+    """
+    separator = '[\n'
+    for record in library_records(chunk_size):
+        yield separator + dump_record(record)
+        separator = ',\n'
+    yield '[]\n' if separator == '[\n' else '\n]\n'
+
+
+def csv_export(chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the listen history as CSV, a row at a time.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def row(values):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(values)
+        return buffer.getvalue()
+
+    yield row(CSV_COLUMNS)
+    listens = (Listen.objects.order_by('pk')
+               .values_list('album__artist__name', 'album__name',
+                            'album__year', 'album__rating', 'listen_date'))
+    for artist, album, year, rating, listen_date in listens.iterator(
+            chunk_size=chunk_size):
+        yield row([artist, album, year, rating,
+                   listen_date.isoformat() if listen_date else ''])
+
+
+def export_library(export_format, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Return a generator of text chunks exporting the library in the given
+    format (a key of EXPORT_FORMATS).
+    """
+    exporters = {'jsonl': jsonl_export, 'json': json_export,
+                 'csv': csv_export}
+    return exporters[export_format](chunk_size)
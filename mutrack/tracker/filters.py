@@ -0,0 +1,234 @@
+"""
+filters.py
+
+Server-side version of the album table filter language in script.js.
+
+Each column of the index table can be filtered with a short expression:
+
+- ',' separates conditions which must all match (logical and)
+- '|' separates conditions of which any may match (logical or)
+- a condition starting with '!' matches cells *not* containing the text
+- any other condition does case-insensitive substring matching
+
+For numeric and date columns, a condition starting with one of the operators
+<, >, <=, >= or = compares the cell value with the number or date following
+the operator instead. An operator with nothing after it matches everything.
+
+Filters are compiled into Q objects on Album's fields, including its stored
+play count and last listen date, so the database does the filtering. Genre
+conditions match against the album's genre tags (see genres.py) rather than
+the text of every album, which gives the same results since a condition
+can't contain the comma separating tags.
+"""
+import datetime
+import functools
+import math
+import operator
+import re
+
+from django.db.models import Case, CharField, Q, Value, When
+from django.db.models.functions import (Cast, Concat, ExtractDay,
+                                        ExtractMonth, ExtractYear, LPad, Mod)
+
+from .genres import normalize_tag
+from .models import AlbumGenreTag, GenreTag
+
+TEXT = 'text'
+NUMBER = 'number'
+DATE = 'date'
+TAGS = 'tags'
+
+# Maps query parameter name -> (field to compare, field holding the text
+# shown in the table cell, column type)
+COLUMNS = {
+    'artist': ('artist__name', 'artist__name', TEXT),
+    'album': ('name', 'name', TEXT),
+    'year': ('year', 'year_text', NUMBER),
+    'rating': ('rating', 'rating_text', NUMBER),
+    'genres': ('genre_tags', 'secondary_genres', TAGS),
+    'plays': ('play_count', 'plays_text', NUMBER),
+    'last_listen': ('last_listen_date', 'last_listen_text', DATE),
+}
+
+# Longer operators first so '<=' isn't read as '<'
+OPERATORS = ('<=', '>=', '<', '>', '=')
+LOOKUPS = {'<=': 'lte', '>=': 'gte', '<': 'lt', '>': 'gt', '=': 'exact'}
+
+# Matches nothing; used for comparisons against something that isn't a number
+NOTHING = Q(pk__in=[])
+
+
+def split_filter(text):
+    """Split filter text into a list of 'and' groups of 'or' conditions.
+
+    E.g.: 'a | b, !c' --> [['a', 'b'], ['!c']]
+    """
+    return [[condition.strip() for condition in group.strip().split('|')]
+            for group in text.strip().split(',')]
+
+
+def parse_number(text):
+    """Convert text to a float the way Javascript's Number() does.
+
+    Returns NaN if the text isn't a valid number; empty text is zero.
+    """
+    text = text.strip()
+    if not text:
+        return 0.0
+    if text in ('Infinity', '+Infinity', '-Infinity'):
+        return float(text.replace('Infinity', 'inf'))
+    if re.fullmatch(r'0[xX][0-9a-fA-F]+|0[oO][0-7]+|0[bB][01]+', text):
+        return float(int(text, 0))
+    if re.fullmatch(r'[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?', text):
+        return float(text)
+    return math.nan
+
+
+def parse_date(text):
+    """Parse a date typed into the last listen filter.
+
+    Accepts YYYY/MM/DD, YYYY-MM-DD, M/D/YYYY, M/D/YY (years below 50 are
+    taken as 20YY, like Javascript's Date does) and YYYY. Returns None if the
+    text isn't a valid date.
+    """
+    text = text.strip()
+    match = re.fullmatch(r'(\d{4})[/-](\d{1,2})[/-](\d{1,2})', text)
+    if match:
+        year, month, day = (int(x) for x in match.groups())
+    else:
+        match = re.fullmatch(r'(\d{1,2})/(\d{1,2})/(\d{2}|\d{4})', text)
+        if match:
+            month, day, year = (int(x) for x in match.groups())
+            if len(match.group(3)) == 2:
+                year += 2000 if year < 50 else 1900
+        elif re.fullmatch(r'\d{4}', text):
+            year, month, day = int(text), 1, 1
+        else:
+            return None
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+
+def text_condition(text_field, condition):
+    """Get a Q object for a substring ('abc') or negated ('!abc') condition.
+    """
+    if condition.startswith('!'):
+        return ~Q(**{text_field + '__icontains': condition[1:]})
+    return Q(**{text_field + '__icontains': condition})
+
+
+def tag_condition(condition):
+    """Get a Q object for a substring or negated condition on genre tags.
+
+    Matching tags are looked up in the tag table, and albums by tag through
+    the AlbumGenreTag index, so and/or/not become set operations on album
+    ids.
+    """
+    negate = condition.startswith('!')
+    if negate:
+        condition = condition[1:]
+    tags = GenreTag.objects.filter(name__contains=normalize_tag(condition))
+    q = Q(pk__in=AlbumGenreTag.objects.filter(tag__in=tags)
+          .values('album_id'))
+    return ~q if negate else q
+
+
+def comparison_condition(field, column_type, operator, operand):
+    """Get a Q object comparing field with the operand using operator.
+    """
+    if not operand.strip():
+        return Q()
+
+    lookup = '{}__{}'.format(field, LOOKUPS[operator])
+    if column_type == DATE:
+        value = parse_date(operand)
+        if value is None:
+            return NOTHING
+        return Q(**{lookup: value})
+
+    value = parse_number(operand)
+    if math.isnan(value):
+        return NOTHING
+    if math.isinf(value):
+        # Every value in the table is finite
+        if (value > 0) == (operator in ('<', '<=')):
+            return Q(**{field + '__isnull': False})
+        return NOTHING
+    return Q(**{lookup: value})
+
+
+def condition_to_q(column, condition):
+    """Get a Q object for a single condition on a column.
+
+    As in script.js, an empty condition matches everything and a lone '!'
+    nothing, whatever the column.
+    """
+    if not condition:
+        return Q()
+    if condition == '!':
+        return NOTHING
+    field, text_field, column_type = COLUMNS[column]
+    if column_type == TAGS:
+        return tag_condition(condition)
+    if column_type != TEXT:
+        for operator in OPERATORS:
+            if condition.startswith(operator):
+                return comparison_condition(field, column_type, operator,
+                                            condition[len(operator):])
+    return text_condition(text_field, condition)
+
+
+def filter_to_q(column, text):
+    """Compile the filter text for a column into a Q object.
+    """
+    q = Q()
+    for group in split_filter(text):
+        conditions = [condition_to_q(column, condition) for condition in group]
+        # An empty Q matches everything, so the whole group does too
+        if all(conditions):
+            q &= functools.reduce(operator.or_, conditions)
+    return q
+
+
+def cell_text_annotations():
+    """Get annotations holding the text shown in numeric and date cells.
+
+    Substring conditions on numeric and date columns match the text in the
+    table cell, like the Javascript version does.
+    """
+    month = Cast(ExtractMonth('last_listen_date'), CharField())
+    day = Cast(ExtractDay('last_listen_date'), CharField())
+    year = LPad(Cast(Mod(ExtractYear('last_listen_date'), 100), CharField()),
+                2, Value('0'))
+    return {
+        'year_text': Cast('year', CharField()),
+        'rating_text': Cast('rating', CharField()),
+        'plays_text': Cast('play_count', CharField()),
+        'last_listen_text': Case(
+            When(play_count=0, then=Value('No listens')),
+            When(last_listen_date__isnull=True, then=Value('Unknown date')),
+            default=Concat(month, Value('/'), day, Value('/'), year),
+            output_field=CharField()),
+    }
+
+
+def filter_albums(queryset, params):
+    """Filter albums using the column filters in params.
+
+    params is a mapping (like request.GET) from column names in COLUMNS to
+    filter text; other keys are ignored.
+    """
+    filters = {column: params[column] for column in COLUMNS
+               if params.get(column, '').strip()}
+    if not filters:
+        return queryset
+
+    text_annotations = cell_text_annotations()
+    used = {COLUMNS[column][1] for column in filters} & set(text_annotations)
+    queryset = queryset.annotate(**{name: text_annotations[name]
+                                    for name in used})
+    for column, text in filters.items():
+        queryset = queryset.filter(filter_to_q(column, text))
+    return queryset
@@ -6,14 +6,55 @@ Module for holding custom forms for the tracker application.
 """
 
 from django import forms
+from django.urls import reverse_lazy
+
+from .models import Album, Listen
+
+
+class AlbumAutocompleteWidget(forms.Widget):
+    """Widget for picking an album by typing part of its artist or name.
+
+    Renders a text box which fetches matching albums from the autocomplete
+    API as the user types, and a hidden input holding the chosen album's
+    primary key. Unlike a select, the page doesn't list every album.
+    """
+    template_name = 'tracker/widgets/album_autocomplete.html'
+    empty_values = (None, '')
+
+    class Media:
+        css = {'all': ['tracker/autocomplete.css']}
+        js = ['tracker/autocomplete.js']
+
+    def __init__(self, attrs=None, url=None):
+        super(AlbumAutocompleteWidget, self).__init__(attrs)
+        self.url = url or reverse_lazy('tracker:api-album-autocomplete')
+
+    def get_context(self, name, value, attrs):
+        context = super(AlbumAutocompleteWidget, self).get_context(
+            name, value, attrs)
+        context['widget']['url'] = self.url
+        context['widget']['label'] = self.label_for(value)
+        return context
+
+    def label_for(self, value):
+        """Get the label shown for the album with primary key value, if there
+        is one.
+        """
+        if value in self.empty_values:
+            return ''
+        try:
+            album = Album.objects.select_related('artist').get(pk=value)
+        except (Album.DoesNotExist, ValueError, TypeError):
+            return ''
+        return album.label()
 
-from .models import Listen
 
 class ListenForm(forms.ModelForm):
 
     class Meta:
         model = Listen
         fields = ['album', 'listen_date']
+        widgets = {'album': AlbumAutocompleteWidget}
 
 
 class ListenFormForAlbum(ListenForm):
@@ -0,0 +1,160 @@
+"""
+genres.py
+
+Genre tags parsed from albums' free-text secondary genres.
+
+secondary_genres stays the text the user edits and sees; on save it is split
+on commas into normalized GenreTag rows linked through AlbumGenreTag. Filters
+and facet counts then work on the small tag table and the indexed through
+table instead of scanning the text of every album.
+"""
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Album, AlbumGenreTag, GenreTag, PrimaryGenre
+
+BATCH_SIZE = 500
+
+DEFAULT_FACET_COUNT = 20
+
+
+def normalize_tag(text):
+    """Return the tag name for a genre: casefolded, with runs of whitespace
+    collapsed to single spaces.
+    """
+    return ' '.join(text.casefold().split())
+
+
+def parse_genre_tags(text):
+    """Split secondary genres text into a list of unique tag names, in order.
+    """
+    tags = []
+    for part in text.split(','):
+        tag = normalize_tag(part)
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def tag_ids(names):
+    """Return {name: id} for the given tag names, creating missing tags.
+    """
+    names = set(names)
+    ids = {}
+    for batch in batched(sorted(names)):
+        ids.update(GenreTag.objects.filter(name__in=batch)
+                   .values_list('name', 'pk'))
+    missing = names - set(ids)
+    if missing:
+        GenreTag.objects.bulk_create(
+            [GenreTag(name=name) for name in missing], ignore_conflicts=True)
+        for batch in batched(sorted(missing)):
+            ids.update(GenreTag.objects.filter(name__in=batch)
+                       .values_list('name', 'pk'))
+    return ids
+
+
+def batched(items, size=BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def sync_genre_tags(albums):
+    """Bring the genre tags of albums into line with their secondary genres.
+
+    albums is an iterable of Album instances. Only albums whose tags have
+    changed are rewritten. Returns the number of albums rewritten.
+    """
+    wanted = {album.pk: parse_genre_tags(album.secondary_genres)
+              for album in albums}
+    existing = {album_id: [] for album_id in wanted}
+    for batch in batched(wanted):
+        rows = (AlbumGenreTag.objects.filter(album_id__in=batch)
+                .order_by('album_id', 'position')
+                .values_list('album_id', 'tag__name'))
+        for album_id, name in rows:
+            existing[album_id].append(name)
+    changed = [album_id for album_id, tags in wanted.items()
+               if tags != existing[album_id]]
+    if not changed:
+        return 0
+
+    with transaction.atomic():
+        ids = tag_ids(name for album_id in changed
+                      for name in wanted[album_id])
+        for batch in batched(changed):
+            AlbumGenreTag.objects.filter(album_id__in=batch).delete()
+        AlbumGenreTag.objects.bulk_create(
+            (AlbumGenreTag(album_id=album_id, tag_id=ids[name],
+                           position=position)
+             for album_id in changed
+             for position, name in enumerate(wanted[album_id])),
+            batch_size=BATCH_SIZE)
+    return len(changed)
+
+
+def rebuild_genre_tags():
+    """Resync the tags of every album and delete tags no album uses.
+
+    Returns (albums rewritten, tags deleted).
+    """
+    rewritten = 0
+    albums = Album.objects.order_by('pk').only('pk', 'secondary_genres')
+    for batch in batched(albums.iterator()):
+        rewritten += sync_genre_tags(batch)
+    deleted, _ = GenreTag.objects.filter(albumgenretag=None).delete()
+    return rewritten, deleted
+
+
+def genre_facets(albums=None, count=DEFAULT_FACET_COUNT):
+    """Count albums per genre tag and per primary genre.
+
+    albums optionally restricts the count to a queryset of albums (e.g. the
+    filtered album table). Returns {'tags': [(name, albums)],
+    'primary': [(name, albums)]}, most common first, with at most count
+    tags.
+    """
+    tag_rows = AlbumGenreTag.objects.all()
+    primary_rows = Album.primary_genres.through.objects.all()
+    if albums is not None:
+        album_ids = albums.order_by().values('pk')
+        tag_rows = tag_rows.filter(album_id__in=album_ids)
+        primary_rows = primary_rows.filter(album_id__in=album_ids)
+
+    tags = (tag_rows.order_by().values_list('tag__name')
+            .annotate(albums=Count('album_id'))
+            .order_by('-albums', 'tag__name')[:count])
+    primary = dict(primary_rows.order_by().values_list('primarygenre_id')
+                   .annotate(albums=Count('album_id')))
+    names = dict(PrimaryGenre.objects.filter(pk__in=primary)
+                 .values_list('pk', 'name'))
+    return {
+        'tags': list(tags),
+        'primary': sorted(((names[pk], albums) for pk, albums in
+                           primary.items()),
+                          key=lambda item: (-item[1], item[0])),
+    }
+
+
+def genre_features(album_ids=None, features=None):
+    """Return a list of (album id, feature) pairs describing albums' genres,
+    for comparing albums: a primary genre's feature is its id, and a genre
+    tag's is minus its id.
+
+    album_ids and features optionally limit the albums and features listed.
+    """
+    genre_links = Album.primary_genres.through.objects.values_list(
+        'album_id', 'primarygenre_id')
+    tag_links = AlbumGenreTag.objects.values_list('album_id', 'tag_id')
+    if album_ids is not None:
+        genre_links = genre_links.filter(album_id__in=album_ids)
+        tag_links = tag_links.filter(album_id__in=album_ids)
+    if features is not None:
+        genre_links = genre_links.filter(
+            primarygenre_id__in=[f for f in features if f > 0])
+        tag_links = tag_links.filter(tag_id__in=[-f for f in features
+                                                 if f < 0])
+    return (list(genre_links)
+            + [(album_id, -tag_id) for album_id, tag_id in tag_links])
+
@@ -0,0 +1,514 @@
+"""
+importer.py
+
+Bulk import of listen histories, e.g. from a spreadsheet or scrobble export.
+
+Records are read one at a time from CSV, JSON Lines or JSON array files,
+resolved to albums through an in-memory index of artist and album names, and
+written with bulk_create in batches, each in its own transaction along with
+any artists and albums created for it. Memory use depends on the size of the
+library and the batch size, not on the size of the input.
+
+Records which can't be imported, including artists and albums which aren't
+valid or which the database won't create, are skipped and counted, with the
+first few reasons kept along with the records' row numbers. Files which can't
+be parsed any further stop the import where the error is found.
+"""
+import csv
+import datetime
+import json
+import re
+import time
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from . import jobs
+from .caching import data_changed
+from .models import Album, Artist, Listen, normalize_name
+from .rollups import refresh_rollups
+
+# Fields a listen record may have. Only artist and album are required.
+RECORD_FIELDS = ('artist', 'album', 'date', 'track', 'year', 'rating')
+
+# Other names the fields go by in exports
+FIELD_ALIASES = {
+    'listen_date': 'date',
+    'artist_name': 'artist',
+    'album_name': 'album',
+    'track_name': 'track',
+    'uts': 'date',
+}
+
+# Characters of a JSON array file read at a time
+JSON_CHUNK_SIZE = 65536
+
+# Length of the longest JSON token other than a string ('-Infinity'). Items
+# which fail to decode this close to the end of what's been read may just
+# be cut off there.
+MAX_TOKEN_LENGTH = 9
+
+NON_SPACE_RE = re.compile(r'\S')
+
+DATE_FORMATS = (
+    '%Y-%m-%d',
+    '%Y/%m/%d',
+    '%m/%d/%Y',
+    '%m/%d/%y',
+    '%d %b %Y %H:%M',   # Last.fm CSV exports
+    '%d %b %Y, %H:%M',  # Last.fm web pages and JSON exports
+)
+
+
+class ListenImportError(ValueError):
+    """Raised for a listen record which can't be imported."""
+
+
+def parse_listen_date(value):
+    """Parse the date of a listen.
+
+    Accepts the formats in DATE_FORMATS, ISO 8601 date-times, and Unix
+    timestamps (as scrobbles use), which are converted to the local date.
+    Empty values give None, meaning the date is unknown.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value:
+        return None
+    if value.isdigit():
+        moment = datetime.datetime.fromtimestamp(int(value), tz=timezone.utc)
+        return timezone.localtime(moment).date()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format).date()
+        except ValueError:
+            pass
+    try:
+        moment = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ListenImportError('Unrecognised date: {!r}'.format(value))
+    if timezone.is_aware(moment):
+        moment = timezone.localtime(moment)
+    return moment.date()
+
+
+def normalize_record(raw):
+    """Get a record with the fields in RECORD_FIELDS from a parsed row.
+
+    Field names are matched ignoring case, and values given as
+    {'#text': ...} or {'uts': ...} objects (as in Last.fm JSON) are
+    unwrapped.
+    """
+    record = dict.fromkeys(RECORD_FIELDS)
+    for key, value in raw.items():
+        if key is None:
+            continue
+        key = key.strip().lower()
+        key = FIELD_ALIASES.get(key, key)
+        if key not in record:
+            continue
+        if isinstance(value, dict):
+            value = value.get('uts', value.get('#text'))
+        record[key] = value.strip() if isinstance(value, str) else value
+    return record
+
+
+def read_csv(stream, columns=None):
+    """Yield listen records from a CSV file.
+
+    If columns is given, the file has no header row and columns names its
+    columns in order.
+    """
+    reader = csv.DictReader(stream, fieldnames=columns)
+    try:
+        for row in reader:
+            yield normalize_record(row)
+    except csv.Error as err:
+        raise ListenImportError('Invalid CSV on line {}: {}'.format(
+            reader.line_num, err))
+
+
+def read_json_lines(stream):
+    """Yield listen records from a JSON Lines file (one object per line).
+
+    Lines which aren't JSON objects are yielded as ListenImportErrors, for
+    the importer to skip.
+    """
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError as err:
+            yield ListenImportError('Invalid JSON on line {}: {}'.format(
+                line_number, err))
+            continue
+        if not isinstance(value, dict):
+            yield ListenImportError(
+                'Line {} is not a JSON object.'.format(line_number))
+            continue
+        yield normalize_record(value)
+
+
+def read_json_array(stream, chunk_size=JSON_CHUNK_SIZE):
+    """Yield listen records from a JSON file holding an array of objects.
+
+    The file is read a chunk at a time and the array decoded an item at a
+    time, so it never has to fit in memory. Items which aren't objects are
+    yielded as ListenImportErrors, for the importer to skip. Invalid JSON
+    raises ListenImportError giving its line and column as soon as it's
+    read, as nothing after it can be decoded.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    # Offset in the file and line number of the start of the buffer, and
+    # offset of the start of that line
+    offset = 0
+    line = 1
+    line_start = 0
+
+    def read_more():
+        """Drop what's been decoded from the buffer and add the next chunk
+        to it. Returns False at the end of the file.
+        """
+        nonlocal buffer, position, offset, line, line_start
+        more = stream.read(chunk_size)
+        if not more:
+            return False
+        newline = buffer.rfind('\n', 0, position)
+        if newline != -1:
+            line += buffer.count('\n', 0, position)
+            line_start = offset + newline + 1
+        offset += position
+        buffer = buffer[position:] + more
+        position = 0
+        return True
+
+    def where(index):
+        """Return the line and column of buffer[index] in the file."""
+        newline = buffer.rfind('\n', 0, index)
+        start = offset + newline + 1 if newline != -1 else line_start
+        return 'line {} column {}'.format(
+            line + buffer.count('\n', 0, index), offset + index - start + 1)
+
+    def next_char():
+        """Skip whitespace and return the next character, or '' at the end.
+        """
+        nonlocal position
+        while True:
+            match = NON_SPACE_RE.search(buffer, position)
+            if match:
+                position = match.start()
+                return buffer[position]
+            position = len(buffer)
+            if not read_more():
+                return ''
+
+    if next_char() != '[':
+        raise ListenImportError('Expected a JSON array at {}.'.format(
+            where(position)))
+    position += 1
+    if next_char() == ']':
+        return
+
+    item = 0
+    while True:
+        item += 1
+        next_char()
+        while True:
+            try:
+                value, position = decoder.raw_decode(buffer, position)
+                break
+            except json.JSONDecodeError as err:
+                # Decode again with more of the file if the item may just
+                # be cut off by the end of the chunk
+                cut_off = (err.msg.startswith('Unterminated string')
+                           or len(buffer) - err.pos < MAX_TOKEN_LENGTH)
+                if not cut_off or not read_more():
+                    raise ListenImportError(
+                        'Invalid JSON in item {} at {}: {}.'.format(
+                            item, where(err.pos), err.msg))
+        if isinstance(value, dict):
+            yield normalize_record(value)
+        else:
+            yield ListenImportError(
+                'Item {} is not a JSON object.'.format(item))
+
+        char = next_char()
+        if char == ']':
+            return
+        if char != ',':
+            raise ListenImportError(
+                'Invalid JSON after item {} at {}.'.format(
+                    item, where(position)))
+        position += 1
+
+
+class ImportStats:
+    """Counts of what an import did.
+    """
+    def __init__(self):
+        self.rows = 0
+        self.listens = 0
+        self.collapsed = 0
+        self.artists_created = 0
+        self.albums_created = 0
+        self.skipped = 0
+        self.errors = []
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+class ListenImporter:
+    """Imports listen records in batches.
+
+    Parameters:
+        batch_size: number of listens to write per bulk_create/transaction
+        create_missing: create artists and albums which don't exist yet,
+            rather than skipping their listens
+        dry_run: resolve everything but write nothing
+        progress: optional callable, called with the ImportStats after
+            each batch
+    """
+    # Max number of skipped-row messages to keep
+    max_errors = 20
+
+    def __init__(self, batch_size=1000, create_missing=False, dry_run=False,
+                 progress=None):
+        self.batch_size = batch_size
+        self.create_missing = create_missing
+        self.dry_run = dry_run
+        self.progress = progress
+        self.artist_ids = {}
+        self.album_ids = {}
+        # Stand-in ids for artists and albums not created yet
+        self.next_fake_id = -1
+        # Map stand-in ids -> (key, name) of artists and (key, fields) of
+        # albums to create with the next batch
+        self.new_artists = {}
+        self.new_albums = {}
+        # Map keys of artists and albums the database wouldn't create -> why
+        self.failed_artists = {}
+        self.failed_albums = {}
+
+    def build_index(self):
+        """Load the keys and ids of all artists and albums.
+        """
+        self.artist_ids = dict(
+            Artist.objects.values_list('name_key', 'pk').iterator())
+        self.album_ids = {
+            (artist_id, name_key): pk for artist_id, name_key, pk in
+            Album.objects.values_list('artist_id', 'name_key', 'pk')
+            .iterator()}
+
+    def fake_id(self):
+        self.next_fake_id -= 1
+        return self.next_fake_id
+
+    def validate(self, instance, exclude=None):
+        """Raise ListenImportError if an artist or album to create isn't
+        valid.
+        """
+        try:
+            instance.full_clean(exclude=exclude, validate_unique=False)
+        except ValidationError as err:
+            raise ListenImportError('invalid {} {!r}: {}'.format(
+                instance._meta.verbose_name, instance.name,
+                ' '.join(err.messages)))
+
+    def resolve_artist(self, record, stats):
+        """Get the id of the record's artist, or None if it doesn't exist.
+        """
+        key = normalize_name(record['artist'])
+        if key in self.failed_artists:
+            raise ListenImportError(self.failed_artists[key])
+        if key not in self.artist_ids and self.create_missing:
+            self.validate(Artist(name=record['artist']))
+            artist_id = self.artist_ids[key] = self.fake_id()
+            if not self.dry_run:
+                self.new_artists[artist_id] = (key, record['artist'])
+            stats.artists_created += 1
+        return self.artist_ids.get(key)
+
+    def resolve_album(self, record, stats):
+        """Get the id of the record's album, or None if it doesn't exist.
+
+        Albums created for the import take their year and rating from the
+        record if it has them, and are zero otherwise. Artists and albums
+        to create get stand-in ids until they're created with the batch
+        their listens are written in (see create_new). Raises
+        ListenImportError if they aren't valid, or couldn't be created for
+        an earlier batch.
+        """
+        artist_id = self.resolve_artist(record, stats)
+        if artist_id is None:
+            return None
+
+        key = (artist_id, normalize_name(record['album']))
+        if key in self.failed_albums:
+            raise ListenImportError(self.failed_albums[key])
+        if key not in self.album_ids and self.create_missing:
+            fields = {'name': record['album'],
+                      'year': int(record['year'] or 0),
+                      'rating': float(record['rating'] or 0)}
+            self.validate(Album(**fields), exclude=['artist'])
+            album_id = self.album_ids[key] = self.fake_id()
+            if not self.dry_run:
+                self.new_albums[album_id] = (key, fields)
+            stats.albums_created += 1
+        return self.album_ids.get(key)
+
+    def create_new(self, stats):
+        """Create the artists and albums resolved since the last batch.
+
+        Each is created in a savepoint, so one the database rejects doesn't
+        roll back the rest of the batch, and albums by an artist which
+        couldn't be created aren't created either. Returns a dict mapping their stand-in ids
+        to their real ones, which replace the stand-ins in the index, and
+        to None for those not created, and a dict mapping the stand-in ids
+        of those not created to why.
+        """
+        ids = {}
+        errors = {}
+        for fake_id, (key, name) in self.new_artists.items():
+            try:
+                with transaction.atomic():
+                    ids[fake_id] = self.artist_ids[key] = (
+                        Artist.objects.create(name=name).pk)
+            except DatabaseError as err:
+                ids[fake_id] = None
+                del self.artist_ids[key]
+                errors[fake_id] = self.failed_artists[key] = (
+                    "couldn't create artist {!r}: {}".format(name, err))
+                stats.artists_created -= 1
+        for fake_id, (key, fields) in self.new_albums.items():
+            del self.album_ids[key]
+            artist_id = ids.get(key[0], key[0])
+            if artist_id is None:
+                ids[fake_id] = None
+                errors[fake_id] = errors[key[0]]
+                stats.albums_created -= 1
+                continue
+            try:
+                with transaction.atomic():
+                    ids[fake_id] = self.album_ids[(artist_id, key[1])] = (
+                        Album.objects.create(artist_id=artist_id,
+                                             **fields).pk)
+            except DatabaseError as err:
+                ids[fake_id] = None
+                errors[fake_id] = self.failed_albums[key] = (
+                    "couldn't create album {!r}: {}".format(fields['name'],
+                                                            err))
+                stats.albums_created -= 1
+        self.new_artists = {}
+        self.new_albums = {}
+        return ids, errors
+
+    def skip(self, stats, message, row=None):
+        """Count a record as skipped, keeping why with its row number (the
+        current row by default).
+        """
+        stats.skipped += 1
+        if len(stats.errors) < self.max_errors:
+            stats.errors.append('Row {}: {}'.format(
+                stats.rows if row is None else row, message))
+
+    def run(self, records):
+        """Import an iterable of listen records, returning ImportStats.
+
+        Scrobble exports have a record per track, so consecutive records for
+        the same album and day which name a track count as one listen.
+        Records may also be ListenImportErrors, for those the reader
+        couldn't parse, which are skipped.
+        """
+        stats = ImportStats()
+        self.build_index()
+        batch = []
+        # Row number of each listen in the batch
+        rows = []
+        previous = None
+
+        for record in records:
+            stats.rows += 1
+            if isinstance(record, ListenImportError):
+                self.skip(stats, str(record))
+                continue
+            if not record['artist'] or not record['album']:
+                self.skip(stats, 'missing artist or album')
+                continue
+            try:
+                listen_date = parse_listen_date(record['date'])
+                album_id = self.resolve_album(record, stats)
+            except (ListenImportError, ValueError) as err:
+                self.skip(stats, str(err))
+                continue
+            if album_id is None:
+                self.skip(stats, 'unknown album {!r} by {!r}'.format(
+                    record['album'], record['artist']))
+                continue
+
+            current = (album_id, listen_date)
+            if record['track'] and current == previous:
+                stats.collapsed += 1
+                continue
+            previous = current if record['track'] else None
+
+            batch.append(Listen(album_id=album_id, listen_date=listen_date))
+            rows.append(stats.rows)
+            if len(batch) >= self.batch_size:
+                ids = self.write_batch(batch, rows, stats)
+                batch = []
+                rows = []
+                if previous is not None:
+                    previous = (ids.get(album_id, album_id), listen_date)
+
+        if batch or self.new_artists or self.new_albums:
+            self.write_batch(batch, rows, stats)
+        if stats.listens and not self.dry_run:
+            data_changed()
+        return stats
+
+    def write_batch(self, batch, rows, stats):
+        """Create the batch's new artists and albums, write its listens,
+        update their albums' stored stats and daily rollups, and enqueue
+        their albums' jobs, all in one transaction.
+
+        Listens of albums which couldn't be created are skipped, with the
+        row numbers in rows. bulk_create doesn't send signals, so these are
+        done here. Returns the stand-in ids of the artists and albums
+        created mapped to their real ones.
+        """
+        ids = {}
+        if not self.dry_run:
+            with transaction.atomic():
+                ids, errors = self.create_new(stats)
+                listens = []
+                for listen, row in zip(batch, rows):
+                    album_id = ids.get(listen.album_id, listen.album_id)
+                    if album_id is None:
+                        self.skip(stats, errors[listen.album_id], row)
+                        continue
+                    listen.album_id = album_id
+                    listens.append(listen)
+                batch = listens
+                Listen.objects.bulk_create(batch)
+                album_ids = {listen.album_id for listen in batch}
+                Album.objects.filter(pk__in=album_ids).refresh_listen_stats()
+                refresh_rollups(album_ids,
+                                {listen.listen_date for listen in batch})
+                for album_id in album_ids:
+                    jobs.enqueue('similarities', album_id)
+        stats.listens += len(batch)
+        if self.progress is not None:
+            self.progress(stats)
+        return ids
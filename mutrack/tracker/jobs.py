@@ -0,0 +1,242 @@
+"""
+jobs.py
+
+Background jobs keeping derived data up to date, so the requests that change
+tracker data don't wait for it.
+
+A job is a task (one of TASKS) and the id of what it works on, saved as a
+Job row so it's still done if the server stops first. Jobs are merged:
+enqueueing a task for an album that's already waiting for it just counts
+another request, so an album changed many times in a row is worked on once
+or twice rather than each time.
+
+How jobs run depends on TRACKER_JOBS:
+
+- 'thread': on a pool of TRACKER_JOB_THREADS threads in the server process,
+  once the transaction that enqueued them commits
+- 'sync': straight away, in the request that enqueued them (for tests)
+- 'manual': only when the run_jobs management command is run
+
+Failed jobs are logged and kept with their error, and retried by run_jobs
+until they've failed MAX_ATTEMPTS times. run_jobs also runs any jobs left
+over when a server stopped.
+
+Every update of derived data is a job: albums' play counts and last listen
+dates, the daily rollups, genre tags, the search index and similarities.
+Only changes to the saved rows themselves and the cache versions are made
+in the request, by the receivers in signals.py. Until its jobs have run,
+pages show the derived data as it was before the change.
+"""
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+
+from . import genres, rollups, search, similarity
+from .caching import data_changed, derived_data_changed
+from .models import Album, Job
+
+logger = logging.getLogger(__name__)
+
+
+def refresh_listen_stats(album_id):
+    """Recompute an album's stored play count and last listen date."""
+    Album.objects.filter(pk=album_id).refresh_listen_stats()
+
+
+def refresh_album_rollups(album_id):
+    """Recount an album's daily rollups, then have its similarities, which
+    are worked out from them, brought up to date.
+    """
+    rollups.refresh_album_rollups(album_id)
+    if Album.objects.filter(pk=album_id).exists():
+        enqueue('similarities', album_id)
+
+
+def refresh_genre_rollups(genre_id):
+    """Recount a primary genre's daily rollups."""
+    rollups.refresh_genre_rollups({genre_id})
+
+
+def sync_genre_tags(album_id):
+    """Parse an album's secondary genres into genre tags, then have its
+    similarities brought up to date if they changed.
+    """
+    album = Album.objects.filter(pk=album_id).first()
+    if album is not None and genres.sync_genre_tags([album]):
+        enqueue('similarities', album_id)
+
+
+# Task name: function taking the id of what to work on
+TASKS = {
+    'listen_stats': refresh_listen_stats,
+    'rollups': refresh_album_rollups,
+    'genre_rollups': refresh_genre_rollups,
+    'genre_tags': sync_genre_tags,
+    'index_album': search.index_album,
+    'index_artist': search.index_artist,
+    'index_genre': search.index_genre,
+    'similarities': similarity.album_changed,
+}
+
+# Tasks updating what the recommender loads (see recommendations.py), which
+# bump the source version when they've run as well as the data version
+SOURCE_TASKS = {'listen_stats', 'rollups', 'genre_tags'}
+
+MAX_ATTEMPTS = 3
+
+
+def enqueue(task, object_id):
+    """Save a job, merging it with any waiting for the same task and id,
+    and run it (or have it run) according to TRACKER_JOBS.
+    """
+    if task not in TASKS:
+        raise ValueError('Unknown task: {}'.format(task))
+    jobs = Job.objects.filter(task=task, object_id=object_id)
+    if not jobs.update(requests=F('requests') + 1, attempts=0):
+        try:
+            with transaction.atomic():
+                Job.objects.create(task=task, object_id=object_id)
+        except IntegrityError:
+            # Created by another request meanwhile
+            jobs.update(requests=F('requests') + 1, attempts=0)
+
+    if settings.TRACKER_JOBS == 'sync':
+        run_job(jobs.get())
+    elif settings.TRACKER_JOBS == 'thread':
+        transaction.on_commit(lambda: get_runner().submit(task, object_id))
+
+
+def run_job(job):
+    """Run a job, then remove it unless it was enqueued again meanwhile.
+
+    Returns whether it succeeded; if not, the error is logged and saved on
+    the job.
+    """
+    try:
+        with transaction.atomic():
+            TASKS[job.task](job.object_id)
+    except Exception:
+        logger.exception('Job %s failed', job)
+        Job.objects.filter(pk=job.pk).update(
+            attempts=F('attempts') + 1, error=traceback.format_exc())
+        return False
+    Job.objects.filter(pk=job.pk, requests=job.requests).delete()
+    # Pages showing the derived data are out of date
+    if job.task in SOURCE_TASKS:
+        data_changed()
+    else:
+        derived_data_changed()
+    return True
+
+
+def run_pending():
+    """Run every waiting job in this thread, including any enqueued while
+    running, until only failed ones are left.
+
+    Returns the numbers of jobs (run, failed).
+    """
+    run = 0
+    failed = set()
+    while True:
+        jobs = list(Job.objects.filter(attempts__lt=MAX_ATTEMPTS)
+                    .exclude(pk__in=failed)[:100])
+        if not jobs:
+            return run, len(failed)
+        for job in jobs:
+            if run_job(job):
+                run += 1
+            else:
+                failed.add(job.pk)
+
+
+class JobRunner:
+    """Runs jobs on a thread pool as they're submitted.
+
+    A job submitted while it's already waiting to run is only run once, and
+    one submitted while running is run again afterwards.
+    """
+    def __init__(self, threads):
+        self.executor = ThreadPoolExecutor(threads,
+                                           thread_name_prefix='tracker-jobs')
+        self.lock = threading.Condition()
+        self.waiting = set()
+        self.running = set()
+        self.again = set()
+
+    def submit(self, task, object_id):
+        key = (task, object_id)
+        with self.lock:
+            if key in self.running:
+                self.again.add(key)
+                return
+            if key in self.waiting:
+                return
+            self.waiting.add(key)
+        self.executor.submit(self.run, key)
+
+    def submit_pending(self):
+        """Submit the jobs waiting in the database, e.g. from before a
+        restart.
+        """
+        close_old_connections()
+        try:
+            for task, object_id in Job.objects.filter(
+                    attempts__lt=MAX_ATTEMPTS).values_list('task',
+                                                           'object_id'):
+                self.submit(task, object_id)
+        finally:
+            close_old_connections()
+
+    def run(self, key):
+        with self.lock:
+            self.waiting.discard(key)
+            self.running.add(key)
+        close_old_connections()
+        try:
+            job = Job.objects.filter(task=key[0], object_id=key[1],
+                                     attempts__lt=MAX_ATTEMPTS).first()
+            if job is not None:
+                run_job(job)
+        except Exception:
+            logger.exception('Running job %s %s failed', *key)
+        finally:
+            close_old_connections()
+            with self.lock:
+                self.running.discard(key)
+                again = key in self.again
+                if again:
+                    self.again.discard(key)
+                    self.waiting.add(key)
+                self.lock.notify_all()
+        if again:
+            self.executor.submit(self.run, key)
+
+    def wait(self, timeout=None):
+        """Wait until no jobs are waiting or running. Returns whether they
+        all finished within timeout seconds.
+        """
+        with self.lock:
+            return self.lock.wait_for(
+                lambda: not self.waiting and not self.running, timeout)
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    """Return the job runner, sized by settings.TRACKER_JOB_THREADS.
+
+    When it's started, jobs left in the database are submitted to it.
+    """
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner(settings.TRACKER_JOB_THREADS)
+            _runner.executor.submit(_runner.submit_pending)
+        return _runner
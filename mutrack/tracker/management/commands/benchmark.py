@@ -0,0 +1,105 @@
+"""
+benchmark.py
+
+Management command for benchmarking the tracker at several library sizes.
+"""
+import datetime
+import json
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+
+from tracker.benchmarks import (DEFAULT_THRESHOLD, LIBRARY_SIZES,
+                                compare_results, environment, run_benchmarks)
+from tracker.synthetic import generate_library
+
+
+class Command(BaseCommand):
+    help = ('Time the tracker views and Album methods, with query counts and '
+            'peak memory, against synthetic libraries of several sizes. Runs '
+            'in a throwaway test database, so existing data is untouched.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='small,medium',
+            help='Comma-separated library sizes to run, from: {}.'.format(
+                ', '.join(LIBRARY_SIZES)))
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Timed runs per benchmark.')
+        parser.add_argument('--only', help='Comma-separated benchmark names '
+                                           'to run.')
+        parser.add_argument('-o', '--output',
+                            help='Write results to this JSON file.')
+        parser.add_argument('--compare',
+                            help='Results file from an earlier run to check '
+                                 'for regressions.')
+        parser.add_argument('--threshold', type=float,
+                            default=DEFAULT_THRESHOLD,
+                            help='Slowdown (as a fraction) counted as a '
+                                 'regression.')
+
+    def handle(self, *args, **options):
+        sizes = [size.strip() for size in options['sizes'].split(',')]
+        unknown = set(sizes) - set(LIBRARY_SIZES)
+        if unknown:
+            raise CommandError('Unknown sizes: {}'.format(', '.join(unknown)))
+        names = options['only'] and options['only'].split(',')
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = {
+                'created': datetime.datetime.now().isoformat(),
+                'environment': environment(),
+                'repeat': options['repeat'],
+                'sizes': {size: self.run_size(size, options['repeat'], names)
+                          for size in sizes},
+            }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write('Results written to {}.'.format(
+                options['output']))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                old = json.load(f)
+            regressions = compare_results(old, results, options['threshold'])
+            for regression in regressions:
+                self.stdout.write(self.style.WARNING(regression))
+            if regressions:
+                raise CommandError('{} regression(s) found.'.format(
+                    len(regressions)))
+            self.stdout.write(self.style.SUCCESS('No regressions found.'))
+
+    def run_size(self, size, repeat, names):
+        call_command('flush', interactive=False, verbosity=0)
+        num_artists, num_albums, num_listens = LIBRARY_SIZES[size]
+        self.stdout.write('{}: {} artists, {} albums, {} listens'.format(
+            size, num_artists, num_albums, num_listens))
+
+        start = time.monotonic()
+        generate_library(num_artists, num_albums, num_listens)
+        generate_time = time.monotonic() - start
+
+        results = run_benchmarks(repeat, names)
+        for name, result in results.items():
+            self.stdout.write(
+                '  {:36} {:8.1f}ms {:4d} queries {:9.0f}KiB'.format(
+                    name, result['median_ms'], result['queries'],
+                    result['peak_kib']))
+        return {
+            'library': {'artists': num_artists, 'albums': num_albums,
+                        'listens': num_listens},
+            'generate_s': generate_time,
+            'results': results,
+        }
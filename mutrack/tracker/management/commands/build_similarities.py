@@ -0,0 +1,26 @@
+"""
+build_similarities.py
+
+Management command for working out the similar albums and artists shown on
+album and artist pages.
+"""
+from django.core.management.base import BaseCommand
+
+from tracker.caching import data_changed
+from tracker.similarity import rebuild_similarities
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the similar albums and artists of every album and '
+            'artist from scratch, from the listen history and genres. '
+            'Changes to listens, albums and genres update them incrementally '
+            'through the background job queue (see run_jobs); a full rebuild '
+            'is only needed to fill them in the first time, or quicker after '
+            'a large import.')
+
+    def handle(self, *args, **options):
+        album_rows, artist_rows = rebuild_similarities()
+        data_changed()
+        self.stdout.write(self.style.SUCCESS(
+            'Saved {} similar album and {} similar artist rows.'.format(
+                album_rows, artist_rows)))
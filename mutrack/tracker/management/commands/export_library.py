@@ -0,0 +1,33 @@
+"""
+export_library.py
+
+Management command for exporting the whole library.
+"""
+from django.core.management.base import BaseCommand
+
+from tracker.exporter import DEFAULT_CHUNK_SIZE, EXPORT_FORMATS, export_library
+
+
+class Command(BaseCommand):
+    help = ('Export genres, artists, albums and listens. jsonl and json '
+            'exports can be loaded back with loaddata; csv exports hold the '
+            'listen history and can be loaded back with import_listens.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS),
+                            default='jsonl', help='Output format.')
+        parser.add_argument('-o', '--output',
+                            help='File to write to. Defaults to stdout.')
+        parser.add_argument('--chunk-size', type=int,
+                            default=DEFAULT_CHUNK_SIZE,
+                            help='Rows fetched from the database at a time.')
+
+    def handle(self, *args, **options):
+        chunks = export_library(options['format'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='',
+                      encoding='utf-8') as stream:
+                stream.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,31 @@
+"""
+generate_library.py
+
+Management command for filling the database with a synthetic library.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from tracker.synthetic import generate_library
+
+
+class Command(BaseCommand):
+    help = ('Add a synthetic library of artists, albums and listens to the '
+            'database, for trying out the app at scale. Each seed can only '
+            'be used once per database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--artists', type=int, default=250)
+        parser.add_argument('--albums', type=int, default=2500)
+        parser.add_argument('--listens', type=int, default=25000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        artists, albums, listens = generate_library(
+            options['artists'], options['albums'], options['listens'],
+            seed=options['seed'])
+        self.stdout.write(self.style.SUCCESS(
+            'Created {} artists, {} albums and {} listens in {:.1f}s.'.format(
+                artists, albums, listens, time.monotonic() - start)))
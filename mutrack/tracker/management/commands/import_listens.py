@@ -0,0 +1,112 @@
+"""
+import_listens.py
+
+Management command for importing listen histories from CSV, JSON Lines or
+JSON array files.
+"""
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tracker.importer import (ListenImporter, ListenImportError, read_csv,
+                              read_json_array, read_json_lines)
+
+
+class Command(BaseCommand):
+    help = ('Import listens from CSV, JSON Lines or JSON array files. Each '
+            'record needs an artist and album, and may have a date, and a '
+            'year and rating used when creating albums. Records naming a '
+            'track (as in scrobble exports) are collapsed into one listen per '
+            'album and day.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', metavar='path',
+                            help="Files to import, or '-' for stdin.")
+        parser.add_argument(
+            '--format', choices=['csv', 'jsonl', 'json'],
+            help='Input format: csv, jsonl (JSON Lines, an object per line) '
+                 'or json (an array of objects). Guessed from the file '
+                 'extension by default.')
+        parser.add_argument(
+            '--columns',
+            help='Comma-separated column names for CSV files without a '
+                 'header row, e.g. artist,album,track,date for Last.fm '
+                 'exports.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Listens written per transaction.')
+        parser.add_argument('--create-missing', action='store_true',
+                            help='Create artists and albums that do not '
+                                 'exist yet.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Check the input without writing anything.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        columns = None
+        if options['columns']:
+            columns = [column.strip() for column in
+                       options['columns'].split(',')]
+
+        importer = ListenImporter(batch_size=options['batch_size'],
+                                  create_missing=options['create_missing'],
+                                  dry_run=options['dry_run'],
+                                  progress=self.report_progress)
+
+        for path in options['paths']:
+            input_format = options['format'] or self.guess_format(path)
+            if path == '-':
+                stats = self.import_stream(importer, sys.stdin, input_format,
+                                           columns)
+            else:
+                with open(path, newline='', encoding='utf-8') as stream:
+                    stats = self.import_stream(importer, stream, input_format,
+                                               columns)
+            self.report(path, stats, options['dry_run'])
+
+    def guess_format(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.csv':
+            return 'csv'
+        if extension in ('.jsonl', '.ndjson'):
+            return 'jsonl'
+        if extension == '.json':
+            return 'json'
+        raise CommandError("Can't tell the format of {}; use --format.".format(
+            path))
+
+    def import_stream(self, importer, stream, input_format, columns):
+        if input_format == 'csv':
+            records = read_csv(stream, columns)
+        elif input_format == 'json':
+            records = read_json_array(stream)
+        else:
+            records = read_json_lines(stream)
+        try:
+            return importer.run(records)
+        except ListenImportError as err:
+            raise CommandError(str(err))
+
+    def report_progress(self, stats):
+        self.stdout.write('  {} rows read, {} listens ({:.0f} rows/s)'.format(
+            stats.rows, stats.listens, stats.rows_per_second))
+
+    def report(self, path, stats, dry_run):
+        verb = 'Would import' if dry_run else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            '{} {} listens from {} ({} rows in {:.1f}s, {:.0f} rows/s).'
+            .format(verb, stats.listens, path, stats.rows, stats.elapsed,
+                    stats.rows_per_second)))
+        if stats.collapsed:
+            self.stdout.write('{} track rows were merged into album '
+                              'listens.'.format(stats.collapsed))
+        if stats.artists_created or stats.albums_created:
+            self.stdout.write('{} {} artists and {} albums.'.format(
+                'Would create' if dry_run else 'Created',
+                stats.artists_created, stats.albums_created))
+        if stats.skipped:
+            self.stdout.write(self.style.WARNING(
+                'Skipped {} rows:'.format(stats.skipped)))
+            for error in stats.errors:
+                self.stdout.write('  ' + error)
@@ -0,0 +1,23 @@
+"""
+rebuild_genre_tags.py
+
+Management command for rebuilding the genre tags parsed from albums'
+secondary genres.
+"""
+from django.core.management.base import BaseCommand
+
+from tracker.caching import data_changed
+from tracker.genres import rebuild_genre_tags
+
+
+class Command(BaseCommand):
+    help = ("Reparse every album's secondary genres into genre tags and "
+            "delete tags no album uses. Tags are normally kept up to date as "
+            "albums are saved.")
+
+    def handle(self, *args, **options):
+        rewritten, deleted = rebuild_genre_tags()
+        data_changed()
+        self.stdout.write(self.style.SUCCESS(
+            'Retagged {} album(s); deleted {} unused tag(s).'.format(
+                rewritten, deleted)))
@@ -0,0 +1,55 @@
+"""
+rebuild_listen_stats.py
+
+Management command for rebuilding the play counts and last listen dates
+stored on albums.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from tracker.models import Album
+
+
+class Command(BaseCommand):
+    help = ('Recompute the stored play count and last listen date of every '
+            'album from its listens, reporting albums that had drifted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report drifted albums; don't fix them. Exits with an "
+                 "error if any are found.")
+
+    def handle(self, *args, **options):
+        drifted = self.find_drifted_albums()
+        for album_id, stored, actual in drifted:
+            self.stdout.write('Album {}: stored {}, actual {}'.format(
+                album_id, stored, actual))
+
+        if options['check']:
+            if drifted:
+                raise CommandError('{} album(s) have drifted.'.format(
+                    len(drifted)))
+            self.stdout.write(self.style.SUCCESS('No drift found.'))
+            return
+
+        with transaction.atomic():
+            updated = Album.objects.all().refresh_listen_stats()
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt listen stats for {} album(s); {} had drifted.'.format(
+                updated, len(drifted))))
+
+    def find_drifted_albums(self):
+        """Return (album id, stored stats, actual stats) for each album whose
+        stored stats don't match its listens.
+        """
+        rows = (Album.objects.with_actual_listen_stats().order_by()
+                .values_list('pk', 'play_count', 'last_listen_date',
+                             'actual_play_count', 'actual_last_listen_date'))
+        drifted = []
+        for album_id, plays, last_date, actual_plays, actual_date in (
+                rows.iterator()):
+            if (plays, last_date) != (actual_plays, actual_date):
+                drifted.append((album_id, (plays, last_date),
+                                (actual_plays, actual_date)))
+        return drifted
@@ -0,0 +1,23 @@
+"""
+rebuild_rollups.py
+
+Management command for rebuilding the daily listen rollups behind the stats
+page.
+"""
+from django.core.management.base import BaseCommand
+
+from tracker.caching import data_changed
+from tracker.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = ('Recount the daily listens of every album and primary genre from '
+            'the listen history. They are normally kept up to date as '
+            'listens change.')
+
+    def handle(self, *args, **options):
+        album_rows, genre_rows = rebuild_rollups()
+        data_changed()
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt {} album and {} genre rollup rows.'.format(
+                album_rows, genre_rows)))
@@ -0,0 +1,25 @@
+"""
+rebuild_search_index.py
+
+Management command for rebuilding the full-text search index.
+"""
+from django.core.management.base import BaseCommand
+
+from tracker.search import FTS5Index, get_index
+
+
+class Command(BaseCommand):
+    help = ('Reindex every artist and album for search. The index is normally '
+            'kept up to date as they change.')
+
+    def handle(self, *args, **options):
+        index = get_index()
+        index.rebuild()
+        if isinstance(index, FTS5Index):
+            self.stdout.write(self.style.SUCCESS(
+                'Rebuilt the FTS5 search index.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                'FTS5 is not available, so search uses in-memory indexes. '
+                'They will be reread from the database by their next '
+                'search.'))
@@ -0,0 +1,23 @@
+"""
+run_jobs.py
+
+Management command for running the background jobs waiting in the database.
+"""
+from django.core.management.base import BaseCommand
+
+from tracker.jobs import run_pending
+
+
+class Command(BaseCommand):
+    help = ('Run the background jobs keeping derived data up to date that '
+            'are waiting in the database, such as ones left when the server '
+            'stopped or all of them with MUTRACK_JOBS=manual. Jobs that '
+            'fail are kept and retried next time, a few times at most.')
+
+    def handle(self, *args, **options):
+        run, failed = run_pending()
+        self.stdout.write(self.style.SUCCESS('Ran {} jobs.'.format(run)))
+        if failed:
+            self.stderr.write(self.style.ERROR(
+                '{} jobs failed; see the Job table for errors.'.format(
+                    failed)))
@@ -0,0 +1,138 @@
+"""
+middleware.py
+
+Middleware for the tracker application.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+logger = logging.getLogger('tracker.timing')
+
+# Timings of the request being handled, for code running its queries on
+# another thread (see async_views.database_sync_to_async)
+current_timing = contextvars.ContextVar('current_timing', default=None)
+
+
+class RequestTiming:
+    """Timings collected for a single request.
+    """
+    def __init__(self):
+        self.view_name = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_start = None
+        self.total_time = 0.0
+
+    def database_wrapper(self, execute, sql, params, many, context):
+        """Execute wrapper counting queries and timing them.
+        """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+    def start_template(self):
+        self.template_start = time.perf_counter()
+
+    def end_template(self, response):
+        self.template_time = time.perf_counter() - self.template_start
+
+    def server_timing(self):
+        """Return the value for a Server-Timing header.
+        """
+        metrics = [
+            'db;dur={:.1f};desc="{} queries"'.format(self.db_time * 1000,
+                                                     self.queries),
+            'tpl;dur={:.1f}'.format(self.template_time * 1000),
+            'total;dur={:.1f}'.format(self.total_time * 1000),
+        ]
+        if self.view_name:
+            metrics.append('view;desc="{}"'.format(self.view_name))
+        return ', '.join(metrics)
+
+
+class TimingMiddleware:
+    """Records the number of queries, time spent in the database, template
+    render time and total time for each request.
+
+    Timings are sent in a Server-Timing header, so they show up in the
+    browser's developer tools, and logged to the 'tracker.timing' logger.
+    Turned on by settings.TRACKER_TIMING_ENABLED (MUTRACK_TIMING=1), and
+    otherwise left out of the middleware chain. Should come first in
+    MIDDLEWARE so the total covers the other middleware too.
+
+    Queries run while rendering a template (e.g. from lazy querysets) count
+    towards both database and template time. Works under ASGI too, without
+    tying the request to one thread; async views render their templates on
+    the database thread pool, so their template time counts as view time.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'TRACKER_TIMING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # So Django sees the middleware as async
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        request.timing = timing = RequestTiming()
+        token = current_timing.set(timing)
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timing.database_wrapper):
+                response = self.get_response(request)
+        finally:
+            current_timing.reset(token)
+        timing.total_time = time.perf_counter() - start
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        request.timing = timing = RequestTiming()
+        # Queries are counted by the threads running them
+        token = current_timing.set(timing)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timing.reset(token)
+        timing.total_time = time.perf_counter() - start
+        return self.finish(request, response)
+
+    def finish(self, request, response):
+        """Add the Server-Timing header to the response and log the timings.
+        """
+        timing = request.timing
+        response['Server-Timing'] = timing.server_timing()
+        logger.info(
+            'view=%s method=%s path=%s status=%s queries=%d db_ms=%.1f '
+            'template_ms=%.1f total_ms=%.1f', timing.view_name,
+            request.method, request.path, response.status_code,
+            timing.queries, timing.db_time * 1000,
+            timing.template_time * 1000, timing.total_time * 1000)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None)
+        request.timing.view_name = getattr(view_class or view_func,
+                                           '__name__', None)
+
+    def process_template_response(self, request, response):
+        # The template is rendered right after this hook
+        request.timing.start_template()
+        response.add_post_render_callback(request.timing.end_template)
+        return response
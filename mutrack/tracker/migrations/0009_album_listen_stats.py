@@ -0,0 +1,42 @@
+# Generated by Django 3.1.7 on 2026-10-18 17:53
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_listen_stats(apps, schema_editor):
+    """Compute the stored play counts and last listen dates for all albums.
+    """
+    Album = apps.get_model('tracker', 'Album')
+    Listen = apps.get_model('tracker', 'Listen')
+
+    listens = (Listen.objects.filter(album=OuterRef('pk'))
+               .order_by().values('album'))
+    plays = listens.annotate(plays=Count('pk')).values('plays')
+    last_date = listens.annotate(last_date=Max('listen_date')).values('last_date')
+    Album.objects.update(
+        play_count=Coalesce(
+            Subquery(plays, output_field=models.IntegerField()), 0),
+        last_listen_date=Subquery(last_date))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0008_auto_20171223_2315'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='last_listen_date',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='play_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_listen_stats, migrations.RunPython.noop),
+    ]
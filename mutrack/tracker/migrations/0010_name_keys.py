@@ -0,0 +1,46 @@
+# Generated by Django 3.1.7 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+def fill_name_keys(apps, schema_editor):
+    """Set the case-insensitive lookup keys for existing artists and albums.
+    """
+    for model_name in ('Artist', 'Album'):
+        model = apps.get_model('tracker', model_name)
+        objects = list(model.objects.only('pk', 'name'))
+        for obj in objects:
+            obj.name_key = obj.name.casefold()
+        model.objects.bulk_update(objects, ['name_key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0009_album_listen_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='name_key',
+            field=models.CharField(default='', editable=False, max_length=360),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='name_key',
+            field=models.CharField(default='', editable=False, max_length=360),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_name_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='artist',
+            name='name_key',
+            field=models.CharField(db_index=True, editable=False, max_length=360),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['artist', 'name_key'], name='album_artist_name_key_idx'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 3.1.7 on 2026-10-18 18:06
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import django.db.models.deletion
+
+
+def fill_rollups(apps, schema_editor):
+    """Count the daily listens of every album and primary genre.
+    """
+    Listen = apps.get_model('tracker', 'Listen')
+    DailyAlbumListens = apps.get_model('tracker', 'DailyAlbumListens')
+    DailyGenreListens = apps.get_model('tracker', 'DailyGenreListens')
+
+    album_counts = (Listen.objects.exclude(listen_date=None).order_by()
+                    .values_list('album_id', 'listen_date')
+                    .annotate(listens=Count('pk')))
+    DailyAlbumListens.objects.bulk_create(
+        (DailyAlbumListens(album_id=album_id, date=date, listens=listens)
+         for album_id, date, listens in album_counts.iterator()),
+        batch_size=2000)
+
+    genre_counts = (DailyAlbumListens.objects
+                    .exclude(album__primary_genres=None).order_by()
+                    .values_list('album__primary_genres', 'date')
+                    .annotate(listens=Sum('listens')))
+    DailyGenreListens.objects.bulk_create(
+        (DailyGenreListens(genre_id=genre_id, date=date, listens=listens)
+         for genre_id, date, listens in genre_counts.iterator()),
+        batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0010_name_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyGenreListens',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('listens', models.PositiveIntegerField()),
+                ('genre', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tracker.primarygenre')),
+            ],
+            options={
+                'ordering': ('date',),
+                'unique_together': {('date', 'genre')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyAlbumListens',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('listens', models.PositiveIntegerField()),
+                ('album', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tracker.album')),
+            ],
+            options={
+                'ordering': ('date',),
+                'unique_together': {('date', 'album')},
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Creates the FTS5 search index used by search.py, where SQLite supports it.
+# Elsewhere search.py falls back to an in-memory index, so there is nothing
+# to do.
+
+from django.db import migrations
+
+FIELDS = ('name', 'artist', 'genres', 'comments')
+
+
+def fts5_supported(schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return 'ENABLE_FTS5' in {row[0] for row in cursor.fetchall()}
+
+
+def create_search_index(apps, schema_editor):
+    """Create the FTS5 table and index every artist and album.
+    """
+    if not fts5_supported(schema_editor):
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS tracker_search USING fts5("
+        "name, artist, genres, comments, "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+    schema_editor.execute(
+        "INSERT INTO tracker_search (rowid, name, artist, genres, comments) "
+        "SELECT id * 2, name, '', '', '' FROM tracker_artist")
+    schema_editor.execute(
+        "INSERT INTO tracker_search (rowid, name, artist, genres, comments) "
+        "SELECT album.id * 2 + 1, album.name, artist.name, "
+        "album.secondary_genres || ' ' || COALESCE(("
+        "    SELECT group_concat(genre.name, ' ') "
+        "    FROM tracker_album_primary_genres album_genre "
+        "    JOIN tracker_primarygenre genre "
+        "    ON genre.id = album_genre.primarygenre_id "
+        "    WHERE album_genre.album_id = album.id), ''), "
+        "album.comments "
+        "FROM tracker_album album "
+        "JOIN tracker_artist artist ON artist.id = album.artist_id")
+
+
+def drop_search_index(apps, schema_editor):
+    if fts5_supported(schema_editor):
+        schema_editor.execute('DROP TABLE IF EXISTS tracker_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0011_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.7 on 2026-10-18 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0012_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='album',
+            name='name_key',
+            field=models.CharField(db_index=True, editable=False, max_length=360),
+        ),
+    ]
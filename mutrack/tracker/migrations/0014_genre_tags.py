@@ -0,0 +1,81 @@
+# Generated by Django 3.1.7 on 2026-10-18 18:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def parse_genre_tags(text):
+    # Copy of genres.parse_genre_tags as of this migration
+    tags = []
+    for part in text.split(','):
+        tag = ' '.join(part.casefold().split())
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def fill_genre_tags(apps, schema_editor):
+    """Parse every album's secondary genres into genre tags.
+    """
+    Album = apps.get_model('tracker', 'Album')
+    GenreTag = apps.get_model('tracker', 'GenreTag')
+    AlbumGenreTag = apps.get_model('tracker', 'AlbumGenreTag')
+
+    album_tags = [(album_id, parse_genre_tags(text)) for album_id, text in
+                  Album.objects.values_list('pk', 'secondary_genres')
+                  .iterator()]
+    names = {name for _, tags in album_tags for name in tags}
+    GenreTag.objects.bulk_create([GenreTag(name=name) for name in names],
+                                 batch_size=500)
+    ids = dict(GenreTag.objects.values_list('name', 'pk'))
+    AlbumGenreTag.objects.bulk_create(
+        (AlbumGenreTag(album_id=album_id, tag_id=ids[name], position=position)
+         for album_id, tags in album_tags
+         for position, name in enumerate(tags)),
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0013_album_name_key_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenreTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=600, unique=True)),
+            ],
+            options={
+                'ordering': ('name',),
+            },
+        ),
+        migrations.CreateModel(
+            name='AlbumGenreTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+                ('album', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tracker.album')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tracker.genretag')),
+            ],
+            options={
+                'ordering': ('album', 'position'),
+            },
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='genre_tags',
+            field=models.ManyToManyField(blank=True, editable=False, through='tracker.AlbumGenreTag', to='tracker.GenreTag'),
+        ),
+        migrations.AddIndex(
+            model_name='albumgenretag',
+            index=models.Index(fields=['tag', 'album'], name='albumgenretag_tag_album_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='albumgenretag',
+            unique_together={('album', 'tag')},
+        ),
+        migrations.RunPython(fill_genre_tags, migrations.RunPython.noop),
+    ]
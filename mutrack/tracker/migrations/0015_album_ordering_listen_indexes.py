@@ -0,0 +1,46 @@
+# Generated by Django 3.1.7 on 2026-10-18 18:34
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_artist_names(apps, schema_editor):
+    """Copy each album's artist name onto it, for ordering albums.
+    """
+    Album = apps.get_model('tracker', 'Album')
+    Artist = apps.get_model('tracker', 'Artist')
+
+    names = Artist.objects.filter(pk=OuterRef('artist')).values('name')
+    Album.objects.update(sort_artist_name=Subquery(names))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0014_genre_tags'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='album',
+            options={'ordering': ('-rating', 'sort_artist_name', 'name')},
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='sort_artist_name',
+            field=models.CharField(default='', editable=False, max_length=120),
+        ),
+        migrations.RunPython(copy_artist_names, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['-rating', 'sort_artist_name', 'name'], name='album_ordering_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listen',
+            index=models.Index(fields=['album', '-listen_date', '-id'], name='listen_album_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listen',
+            index=models.Index(fields=['listen_date'], name='listen_date_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.1.7 on 2026-10-18 18:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0015_album_ordering_listen_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarArtist',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('artist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_artists', to='tracker.artist')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tracker.artist')),
+            ],
+            options={
+                'ordering': ('artist', 'rank'),
+                'unique_together': {('artist', 'rank')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SimilarAlbum',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('album', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_albums', to='tracker.album')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tracker.album')),
+            ],
+            options={
+                'ordering': ('album', 'rank'),
+                'unique_together': {('album', 'rank')},
+            },
+        ),
+    ]
@@ -6,7 +6,11 @@ File contains data models for music tracker application.
 import datetime
 from urllib.parse import quote_plus
 
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import (Count, IntegerField, Max, Min, OuterRef,
+                              Subquery)
+from django.db.models.functions import Coalesce
 from django.core.exceptions import ValidationError
 from django.urls import reverse_lazy
 
@@ -24,6 +28,42 @@ def validate_zero_to_five(value):
     if value < 0.0 or value > 5.0:
         raise ValidationError(_('Value not between 0 and 5.'))
 
+def normalize_name(name):
+    """Return the key used for case-insensitive lookups of a name.
+
+    Artists and albums store this alongside their name, so looking them up
+    from a URL can use an index rather than a case-insensitive scan.
+    """
+    return name.casefold()
+
+def prefix_range(field, prefix):
+    """Return filter arguments matching values of field starting with prefix.
+
+    Written as a range rather than startswith, which some databases can't
+    answer from an index.
+    """
+    return {field + '__gte': prefix, field + '__lt': prefix + '\U0010ffff'}
+
+def format_date_ymd(date):
+    """Return a date in YYYY/MM/DD format.
+
+    If date is None, 'Unknown date' is returned.
+    """
+    if date is not None:
+        return '{:04d}/{:02d}/{:02d}'.format(date.year, date.month, date.day)
+    else:
+        return 'Unknown date'
+
+def format_date_mdy(date):
+    """Return a date in MM/DD/YY format.
+
+    If date is None, 'Unknown date' is returned.
+    """
+    if date is not None:
+        return '{:d}/{:d}/{:02d}'.format(date.month, date.day, date.year % 100)
+    else:
+        return 'Unknown date'
+
 class PrimaryGenreManager(models.Manager):
     """Manager for PrimaryGenre model.
     """
@@ -48,6 +88,25 @@ class PrimaryGenre(models.Model):
     def __str__(self):
         return self.name
 
+    def natural_key(self):
+        return (self.name,)
+
+
+class GenreTag(models.Model):
+    """A secondary genre, as parsed from albums' secondary_genres text.
+
+    Names are normalized (see genres.py), so 'Art  Rock' and 'art rock' are
+    the same tag.
+    """
+    # Casefolding can make a name longer, hence the larger max_length
+    name = models.CharField(max_length=600, unique=True)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        ordering = ('name',)
+
 
 class ArtistManager(models.Manager):
     """Manager for Artist model.
@@ -67,10 +126,16 @@ class Artist(models.Model):
     objects = ArtistManager()
 
     name = models.CharField(max_length=120, unique=True)
+    # Set from name on save--see signals.py. Casefolding can make a name
+    # longer, hence the larger max_length.
+    name_key = models.CharField(max_length=360, db_index=True, editable=False)
 
     def __str__(self):
         return self.name
 
+    def natural_key(self):
+        return (self.name,)
+
     def quoted_name(self):
         """Get 'quoted' name using pluses as spaces for use in URLs."""
         return quote_plus(self.name)
@@ -85,21 +150,115 @@ class Artist(models.Model):
         ordering = ('name',)
 
 
+class AlbumQuerySet(models.QuerySet):
+    """QuerySet for Album model.
+    """
+    def listen_stats_subqueries(self):
+        """Return subqueries computing play count and last listen date.
+
+        Returns a dict of expressions keyed by the Album field they are
+        stored in, computed from the Listen table for each album.
+        """
+        listens = (Listen.objects.filter(album=OuterRef('pk'))
+                   .order_by().values('album'))
+        plays = listens.annotate(plays=Count('pk')).values('plays')
+        last_date = listens.annotate(
+            last_date=Max('listen_date')).values('last_date')
+        return {
+            'play_count': Coalesce(
+                Subquery(plays, output_field=IntegerField()), 0),
+            'last_listen_date': Subquery(last_date),
+        }
+
+    def refresh_listen_stats(self):
+        """Recompute the stored play count and last listen date.
+
+        Runs as a single UPDATE statement over the albums in the queryset.
+        Returns the number of albums updated.
+        """
+        return self.update(**self.listen_stats_subqueries())
+
+    def with_actual_listen_stats(self):
+        """Annotate albums with play count and last listen date computed from
+        the Listen table, as `actual_play_count` and `actual_last_listen_date`.
+
+        Useful for checking the stored values for drift.
+        """
+        stats = self.listen_stats_subqueries()
+        return self.annotate(actual_play_count=stats['play_count'],
+                             actual_last_listen_date=stats['last_listen_date'])
+
+    def get_by_natural_key(self, name, artist_name):
+        """Method to allow identification of an Album by its name and its
+        artist's name.
+
+        Helpful for serialization/fixtures.
+        """
+        return self.get(name=name, artist__name=artist_name)
+
+    def lookup(self, artist_name, album_name):
+        """Filter to albums matching the given names, ignoring case.
+        """
+        return self.filter(artist__name_key=normalize_name(artist_name),
+                           name_key=normalize_name(album_name))
+
+    def with_name_prefix(self, artist_prefix='', album_prefix=''):
+        """Filter to albums whose artist and album names start with the given
+        prefixes, ignoring case. Uses the name key indexes.
+        """
+        albums = self
+        if artist_prefix:
+            albums = albums.filter(**prefix_range(
+                'artist__name_key', normalize_name(artist_prefix)))
+        if album_prefix:
+            albums = albums.filter(**prefix_range(
+                'name_key', normalize_name(album_prefix)))
+        return albums
+
+    def for_table(self):
+        """Return albums with everything needed to render the album table.
+
+        The artist is joined in and primary genres are prefetched, so the
+        whole table renders in a constant number of queries.
+        """
+        return (self.select_related('artist')
+                .prefetch_related('primary_genres'))
+
+
 class Album(models.Model):
     """Model representing an album.
     """
+    objects = AlbumQuerySet.as_manager()
+
     name = models.CharField(max_length=120)
+    # Set from name on save--see signals.py
+    name_key = models.CharField(max_length=360, db_index=True, editable=False)
     year = models.IntegerField()
     artist = models.ForeignKey(Artist, on_delete=models.CASCADE)
+    # Copy of the artist's name, set on save and when the artist is renamed
+    # --see signals.py. Lets the album table's ordering come from an index.
+    sort_artist_name = models.CharField(max_length=120, editable=False,
+                                        default='')
     rating = models.FloatField(validators=[validate_zero_to_five])
     primary_genres = models.ManyToManyField(PrimaryGenre)
     secondary_genres = models.CharField(max_length=200, blank=True, default='')
+    # Parsed from secondary_genres on save--see genres.py
+    genre_tags = models.ManyToManyField(GenreTag, through='AlbumGenreTag',
+                                        blank=True, editable=False)
     comments = models.TextField(blank=True, default='')
     listen_link = models.URLField(blank=True, default='')
 
+    # Kept up to date when listens are saved or deleted--see signals.py
+    play_count = models.PositiveIntegerField(default=0, editable=False)
+    last_listen_date = models.DateField(null=True, blank=True, editable=False)
+
     def __str__(self):
         return '{} [{}]'.format(self.name, self.artist.name)
 
+    def natural_key(self):
+        return (self.name,) + self.artist.natural_key()
+    natural_key.dependencies = ['tracker.artist']
+
     def get_absolute_url(self):
         """Get url to detail page for the model instance.
         """
@@ -110,42 +269,61 @@ class Album(models.Model):
     def artist_name(self):
         return self.artist.name
 
+    def label(self):
+        """Return 'Artist – Album', as used to pick albums in forms."""
+        return '{} \u2013 {}'.format(self.artist.name, self.name)
+
     def quoted_name(self):
         """Get 'quoted' name using pluses as spaces for use in URLs."""
         return quote_plus(self.name)
 
     def all_listens(self):
-        """Return all listens for this album."""
-        return self.listen_set.filter(album=self)
+        """Return all listens for this album, most recent first."""
+        # pk breaks ties between listens on the same day, so pages of
+        # listens don't overlap
+        return self.listen_set.order_by('-listen_date', '-pk')
+
+    def recent_listens(self, count=None):
+        """Return a list of the most recent listens for this album, at most
+        count of them (settings.TRACKER_RECENT_LISTENS by default).
+
+        Fetched with a single bounded query, then remembered.
+        """
+        if count is None:
+            count = settings.TRACKER_RECENT_LISTENS
+        if not hasattr(self, '_recent_listens'):
+            self._recent_listens = {}
+        if count not in self._recent_listens:
+            self._recent_listens[count] = list(self.all_listens()[:count])
+        return self._recent_listens[count]
+
+    def recent_listens_label(self, count=None):
+        """Return text label for displaying the recent listens in a view."""
+        recent = self.recent_listens(count)
+        if not recent:
+            return ''
+        else:
+            return 'Last {} listens:'.format(len(recent))
 
     def last_five_listens(self):
         """Return five most recent listens for this album."""
-        return self.all_listens()[:5]
+        return self.recent_listens(5)
 
     def last_five_listens_label(self):
         """Return text label for displaying "last five listens" in a view."""
-        last_five = self.last_five_listens()
-        if not last_five:
-            return ''
-        else:
-            return 'Last {} listens:'.format(min((self.number_of_plays(), 5)))
+        return self.recent_listens_label(5)
 
     def last_listen(self):
         """Return most recent listen for this album."""
-        all_listens = self.all_listens()
-        if all_listens:
-            return all_listens[0]
-        else:
-            return None
+        return self.all_listens().first()
 
     def last_listen_date_ymd(self):
         """Return date of most recent listen as a string in YYYY/MM/DD format.
 
         If no last listen, will return 'No listens'
         """
-        last_listen = self.last_listen()
-        if last_listen:
-            return last_listen.slash_date_ymd()
+        if self.play_count:
+            return format_date_ymd(self.last_listen_date)
         else:
             return 'No listens'
 
@@ -154,19 +332,94 @@ class Album(models.Model):
 
         If no last listen, will return 'No listens'
         """
-        last_listen = self.last_listen()
-        if last_listen:
-            return last_listen.slash_date_mdy()
+        if self.play_count:
+            return format_date_mdy(self.last_listen_date)
         else:
             return 'No listens'
 
     def number_of_plays(self):
         """Return number of listens for this album."""
-        return len(self.all_listens())
+        return self.play_count
 
     class Meta:
         unique_together = ('name', 'artist')
-        ordering = ('-rating', 'artist', 'name')
+        # The same as ordering by artist (whose ordering is by name)
+        ordering = ('-rating', 'sort_artist_name', 'name')
+        indexes = [
+            models.Index(fields=['artist', 'name_key'],
+                         name='album_artist_name_key_idx'),
+            models.Index(fields=['-rating', 'sort_artist_name', 'name'],
+                         name='album_ordering_idx'),
+        ]
+
+
+class AlbumGenreTag(models.Model):
+    """Links an album to one of its genre tags.
+
+    position is the tag's place in the album's secondary_genres text.
+    """
+    album = models.ForeignKey(Album, on_delete=models.CASCADE)
+    tag = models.ForeignKey(GenreTag, on_delete=models.CASCADE)
+    position = models.PositiveSmallIntegerField(default=0)
+
+    def __str__(self):
+        return '{}: {}'.format(self.album, self.tag)
+
+    class Meta:
+        unique_together = ('album', 'tag')
+        ordering = ('album', 'position')
+        indexes = [
+            # For finding albums by tag; the unique index covers the reverse
+            models.Index(fields=['tag', 'album'],
+                         name='albumgenretag_tag_album_idx'),
+        ]
+
+
+class ListenQuerySet(models.QuerySet):
+    """QuerySet for Listen model.
+
+    Its aggregates are found with a few seeks of the listen_date index, and
+    its date lists from the index alone, rather than a scan of every listen,
+    for the admin's date hierarchy.
+    """
+    def aggregate(self, *args, **kwargs):
+        """Aggregate the listens, as QuerySet.aggregate does.
+
+        Several Min and Max aggregates are each run as a query of their own,
+        as SQLite only answers a lone min() or max() from one end of an
+        index, and scans the whole table for more.
+        """
+        if (not args and len(kwargs) > 1
+                and all(type(aggregate) in (Min, Max)
+                        for aggregate in kwargs.values())):
+            parent = super(ListenQuerySet, self)
+            return {name: parent.aggregate(**{name: aggregate})[name]
+                    for name, aggregate in kwargs.items()}
+        return super(ListenQuerySet, self).aggregate(*args, **kwargs)
+
+    def dates(self, field_name, kind, order='ASC'):
+        """Return a list of the years or months with listens, as
+        QuerySet.dates does.
+
+        For listen_date, the distinct days with listens are read from the
+        index in one query and truncated here, rather than truncating the
+        date of every listen in the database. Other kinds are left to
+        QuerySet.dates.
+        """
+        if field_name != 'listen_date' or kind not in ('year', 'month'):
+            return super(ListenQuerySet, self).dates(field_name, kind, order)
+        if order not in ('ASC', 'DESC'):
+            raise ValueError("'order' must be either 'ASC' or 'DESC'.")
+
+        days = (self.filter(listen_date__isnull=False)
+                .order_by('listen_date')
+                .values_list('listen_date', flat=True)
+                .distinct())
+        if kind == 'year':
+            dates = {day.replace(month=1, day=1) for day in days}
+        else:
+            dates = {day.replace(day=1) for day in days}
+        return sorted(dates, reverse=(order == 'DESC'))
 
 
 class Listen(models.Model):
@@ -175,9 +428,20 @@ class Listen(models.Model):
     album = models.ForeignKey(Album, on_delete=models.CASCADE)
     listen_date = models.DateField(default=datetime.date.today, null=True)
 
+    objects = ListenQuerySet.as_manager()
+
     def __str__(self):
         return '{} ({})'.format(self.album, self.listen_date)
 
+    def save(self, *args, **kwargs):
+        """Save the listen.
+
+        Done in a transaction so the album's stored play count and last listen
+        date (updated on post_save) can't get out of step with its listens.
+        """
+        with transaction.atomic():
+            super(Listen, self).save(*args, **kwargs)
+
     def get_absolute_url(self):
         """Get url to detail page for the model instance.
         """
@@ -197,24 +461,14 @@ class Listen(models.Model):
 
         If no date, 'Unknown date' is returned.
         """
-        if self.listen_date is not None:
-            return '{:04d}/{:02d}/{:02d}'.format(self.listen_date.year,
-                                                 self.listen_date.month,
-                                                 self.listen_date.day)
-        else:
-            return 'Unknown date'
+        return format_date_ymd(self.listen_date)
 
     def slash_date_mdy(self):
         """Return listen date in MM/DD/YY format.
 
         If no date, 'Unknown date' is returned.
         """
-        if self.listen_date is not None:
-            return '{:d}/{:d}/{:02d}'.format(self.listen_date.month,
-                                             self.listen_date.day,
-                                             self.listen_date.year % 100)
-        else:
-            return 'Unknown date'
+        return format_date_mdy(self.listen_date)
 
     def default_date(self):
         """Return listen date in default datetime.date format.
@@ -228,3 +482,114 @@ class Listen(models.Model):
 
     class Meta:
         ordering = ('-listen_date',)
+        indexes = [
+            # An album's listens, most recent first (see Album.all_listens)
+            models.Index(fields=['album', '-listen_date', '-id'],
+                         name='listen_album_date_idx'),
+            # Listens in a date range, for stats
+            models.Index(fields=['listen_date'], name='listen_date_idx'),
+        ]
+
+
+class SimilarAlbum(models.Model):
+    """One of an album's most similar albums, by co-listens and genres.
+
+    rank 0 is the most similar. Worked out by similarity.py.
+    """
+    album = models.ForeignKey(Album, on_delete=models.CASCADE,
+                              related_name='similar_albums')
+    similar = models.ForeignKey(Album, on_delete=models.CASCADE,
+                                related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    def __str__(self):
+        return '{} ~ {}'.format(self.album, self.similar)
+
+    class Meta:
+        # The unique index serves an album's list, in order
+        unique_together = ('album', 'rank')
+        ordering = ('album', 'rank')
+
+
+class SimilarArtist(models.Model):
+    """One of an artist's most similar artists, from their albums'
+    similarity.
+
+    rank 0 is the most similar. Worked out by similarity.py.
+    """
+    artist = models.ForeignKey(Artist, on_delete=models.CASCADE,
+                               related_name='similar_artists')
+    similar = models.ForeignKey(Artist, on_delete=models.CASCADE,
+                                related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    def __str__(self):
+        return '{} ~ {}'.format(self.artist, self.similar)
+
+    class Meta:
+        unique_together = ('artist', 'rank')
+        ordering = ('artist', 'rank')
+
+
+class DailyAlbumListens(models.Model):
+    """Number of listens of an album on a day.
+
+    A rollup of the Listen table for the stats page, kept up to date when
+    listens are saved or deleted--see rollups.py. Listens with unknown dates
+    aren't counted.
+    """
+    date = models.DateField()
+    album = models.ForeignKey(Album, on_delete=models.CASCADE)
+    listens = models.PositiveIntegerField()
+
+    def __str__(self):
+        return '{} ({}): {}'.format(self.album, self.date, self.listens)
+
+    class Meta:
+        unique_together = ('date', 'album')
+        ordering = ('date',)
+
+
+class DailyGenreListens(models.Model):
+    """Number of listens of albums in a primary genre on a day.
+
+    Rolled up from DailyAlbumListens. An album in two genres counts towards
+    both.
+    """
+    date = models.DateField()
+    genre = models.ForeignKey(PrimaryGenre, on_delete=models.CASCADE)
+    listens = models.PositiveIntegerField()
+
+    def __str__(self):
+        return '{} ({}): {}'.format(self.genre, self.date, self.listens)
+
+    class Meta:
+        unique_together = ('date', 'genre')
+        ordering = ('date',)
+
+
+class Job(models.Model):
+    """Derived data waiting to be brought up to date in the background.
+
+    A task name from jobs.TASKS and the id of what it works on, usually an
+    album. There's at most one job for each, however many times it's
+    enqueued--see jobs.py.
+    """
+    task = models.CharField(max_length=40)
+    object_id = models.PositiveIntegerField()
+    # Counts enqueues, so that a run only removes the job if it wasn't
+    # enqueued again meanwhile
+    requests = models.PositiveIntegerField(default=1)
+    created = models.DateTimeField(auto_now_add=True)
+    # Failed runs since the job was last enqueued, and the last error
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return '{} {}'.format(self.task, self.object_id)
+
+    class Meta:
+        unique_together = ('task', 'object_id')
+        ordering = ('pk',)
@@ -0,0 +1,302 @@
+"""
+recommendations.py
+
+Ranks albums by what to listen to next, for the recommendations page.
+
+Each album gets a score between about 0 and 1 for each of:
+
+- rating: its rating out of 5
+- plays: how many times it's been played, on a log scale relative to the
+  most played album
+- recency: how long it's been since it was last played (never played albums
+  score 1)
+- genre: how closely its primary genres and genre tags match those of the
+  albums listened to in the last TRACKER_RECOMMENDATION_WINDOW days
+
+and its overall score is the sum of these weighted by
+TRACKER_RECOMMENDATION_WEIGHTS (or weights given with the request).
+
+The scores are worked out for every album at once with NumPy, from arrays
+loaded in a fixed number of flat queries. The arrays are kept in memory by
+each server process and updated in place when a listen is added; anything
+else that changes tracker data (see caching.py), or a new day, has them
+loaded again the next time they're needed.
+"""
+import datetime
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+
+from .caching import SOURCE_VERSION_KEY, source_version
+from .genres import genre_features
+from .models import Album, DailyAlbumListens
+
+COMPONENTS = ('rating', 'plays', 'recency', 'genre')
+
+DEFAULT_LIMIT = 25
+MAX_LIMIT = 200
+
+# Days since an album was last played at which its recency score reaches
+# 1 - 1/e
+RECENCY_SCALE = 180
+
+# Rankings kept for different weights, until the data changes
+MAX_CACHED_RANKINGS = 16
+
+
+def parse_weights(params):
+    """Get the scoring weights, from TRACKER_RECOMMENDATION_WEIGHTS with any
+    given in params (a mapping like request.GET) in their place.
+
+    Raises ValueError if a weight given isn't a number.
+    """
+    weights = dict.fromkeys(COMPONENTS, 0.0)
+    weights.update(settings.TRACKER_RECOMMENDATION_WEIGHTS)
+    for name in COMPONENTS:
+        if params.get(name):
+            weight = float(params[name])
+            if not np.isfinite(weight):
+                raise ValueError('{} weight must be finite.'.format(name))
+            weights[name] = weight
+    return weights
+
+
+class Recommender:
+    """Album scores, and the arrays they're worked out from.
+
+    Call load to fill the arrays from the database, and listen_added as
+    listens are added. Safe to use from several threads.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None
+        self.today = None
+        # Number of times loaded
+        self.loads = 0
+        self.album_ids = np.zeros(0, dtype=np.int64)
+
+    def load(self, today=None):
+        """Load the album data from the database.
+        """
+        today = today or timezone.localdate()
+        version = source_version()
+
+        albums = list(Album.objects.order_by('pk').values_list(
+            'pk', 'rating', 'play_count', 'last_listen_date'))
+        album_ids = np.array([album[0] for album in albums], dtype=np.int64)
+
+        links = np.array(genre_features(), dtype=np.int64).reshape(-1, 2)
+        feature_albums = links[:, 0]
+        # Numbered from 0 for bincount
+        _, features = np.unique(links[:, 1], return_inverse=True)
+        features = features.reshape(-1)
+
+        window_start = today - datetime.timedelta(
+            days=settings.TRACKER_RECOMMENDATION_WINDOW)
+        recent = np.array(
+            list(DailyAlbumListens.objects.filter(date__gt=window_start)
+                 .order_by().values('album').annotate(total=Sum('listens'))
+                 .values_list('album', 'total'))
+            or np.zeros((0, 2)), dtype=np.int64).reshape(-1, 2)
+
+        with self.lock:
+            self.loads += 1
+            self.version = version
+            self.today = today
+            self.window_start = window_start
+            self.album_ids = album_ids
+            self.rows = {album_id: row
+                         for row, album_id in enumerate(album_ids.tolist())}
+            self.rating = np.array([album[1] for album in albums],
+                                   dtype=np.float64)
+            self.plays = np.array([album[2] for album in albums],
+                                  dtype=np.float64)
+            # Day numbers, with NaN for never played
+            self.last_day = np.array(
+                [album[3].toordinal() if album[3] is not None else np.nan
+                 for album in albums], dtype=np.float64)
+
+            self.feature_rows, found = self.find_rows(feature_albums)
+            self.feature_rows = self.feature_rows[found]
+            self.features = features[found]
+            self.feature_count = int(self.features.max(initial=-1)) + 1
+            # Each album's feature vector has unit length
+            per_album = np.bincount(self.feature_rows,
+                                    minlength=len(album_ids))
+            self.feature_weights = 1 / np.sqrt(
+                np.maximum(per_album, 1))[self.feature_rows]
+
+            self.recent_listens = np.zeros(len(album_ids))
+            recent_rows, found = self.find_rows(recent[:, 0])
+            self.recent_listens[recent_rows[found]] = recent[found, 1]
+            self.scores_changed()
+
+    def find_rows(self, album_ids):
+        """Return the rows of the given albums in the arrays, and whether
+        each was found (albums added since loading aren't).
+        """
+        rows = np.searchsorted(self.album_ids, album_ids)
+        rows = np.minimum(rows, max(len(self.album_ids) - 1, 0))
+        found = (self.album_ids[rows] == album_ids if len(self.album_ids)
+                 else np.zeros(len(album_ids), dtype=bool))
+        return rows, found
+
+    def is_current(self):
+        """Return whether the arrays are up to date."""
+        return (self.version == source_version()
+                and self.today == timezone.localdate())
+
+    def listen_added(self, album_id, listen_date):
+        """Update the arrays for a new listen of an album.
+        """
+        with self.lock:
+            row = self.rows.get(album_id)
+            if row is None:
+                return False
+            self.plays[row] += 1
+            if listen_date is not None:
+                day = listen_date.toordinal()
+                if not day <= self.last_day[row]:
+                    self.last_day[row] = day
+                if self.window_start < listen_date <= self.today:
+                    self.recent_listens[row] += 1
+            self.scores_changed()
+            return True
+
+    def scores_changed(self):
+        self.components = None
+        self.rankings = {}
+
+    def get_components(self):
+        """Return {component: array of every album's score for it}."""
+        with self.lock:
+            if self.components is None:
+                self.components = self.compute_components()
+            return self.components
+
+    def compute_components(self):
+        rating = self.rating / 5
+
+        most_plays = self.plays.max(initial=0)
+        plays = np.log1p(self.plays) / np.log1p(max(most_plays, 1))
+
+        days = self.today.toordinal() - self.last_day
+        recency = np.where(np.isnan(days), 1.0, -np.expm1(
+            -np.maximum(np.nan_to_num(days), 0) / RECENCY_SCALE))
+
+        # Cosine similarity of each album's features with the sum of those
+        # of the recently played albums, weighted by their listens
+        pair_weights = self.feature_weights
+        profile = np.bincount(
+            self.features,
+            weights=pair_weights * self.recent_listens[self.feature_rows],
+            minlength=self.feature_count)
+        norm = np.linalg.norm(profile)
+        if norm:
+            genre = np.bincount(
+                self.feature_rows,
+                weights=pair_weights * profile[self.features] / norm,
+                minlength=len(self.album_ids))
+        else:
+            genre = np.zeros(len(self.album_ids))
+
+        return {'rating': rating, 'plays': plays, 'recency': recency,
+                'genre': genre}
+
+    def ranking(self, weights, limit=DEFAULT_LIMIT):
+        """Return [(album id, score, {component: score})] for the best
+        scoring albums under the given weights, best first.
+        """
+        key = (tuple(weights[name] for name in COMPONENTS), limit)
+        with self.lock:
+            if key not in self.rankings:
+                if len(self.rankings) >= MAX_CACHED_RANKINGS:
+                    self.rankings.clear()
+                self.rankings[key] = self.compute_ranking(weights, limit)
+            return self.rankings[key]
+
+    def compute_ranking(self, weights, limit):
+        components = self.get_components()
+        scores = np.zeros(len(self.album_ids))
+        for name in COMPONENTS:
+            scores += weights[name] * components[name]
+
+        limit = min(limit, len(scores))
+        if limit <= 0:
+            return []
+        # Only the best few need sorting; ties go to the older album
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        best = best[np.lexsort((self.album_ids[best], -scores[best]))]
+        return [(int(self.album_ids[row]), float(scores[row]),
+                 {name: float(components[name][row])
+                  for name in COMPONENTS})
+                for row in best]
+
+
+_recommender = Recommender()
+
+
+def get_recommender():
+    """Return the recommender, loading its arrays if they're out of date.
+    """
+    with _recommender.lock:
+        if not _recommender.is_current():
+            _recommender.load()
+    return _recommender
+
+
+def listen_saving(listen):
+    """Note whether the recommender is up to date, and with which version,
+    before a new listen is saved (and the source version bumped).
+    """
+    with _recommender.lock:
+        if _recommender.is_current():
+            listen._recommender_state = (_recommender.loads,
+                                         _recommender.version)
+
+
+def listen_saved(listen):
+    """Return a function updating the recommender for a new listen, for
+    data_changed to call once the transaction commits, or None if the
+    recommender wasn't up to date before.
+
+    The recommender then stays up to date rather than loading everything
+    again the next time it's used. It only adopts the source version bumped
+    for the listen if the listen's bumps were the only ones since it was up
+    to date; otherwise it's left out of date, and loads next time.
+    """
+    state = getattr(listen, '_recommender_state', None)
+    if state is None:
+        return None
+    loads, version = state
+
+    def update(changed, committed):
+        changed_from, changed_to = changed[SOURCE_VERSION_KEY]
+        committed_from, committed_to = committed[SOURCE_VERSION_KEY]
+        with _recommender.lock:
+            if _recommender.loads != loads or not _recommender.listen_added(
+                    listen.album_id, listen.listen_date):
+                return
+            if (changed_from == version and committed_from == changed_to
+                    and source_version() == committed_to):
+                _recommender.version = committed_to
+            else:
+                _recommender.version = None
+    return update
+
+
+def recommendations(weights, limit=DEFAULT_LIMIT):
+    """Return the best albums to listen to next under the given weights.
+
+    Returns a list of (album, score, {component: score}), best first. The
+    albums (with their artists) are fetched in one query.
+    """
+    ranking = get_recommender().ranking(weights, limit)
+    albums = Album.objects.select_related('artist').in_bulk(
+        [album_id for album_id, _, _ in ranking])
+    return [(albums[album_id], score, components)
+            for album_id, score, components in ranking
+            if album_id in albums]
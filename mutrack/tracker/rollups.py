@@ -0,0 +1,111 @@
+"""
+rollups.py
+
+Keeps the daily listen rollup tables (DailyAlbumListens, DailyGenreListens)
+in step with the Listen table.
+
+Rather than adding or subtracting one when a listen changes, the affected
+rows are recounted, so a refresh is always safe to repeat. Refreshing covers
+every combination of the given albums (or genres) and dates.
+"""
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from .models import (Album, DailyAlbumListens, DailyGenreListens, Listen,
+                     PrimaryGenre)
+
+BATCH_SIZE = 2000
+
+
+def refresh_rollups(album_ids, dates):
+    """Recount the daily listens of the given albums on the given dates,
+    and of their primary genres on those dates.
+    """
+    album_ids = set(album_ids)
+    dates = {date for date in dates if date is not None}
+    if not album_ids or not dates:
+        return
+
+    counts = (Listen.objects
+              .filter(album_id__in=album_ids, listen_date__in=dates)
+              .order_by().values_list('album_id', 'listen_date')
+              .annotate(listens=Count('pk')))
+    with transaction.atomic():
+        DailyAlbumListens.objects.filter(album_id__in=album_ids,
+                                         date__in=dates).delete()
+        DailyAlbumListens.objects.bulk_create(
+            DailyAlbumListens(album_id=album_id, date=date, listens=listens)
+            for album_id, date, listens in counts)
+
+        genre_ids = (PrimaryGenre.objects.filter(album__in=album_ids)
+                     .values_list('pk', flat=True).distinct())
+        refresh_genre_rollups(genre_ids, dates)
+
+
+def refresh_album_rollups(album_id):
+    """Recount an album's daily listens on every day it has listens or
+    rollups, and its primary genres' on those days.
+
+    Covers days it no longer has listens on too, so it's all that's needed
+    after any change to the album's listens.
+    """
+    dates = set(DailyAlbumListens.objects.filter(album_id=album_id)
+                .values_list('date', flat=True))
+    dates.update(Listen.objects.filter(album_id=album_id)
+                 .exclude(listen_date=None).order_by()
+                 .values_list('listen_date', flat=True).distinct())
+    refresh_rollups({album_id}, dates)
+
+
+def refresh_genre_rollups(genre_ids, dates=None):
+    """Recount the daily listens of the given primary genres on the given
+    dates (or all dates) from DailyAlbumListens.
+
+    Used directly when albums change genre.
+    """
+    genre_ids = set(genre_ids)
+    if not genre_ids:
+        return
+
+    existing = DailyGenreListens.objects.filter(genre_id__in=genre_ids)
+    album_days = DailyAlbumListens.objects.filter(
+        album__primary_genres__in=genre_ids)
+    if dates is not None:
+        existing = existing.filter(date__in=dates)
+        album_days = album_days.filter(date__in=dates)
+    counts = (album_days.order_by()
+              .values_list('album__primary_genres', 'date')
+              .annotate(listens=Sum('listens')))
+
+    with transaction.atomic():
+        existing.delete()
+        DailyGenreListens.objects.bulk_create(
+            DailyGenreListens(genre_id=genre_id, date=date, listens=listens)
+            for genre_id, date, listens in counts)
+
+
+def rebuild_rollups():
+    """Rebuild both rollup tables from scratch.
+
+    Returns the number of (album, genre) rows written.
+    """
+    counts = (Listen.objects.exclude(listen_date=None).order_by()
+              .values_list('album_id', 'listen_date')
+              .annotate(listens=Count('pk')))
+    with transaction.atomic():
+        DailyAlbumListens.objects.all().delete()
+        DailyAlbumListens.objects.bulk_create(
+            (DailyAlbumListens(album_id=album_id, date=date, listens=listens)
+             for album_id, date, listens in counts.iterator()),
+            batch_size=BATCH_SIZE)
+
+        DailyGenreListens.objects.all().delete()
+        refresh_genre_rollups(PrimaryGenre.objects.values_list('pk',
+                                                               flat=True))
+    return DailyAlbumListens.objects.count(), DailyGenreListens.objects.count()
+
+
+def album_genre_ids(album):
+    """Return the ids of an album's primary genres."""
+    return set(Album.primary_genres.through.objects.filter(album=album)
+               .values_list('primarygenre_id', flat=True))
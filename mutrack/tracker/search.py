@@ -0,0 +1,439 @@
+"""
+search.py
+
+Full-text search over artist names, album names, genres and comments.
+
+Two interchangeable indexes are provided:
+
+- FTS5Index keeps an SQLite FTS5 table (created by migration 0012 where
+  the SQLite build supports it) and is updated row by row as artists and
+  albums are saved, by background jobs--see index_album and signals.py.
+- PythonIndex is an in-memory inverted index, used with other databases or
+  SQLite builds without FTS5. It is updated document by document by the
+  same jobs, and reread from the database when another process has changed
+  artists or albums--see PythonIndex.
+
+Both match every word of the query, the last one as a prefix so results
+update as the user types, and rank results by BM25-style scores weighted by
+the field that matched.
+"""
+import bisect
+import functools
+import itertools
+import math
+import re
+import threading
+import unicodedata
+
+from django.db import connection, transaction
+
+from .caching import SEARCH_VERSION_KEY, bump_version, search_version
+from .models import Album, Artist
+
+FTS_TABLE = 'tracker_search'
+
+# Relative weight of a match in each field
+FIELD_WEIGHTS = {
+    'name': 10.0,
+    'artist': 5.0,
+    'genres': 3.0,
+    'comments': 1.0,
+}
+FIELDS = tuple(FIELD_WEIGHTS)
+
+BATCH_SIZE = 1000
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def tokenize(text):
+    """Split text into lowercase words with accents removed.
+
+    Matches the FTS5 'unicode61 remove_diacritics 2' tokenizer closely
+    enough that both indexes find the same things.
+    """
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return WORD_RE.findall(text)
+
+
+def document_id(kind, object_id):
+    """Return the id of an artist's or album's search document.
+
+    Ids interleave the two kinds so each fits in the FTS table's rowid.
+    """
+    return object_id * 2 + (kind == 'album')
+
+
+def parse_document_id(doc_id):
+    """Return (kind, object id) for a search document id."""
+    return ('album' if doc_id % 2 else 'artist'), doc_id // 2
+
+
+def artist_documents(artists):
+    """Yield (document id, fields) for each artist."""
+    for artist_id, name in artists.values_list('pk', 'name').iterator():
+        yield document_id('artist', artist_id), {
+            'name': name, 'artist': '', 'genres': '', 'comments': ''}
+
+
+def album_documents(albums):
+    """Yield (document id, fields) for each album.
+
+    An album's genres are its secondary genres and primary genre names.
+    """
+    albums = albums.select_related('artist').prefetch_related(
+        'primary_genres')
+    for album in albums:
+        genres = [album.secondary_genres]
+        genres.extend(genre.name for genre in album.primary_genres.all())
+        yield document_id('album', album.pk), {
+            'name': album.name, 'artist': album.artist.name,
+            'genres': ' '.join(genres), 'comments': album.comments}
+
+
+def all_documents():
+    yield from artist_documents(Artist.objects.order_by())
+    yield from album_documents(Album.objects.order_by())
+
+
+def fetch_results(scored):
+    """Turn [(document id, score)], best first, into result dicts.
+    """
+    ids = {'artist': [], 'album': []}
+    for doc_id, _ in scored:
+        kind, object_id = parse_document_id(doc_id)
+        ids[kind].append(object_id)
+    objects = {
+        'artist': Artist.objects.in_bulk(ids['artist']) if ids['artist']
+        else {},
+        'album': Album.objects.select_related('artist').in_bulk(ids['album'])
+        if ids['album'] else {},
+    }
+
+    results = []
+    for doc_id, score in scored:
+        kind, object_id = parse_document_id(doc_id)
+        obj = objects[kind].get(object_id)
+        if obj is None:
+            # Deleted since the index was read
+            continue
+        result = {'kind': kind, 'id': obj.pk, 'name': obj.name,
+                  'url': str(obj.get_absolute_url()), 'score': score}
+        if kind == 'album':
+            result['artist'] = obj.artist.name
+            result['year'] = obj.year
+        results.append(result)
+    return results
+
+
+class FTS5Index:
+    """Search index stored in an SQLite FTS5 table.
+    """
+    @staticmethod
+    def exists(conn):
+        """Return whether the FTS5 table has been created (by migration 0012)
+        on a database connection.
+        """
+        return FTS_TABLE in conn.introspection.table_names()
+
+    def write(self, documents):
+        """Add or replace documents, a batch at a time."""
+        documents = iter(documents)
+        while True:
+            rows = [(doc_id,) + tuple(fields[field] for field in FIELDS)
+                    for doc_id, fields in itertools.islice(documents,
+                                                           BATCH_SIZE)]
+            if not rows:
+                return
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    'DELETE FROM {} WHERE rowid = %s'.format(FTS_TABLE),
+                    [row[:1] for row in rows])
+                cursor.executemany(
+                    'INSERT INTO {} (rowid, {}) VALUES (%s{})'.format(
+                        FTS_TABLE, ', '.join(FIELDS), ', %s' * len(FIELDS)),
+                    rows)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {}'.format(FTS_TABLE))
+        self.write(all_documents())
+
+    def update(self, artists=None, albums=None):
+        """Reindex the given artist and album querysets."""
+        if artists is not None:
+            self.write(artist_documents(artists))
+        if albums is not None:
+            self.write(album_documents(albums))
+
+    def remove(self, kind, object_id):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(
+                FTS_TABLE), [document_id(kind, object_id)])
+
+    def search(self, words, limit):
+        """Return [(document id, score)] for the best matches of words."""
+        terms = ['"{}"'.format(word) for word in words]
+        terms[-1] += '*'
+        weights = ', '.join(str(FIELD_WEIGHTS[field]) for field in FIELDS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid, -bm25({table}, {weights}) AS score '
+                'FROM {table} WHERE {table} MATCH %s '
+                'ORDER BY score DESC, rowid LIMIT %s'.format(
+                    table=FTS_TABLE, weights=weights),
+                [' '.join(terms), limit])
+            return cursor.fetchall()
+
+
+class PythonIndex:
+    """In-memory inverted index, updated document by document as artists
+    and albums change.
+
+    Changes are applied once their transaction commits, and bump the search
+    version (see caching.py). The index is read from the database in full
+    when first searched, and again if the search version shows another
+    process has changed something since. A lock is held while searching and
+    changing the index, so searches never see it half-updated.
+
+    Scores are computed the same way as FTS5's bm25() function, so results
+    come out in the same order with either index.
+    """
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Search version the index is up to date with, None until it's read
+        self.version = None
+        # Maps word -> {document id: {field index: occurrences}}
+        self.postings = {}
+        # Sorted list of all words, for finding prefix matches
+        self.words = []
+        # Maps document id -> {word: {field index: occurrences}}, for
+        # removing documents
+        self.documents = {}
+        # Maps document id -> number of words in all fields
+        self.lengths = {}
+        self.total_length = 0
+
+    @property
+    def average_length(self):
+        return self.total_length / (len(self.lengths) or 1)
+
+    def load(self, version):
+        """Read every document from the database. The lock must be held.
+        """
+        self.postings = {}
+        self.documents = {}
+        self.lengths = {}
+        self.total_length = 0
+        for doc_id, fields in all_documents():
+            self.add(doc_id, fields, sort=False)
+        self.words = sorted(self.postings)
+        self.version = version
+
+    def add(self, doc_id, fields, sort=True):
+        """Add or replace a document. The lock must be held.
+
+        If sort is false, self.words isn't kept up to date.
+        """
+        self.discard(doc_id)
+        terms = {}
+        length = 0
+        for i, field in enumerate(FIELDS):
+            words = tokenize(fields[field])
+            length += len(words)
+            for word in words:
+                counts = terms.setdefault(word, {})
+                counts[i] = counts.get(i, 0) + 1
+
+        for word, counts in terms.items():
+            if word not in self.postings:
+                self.postings[word] = {}
+                if sort:
+                    bisect.insort(self.words, word)
+            self.postings[word][doc_id] = counts
+        self.documents[doc_id] = terms
+        self.lengths[doc_id] = length
+        self.total_length += length
+
+    def discard(self, doc_id):
+        """Remove a document if it's there. The lock must be held."""
+        terms = self.documents.pop(doc_id, None)
+        if terms is None:
+            return
+        for word in terms:
+            postings = self.postings[word]
+            del postings[doc_id]
+            if not postings:
+                del self.postings[word]
+                del self.words[bisect.bisect_left(self.words, word)]
+        self.total_length -= self.lengths.pop(doc_id)
+
+    def apply(self, change=None):
+        """Apply a change to the index, a function called with the lock held,
+        and bump the search version.
+
+        The change is only applied if the index was up to date, and the new
+        version only adopted if nothing else has bumped it since; otherwise
+        the index is reread by the next search.
+        """
+        with self.lock:
+            current = (self.version is not None
+                       and self.version == search_version())
+            if current:
+                change()
+            _, version = bump_version(SEARCH_VERSION_KEY)
+            if current and search_version() == version:
+                self.version = version
+            else:
+                self.version = None
+
+    def rebuild(self):
+        """Have this and other processes' indexes reread the database by
+        their next search, once the current transaction commits.
+        """
+        transaction.on_commit(self.apply)
+
+    def update(self, artists=None, albums=None):
+        """Reindex the given artist and album querysets, once the current
+        transaction commits.
+        """
+        def change():
+            if artists is not None:
+                for doc_id, fields in artist_documents(artists):
+                    self.add(doc_id, fields)
+            if albums is not None:
+                for doc_id, fields in album_documents(albums):
+                    self.add(doc_id, fields)
+        transaction.on_commit(functools.partial(self.apply, change))
+
+    def remove(self, kind, object_id):
+        """Remove an artist or album, once the current transaction commits.
+        """
+        transaction.on_commit(functools.partial(
+            self.apply,
+            functools.partial(self.discard, document_id(kind, object_id))))
+
+    def matches(self, word, prefix):
+        """Return {document id: {field index: occurrences}} for a word, or
+        for all words starting with it if prefix is true.
+        """
+        if not prefix:
+            return self.postings.get(word, {})
+        matches = {}
+        i = bisect.bisect_left(self.words, word)
+        while i < len(self.words) and self.words[i].startswith(word):
+            for doc_id, counts in self.postings[self.words[i]].items():
+                doc_counts = matches.setdefault(doc_id, {})
+                for field, count in counts.items():
+                    doc_counts[field] = doc_counts.get(field, 0) + count
+            i += 1
+        return matches
+
+    def term_scores(self, matches):
+        """Return the BM25 score of one query term for each document it
+        matches.
+
+        As in FTS5, occurrences are weighted by field before being
+        combined, and documents are normalized by their total length.
+        """
+        num_documents = len(self.lengths)
+        idf = math.log((num_documents - len(matches) + 0.5)
+                       / (len(matches) + 0.5))
+        idf = max(idf, 1e-6)
+        weights = [FIELD_WEIGHTS[field] for field in FIELDS]
+
+        scores = {}
+        for doc_id, counts in matches.items():
+            frequency = sum(weights[field] * count
+                            for field, count in counts.items())
+            length = self.lengths[doc_id] / (self.average_length or 1)
+            scores[doc_id] = idf * frequency * (self.k1 + 1) / (
+                frequency + self.k1 * (1 - self.b + self.b * length))
+        return scores
+
+    def search(self, words, limit):
+        """Return [(document id, score)] for the best matches of words."""
+        with self.lock:
+            version = search_version()
+            if self.version != version:
+                self.load(version)
+            return self.best_matches(words, limit)
+
+    def best_matches(self, words, limit):
+        """Search the index. The lock must be held."""
+        scores = None
+        for i, word in enumerate(words):
+            term_scores = self.term_scores(
+                self.matches(word, i == len(words) - 1))
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {doc_id: score + term_scores[doc_id]
+                          for doc_id, score in scores.items()
+                          if doc_id in term_scores}
+            if not scores:
+                return []
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0])
+                      )[:limit]
+
+
+_python_index = PythonIndex()
+_use_fts5 = None
+
+
+def get_index():
+    """Return the search index for the default database.
+
+    Whether to use FTS5 is decided the first time this is called.
+    """
+    global _use_fts5
+    if _use_fts5 is None:
+        _use_fts5 = FTS5Index.exists(connection)
+    return FTS5Index() if _use_fts5 else _python_index
+
+
+def index_album(album_id):
+    """Reindex an album, or remove it from the index if it's been deleted.
+
+    Run as a background job (see jobs.py), as are the two below.
+    """
+    albums = Album.objects.filter(pk=album_id)
+    if albums.exists():
+        get_index().update(albums=albums)
+    else:
+        get_index().remove('album', album_id)
+
+
+def index_artist(artist_id):
+    """Reindex an artist and their albums, which include the artist's name,
+    or remove the artist from the index if they've been deleted.
+    """
+    artists = Artist.objects.filter(pk=artist_id)
+    if artists.exists():
+        get_index().update(artists=artists,
+                           albums=Album.objects.filter(artist_id=artist_id))
+    else:
+        get_index().remove('artist', artist_id)
+
+
+def index_genre(genre_id):
+    """Reindex the albums in a primary genre, which include its name.
+    """
+    get_index().update(albums=Album.objects.filter(primary_genres=genre_id))
+
+
+def search(query, limit=DEFAULT_LIMIT):
+    """Search artists and albums, returning a list of result dicts, best
+    match first.
+    """
+    words = tokenize(query)
+    if not words:
+        return []
+    return fetch_results(get_index().search(words, limit))
@@ -0,0 +1,216 @@
+"""
+signals.py
+
+Signal receivers keeping data derived from the tracker models up to date.
+
+Only what has to be right straight after a save is done here: fields of the
+rows being saved, the copies of artists' names albums are ordered by, the
+cache versions, and the recommender's arrays. Everything else is left to
+background jobs (see jobs.py).
+
+Connected in TrackerConfig.ready.
+"""
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from . import jobs, recommendations
+from .caching import data_changed
+from .models import Album, Artist, Listen, PrimaryGenre, normalize_name
+from .rollups import album_genre_ids
+
+
+@receiver(pre_save, sender=Artist)
+@receiver(pre_save, sender=Album)
+def set_name_key(sender, instance, **kwargs):
+    """Set the case-insensitive lookup key from the name.
+
+    Done on pre_save rather than in save() so fixtures get it too.
+    """
+    instance.name_key = normalize_name(instance.name)
+
+
+@receiver(pre_save, sender=Album)
+def set_sort_artist_name(sender, instance, **kwargs):
+    """Copy the artist's name onto the album, for ordering albums.
+    """
+    instance.sort_artist_name = instance.artist.name
+
+
+@receiver(post_save, sender=Artist)
+def update_sort_artist_names(sender, instance, **kwargs):
+    """Update the copies of a renamed artist's name on their albums.
+    """
+    (Album.objects.filter(artist=instance)
+     .exclude(sort_artist_name=instance.name)
+     .update(sort_artist_name=instance.name))
+
+
+@receiver(pre_save, sender=Listen)
+def remember_previous_album(sender, instance, raw, **kwargs):
+    """Note which album an edited listen used to belong to.
+
+    If the album changed, derived data for both the old and new albums needs
+    updating.
+    """
+    if instance.pk is not None and not raw:
+        instance._previous_album_id = (
+            Listen.objects.filter(pk=instance.pk)
+            .values_list('album_id', flat=True).first())
+
+
+@receiver(m2m_changed, sender=Album.primary_genres.through)
+def remember_cleared_genres(sender, instance, action, reverse, **kwargs):
+    """Note which genres an album is about to be removed from, or which
+    albums a genre is about to lose, as post_clear doesn't say.
+    """
+    if action != 'pre_clear':
+        return
+    if reverse:
+        instance._cleared_album_ids = set(
+            instance.album_set.values_list('pk', flat=True))
+    else:
+        instance._cleared_genre_ids = album_genre_ids(instance)
+
+
+@receiver(pre_delete, sender=Album)
+def remember_album_genres(sender, instance, **kwargs):
+    """Note a deleted album's genres, whose rollups need recounting once it's
+    gone.
+    """
+    instance._deleted_genre_ids = album_genre_ids(instance)
+
+
+@receiver(pre_delete, sender=PrimaryGenre)
+def remember_genre_albums(sender, instance, **kwargs):
+    """Note a deleted genre's albums, which need reindexing once it's gone.
+    """
+    instance._deleted_album_ids = set(
+        instance.album_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Album)
+@receiver(post_save, sender=Artist)
+@receiver(post_save, sender=PrimaryGenre)
+@receiver(post_delete, sender=Album)
+@receiver(post_delete, sender=Artist)
+@receiver(post_delete, sender=Listen)
+@receiver(post_delete, sender=PrimaryGenre)
+@receiver(m2m_changed, sender=Album.primary_genres.through)
+def bump_data_version_on_change(sender, **kwargs):
+    """Mark cached pages as stale when tracker data changes.
+    """
+    data_changed()
+
+
+@receiver(pre_save, sender=Listen)
+def note_recommender_state(sender, instance, raw, **kwargs):
+    """Note whether the recommender can be updated for a new listen.
+    """
+    if instance.pk is None and not raw:
+        recommendations.listen_saving(instance)
+
+
+@receiver(post_save, sender=Listen)
+def listen_changed(sender, instance, created, raw, **kwargs):
+    """Mark cached pages as stale when a listen is saved, and update the
+    recommender's arrays for a new one once it's committed.
+    """
+    committed = None
+    if created and not raw:
+        committed = recommendations.listen_saved(instance)
+    data_changed(committed)
+
+
+# The receivers below enqueue background jobs (see jobs.py) for the data
+# derived from what changed. Jobs for raw saves (loading fixtures) are only
+# left out for play counts, which fixtures hold already.
+
+@receiver(post_save, sender=Listen)
+def enqueue_listen_jobs(sender, instance, raw, **kwargs):
+    """Enqueue the jobs for an added or edited listen's albums.
+    """
+    for album_id in {instance.album_id,
+                     getattr(instance, '_previous_album_id', None)} - {None}:
+        if not raw:
+            jobs.enqueue('listen_stats', album_id)
+        jobs.enqueue('rollups', album_id)
+
+
+@receiver(post_delete, sender=Listen)
+def enqueue_listen_delete_jobs(sender, instance, **kwargs):
+    """Enqueue the jobs for a deleted listen's album.
+    """
+    jobs.enqueue('listen_stats', instance.album_id)
+    jobs.enqueue('rollups', instance.album_id)
+
+
+@receiver(post_save, sender=Album)
+def enqueue_album_jobs(sender, instance, **kwargs):
+    """Enqueue the jobs for a saved album, whose secondary genres may have
+    changed.
+    """
+    jobs.enqueue('genre_tags', instance.pk)
+    jobs.enqueue('index_album', instance.pk)
+
+
+@receiver(post_delete, sender=Album)
+def enqueue_album_delete_jobs(sender, instance, **kwargs):
+    """Enqueue the jobs for a deleted album and its genres.
+    """
+    jobs.enqueue('index_album', instance.pk)
+    for genre_id in getattr(instance, '_deleted_genre_ids', set()):
+        jobs.enqueue('genre_rollups', genre_id)
+
+
+@receiver(post_save, sender=Artist)
+@receiver(post_delete, sender=Artist)
+def enqueue_artist_jobs(sender, instance, **kwargs):
+    """Enqueue the jobs for a saved or deleted artist.
+    """
+    jobs.enqueue('index_artist', instance.pk)
+
+
+@receiver(post_save, sender=PrimaryGenre)
+def enqueue_genre_jobs(sender, instance, **kwargs):
+    """Enqueue the jobs for a saved primary genre, whose albums are indexed
+    with its name.
+    """
+    jobs.enqueue('index_genre', instance.pk)
+
+
+@receiver(post_delete, sender=PrimaryGenre)
+def enqueue_genre_delete_jobs(sender, instance, **kwargs):
+    """Enqueue the jobs for a deleted genre's albums.
+    """
+    for album_id in getattr(instance, '_deleted_album_ids', set()):
+        jobs.enqueue('index_album', album_id)
+        jobs.enqueue('similarities', album_id)
+
+
+@receiver(m2m_changed, sender=Album.primary_genres.through)
+def enqueue_genre_change_jobs(sender, instance, action, reverse, pk_set,
+                              **kwargs):
+    """Enqueue the jobs for albums added to or removed from genres, and for
+    the genres.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if reverse:
+        genre_ids = {instance.pk}
+        if action == 'post_clear':
+            album_ids = getattr(instance, '_cleared_album_ids', set())
+        else:
+            album_ids = pk_set
+    else:
+        album_ids = {instance.pk}
+        if action == 'post_clear':
+            genre_ids = getattr(instance, '_cleared_genre_ids', set())
+        else:
+            genre_ids = pk_set
+    for genre_id in genre_ids:
+        jobs.enqueue('genre_rollups', genre_id)
+    for album_id in album_ids:
+        jobs.enqueue('index_album', album_id)
+        jobs.enqueue('similarities', album_id)
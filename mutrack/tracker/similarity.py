@@ -0,0 +1,348 @@
+"""
+similarity.py
+
+Similar albums and artists, for the album and artist pages.
+
+Two albums are similar if they're listened to in the same listening
+sessions, or share genres. Two sparse album-by-album matrices are built,
+held as NumPy arrays of (row, column, value) entries:
+
+- co-listens: the number of pairs of days, one on which each album was
+  played, no more than TRACKER_SESSION_DAYS apart, divided by the square root
+  of the product of the numbers of days each was played on
+- genre overlap: the cosine similarity of the albums' primary genres and
+  genre tags (see genres.genre_features). Genres with more than
+  GENERIC_GENRE_ALBUMS albums are left out of this, as sharing them says
+  little and they would make the matrix dense.
+
+An album's similarity to another is its co-listen entry plus its genre
+overlap entry times TRACKER_SIMILARITY_GENRE_WEIGHT. Each album keeps its
+TRACKER_SIMILAR_COUNT most similar albums as SimilarAlbum rows, so showing
+them is one indexed query. An artist's similarity to another is the sum of
+their albums' similarities, divided by the square root of the product of
+their numbers of albums, and kept the same way as SimilarArtist rows.
+
+rebuild_similarities works out everything; the build_similarities
+management command runs it. After that, album_changed (run as a background
+job, see jobs.py) brings the lists an album's new or changed listens or
+genres affect up to date. Deleted albums and artists, and albums moved to
+another artist, are only dropped from or updated in other lists by the next
+rebuild.
+"""
+import datetime
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .genres import genre_features
+from .models import (Album, DailyAlbumListens, SimilarAlbum, SimilarArtist)
+
+GENERIC_GENRE_ALBUMS = 200
+
+# Albums scored at once by rebuild_similarities, bounding memory use
+BATCH_SIZE = 1000
+
+
+def as_pairs(rows):
+    """Return a list of pairs as a two-column int64 array."""
+    return np.array(list(rows), dtype=np.int64).reshape(-1, 2)
+
+
+def album_day_pairs(rows):
+    """Return (album id, date) rows as an array of (album, day number).
+    """
+    rows = list(rows)
+    return np.stack([
+        np.array([album_id for album_id, _ in rows], dtype=np.int64),
+        np.array([date for _, date in rows],
+                 dtype='datetime64[D]').astype(np.int64)], axis=1)
+
+
+def value_counts(values):
+    """Return (value, count) pairs for the distinct values in an array."""
+    return np.stack(np.unique(values, return_counts=True), axis=1)
+
+
+def concatenate(parts, width=3):
+    """Join lists of arrays (e.g. sparse matrix entries) column by column.
+    """
+    if not parts:
+        return [np.zeros(0, dtype=np.int64)] * width
+    return [np.concatenate(column) for column in zip(*parts)]
+
+
+def lookup(pairs, wanted):
+    """Return the values for the wanted keys from (key, value) pairs sorted
+    by key, with 0 for missing keys.
+    """
+    if not len(pairs):
+        return np.zeros(len(wanted), dtype=np.int64)
+    at = np.minimum(np.searchsorted(pairs[:, 0], wanted), len(pairs) - 1)
+    return np.where(pairs[at, 0] == wanted, pairs[at, 1], 0)
+
+
+def join(left, right):
+    """Return (i, j) index arrays of every pair with left[i] == right[j],
+    given right sorted.
+    """
+    start = np.searchsorted(right, left, 'left')
+    counts = np.searchsorted(right, left, 'right') - start
+    i = np.repeat(np.arange(len(left)), counts)
+    # Position of each pair within its run of matches
+    offsets = np.arange(len(i)) - np.repeat(np.cumsum(counts) - counts,
+                                            counts)
+    return i, start[i] + offsets
+
+
+def sum_entries(rows, columns, values):
+    """Add up values with the same (row, column), returning the distinct
+    entries of a sparse matrix as (rows, columns, values).
+    """
+    if not len(rows):
+        return rows, columns, np.asarray(values, dtype=np.float64)
+    base = int(columns.max()) + 1
+    keys, inverse = np.unique(rows * base + columns, return_inverse=True)
+    return (keys // base, keys % base,
+            np.bincount(inverse.reshape(-1), weights=values))
+
+
+def normalize(rows, columns, values, counts):
+    """Divide sparse matrix entries by the square root of the product of
+    their row's and column's counts, given as sorted (id, count) pairs.
+    """
+    return rows, columns, values / np.sqrt(lookup(counts, rows)
+                                           * lookup(counts, columns))
+
+
+class ListeningData:
+    """The days each album was played on and the albums' genre features, as
+    sorted arrays, for scoring albums against each other.
+
+    Built from everything by load_all, or from just what some albums need by
+    load_for.
+    """
+    def __init__(self, album_days, day_counts, links, feature_counts,
+                 feature_sizes):
+        # (album, day) pairs, as two arrays sorted by day
+        order = np.argsort(album_days[:, 1], kind='stable')
+        self.day_albums = album_days[order, 0]
+        self.days = album_days[order, 1]
+        # (album, feature) pairs without the generic features, as two arrays
+        # sorted by feature
+        sizes = feature_sizes[np.argsort(feature_sizes[:, 0])]
+        links = links[lookup(sizes, links[:, 1]) <= GENERIC_GENRE_ALBUMS]
+        order = np.argsort(links[:, 1], kind='stable')
+        self.link_albums = links[order, 0]
+        self.link_features = links[order, 1]
+        # (album, days played) and (album, features) pairs, sorted by album
+        self.day_counts = day_counts[np.argsort(day_counts[:, 0])]
+        self.feature_counts = feature_counts[
+            np.argsort(feature_counts[:, 0])]
+
+    @classmethod
+    def load_all(cls):
+        album_days = album_day_pairs(
+            DailyAlbumListens.objects.order_by().values_list('album_id',
+                                                             'date'))
+        links = as_pairs(genre_features())
+        return cls(album_days, value_counts(album_days[:, 0]), links,
+                   value_counts(links[:, 0]), value_counts(links[:, 1]))
+
+    @classmethod
+    def load_for(cls, album_ids):
+        """Load what's needed to score the given albums against all the
+        others.
+        """
+        album_ids = set(album_ids)
+        session = settings.TRACKER_SESSION_DAYS
+        dates = set(DailyAlbumListens.objects.filter(album_id__in=album_ids)
+                    .values_list('date', flat=True))
+        near = {date + datetime.timedelta(days=offset) for date in dates
+                for offset in range(-session, session + 1)}
+        album_days = album_day_pairs(
+            DailyAlbumListens.objects.filter(date__in=near).order_by()
+            .values_list('album_id', 'date'))
+        day_counts = as_pairs(
+            DailyAlbumListens.objects.filter(
+                album_id__in=set(album_days[:, 0].tolist()))
+            .order_by().values('album').annotate(days=Count('pk'))
+            .values_list('album', 'days'))
+
+        features = {feature for _, feature in genre_features(album_ids)}
+        links = as_pairs(genre_features(features=features))
+        others = as_pairs(genre_features(set(links[:, 0].tolist())))
+        return cls(album_days, day_counts, links, value_counts(others[:, 0]),
+                   value_counts(links[:, 1]))
+
+    def scores(self, album_ids):
+        """Return the similarity of the given albums to every other album
+        they have anything in common with, as sparse matrix entries (albums,
+        others, scores).
+        """
+        album_ids = np.asarray(list(album_ids), dtype=np.int64)
+        colisten = self.colisten_entries(album_ids)
+        genre = self.genre_entries(album_ids)
+        weight = settings.TRACKER_SIMILARITY_GENRE_WEIGHT
+        return sum_entries(
+            np.concatenate([colisten[0], genre[0]]),
+            np.concatenate([colisten[1], genre[1]]),
+            np.concatenate([colisten[2], genre[2] * weight]))
+
+    def colisten_entries(self, album_ids):
+        mine = np.isin(self.day_albums, album_ids)
+        albums, days = self.day_albums[mine], self.days[mine]
+        session = settings.TRACKER_SESSION_DAYS
+        rows, columns = [], []
+        for offset in range(-session, session + 1):
+            i, j = join(days + offset, self.days)
+            rows.append(albums[i])
+            columns.append(self.day_albums[j])
+        rows, columns = np.concatenate(rows), np.concatenate(columns)
+        other = rows != columns
+        return normalize(*sum_entries(rows[other], columns[other],
+                                      np.ones(other.sum())),
+                         self.day_counts)
+
+    def genre_entries(self, album_ids):
+        mine = np.isin(self.link_albums, album_ids)
+        i, j = join(self.link_features[mine], self.link_features)
+        rows = self.link_albums[mine][i]
+        columns = self.link_albums[j]
+        other = rows != columns
+        return normalize(*sum_entries(rows[other], columns[other],
+                                      np.ones(other.sum())),
+                         self.feature_counts)
+
+
+def top(rows, columns, scores, count):
+    """Return the best scoring count entries of each row of a sparse matrix,
+    as (rows, columns, scores, ranks), best first.
+    """
+    # Ties go to the older album or artist
+    order = np.lexsort((columns, -scores, rows))
+    rows, columns, scores = rows[order], columns[order], scores[order]
+    ranks = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = ranks < count
+    return rows[keep], columns[keep], scores[keep], ranks[keep]
+
+
+def artist_entries(rows, columns, scores, artists, album_counts):
+    """Sum album similarities into artist similarities.
+
+    artists and album_counts are (album, artist) and (artist, albums) pairs,
+    sorted by their first column.
+    """
+    rows, columns = lookup(artists, rows), lookup(artists, columns)
+    # Deleted albums have no artist (0)
+    other = (rows != columns) & (rows > 0) & (columns > 0)
+    return normalize(*sum_entries(rows[other], columns[other],
+                                  scores[other]), album_counts)
+
+
+def album_artists(album_ids=None):
+    """Return (album, artist) pairs, sorted by album."""
+    albums = Album.objects.order_by('pk')
+    if album_ids is not None:
+        albums = albums.filter(pk__in=album_ids)
+    return as_pairs(albums.values_list('pk', 'artist_id'))
+
+
+def artist_album_counts(artist_ids=None):
+    """Return (artist, number of albums) pairs, sorted by artist."""
+    albums = Album.objects.all()
+    if artist_ids is not None:
+        albums = albums.filter(artist_id__in=artist_ids)
+    return as_pairs(albums.order_by('artist_id').values('artist')
+                    .annotate(albums=Count('pk'))
+                    .values_list('artist', 'albums'))
+
+
+def save_similar(model, field, ids, entries):
+    """Replace the similar albums or artists of the given albums or artists
+    (or all of them if ids is None) with the best of the sparse matrix
+    entries.
+    """
+    rows, columns, scores, ranks = top(*entries,
+                                       settings.TRACKER_SIMILAR_COUNT)
+    existing = model.objects.all()
+    if ids is not None:
+        existing = existing.filter(**{field + '__in': ids})
+    existing.delete()
+    model.objects.bulk_create(
+        (model(**{field + '_id': row, 'similar_id': column,
+                  'rank': rank, 'score': score})
+         for row, column, score, rank in zip(rows.tolist(), columns.tolist(),
+                                             scores.tolist(), ranks.tolist())),
+        batch_size=BATCH_SIZE)
+
+
+def rebuild_similarities():
+    """Work out the similar albums and artists of every album and artist.
+
+    Returns the number of (SimilarAlbum, SimilarArtist) rows written.
+    """
+    data = ListeningData.load_all()
+    artists = album_artists()
+    album_counts = artist_album_counts()
+
+    album_parts = []
+    artist_parts = []
+    for start in range(0, len(artists), BATCH_SIZE):
+        entries = data.scores(artists[start:start + BATCH_SIZE, 0])
+        # Keeping only the best bounds memory use
+        album_parts.append(top(*entries, settings.TRACKER_SIMILAR_COUNT)[:3])
+        artist_parts.append(artist_entries(*entries, artists, album_counts))
+
+    with transaction.atomic():
+        save_similar(SimilarAlbum, 'album', None, concatenate(album_parts))
+        # An artist's albums can be in different batches
+        save_similar(SimilarArtist, 'artist', None,
+                     sum_entries(*concatenate(artist_parts)))
+    return SimilarAlbum.objects.count(), SimilarArtist.objects.count()
+
+
+def refresh_similarities(album_ids):
+    """Work out again the similar albums of the given albums, and the similar
+    artists of their artists and of artists listing those.
+    """
+    album_ids = set(album_ids)
+    artist_ids = set(Album.objects.filter(pk__in=album_ids)
+                     .values_list('artist_id', flat=True))
+    artist_ids.update(SimilarArtist.objects.filter(similar__in=artist_ids)
+                      .values_list('artist_id', flat=True))
+    # Artists' scores come from all their albums'
+    sources = album_ids | set(Album.objects.filter(artist__in=artist_ids)
+                              .values_list('pk', flat=True))
+
+    rows, columns, scores = ListeningData.load_for(sources).scores(sources)
+    artists = album_artists(set(rows.tolist()) | set(columns.tolist()))
+    album_counts = artist_album_counts(set(artists[:, 1].tolist()))
+    artist_rows, artist_columns, artist_scores = artist_entries(
+        rows, columns, scores, artists, album_counts)
+
+    mine = np.isin(rows, list(album_ids))
+    artists_mine = np.isin(artist_rows, list(artist_ids))
+    with transaction.atomic():
+        save_similar(SimilarAlbum, 'album', album_ids,
+                     (rows[mine], columns[mine], scores[mine]))
+        save_similar(SimilarArtist, 'artist', artist_ids,
+                     (artist_rows[artists_mine],
+                      artist_columns[artists_mine],
+                      artist_scores[artists_mine]))
+
+
+def album_changed(album_id):
+    """Bring the similar albums and artists up to date after an album's
+    listens or genres change.
+
+    Refreshes the album, the albums it has anything in common with (whose
+    similarity to it may have changed), and the albums listing it.
+    """
+    _, others, _ = ListeningData.load_for([album_id]).scores([album_id])
+    album_ids = set(others.tolist())
+    album_ids.add(album_id)
+    album_ids.update(SimilarAlbum.objects.filter(similar_id=album_id)
+                     .values_list('album_id', flat=True))
+    refresh_similarities(album_ids)
@@ -0,0 +1,90 @@
+/*
+Album autocomplete widget (see AlbumAutocompleteWidget in forms.py).
+*/
+
+(function() {
+  // Wait for a pause in typing before fetching matches
+  var delay = 150;
+
+  document.querySelectorAll('.album-autocomplete').forEach(setUp);
+
+  //-------------------------- Function definitions -------------------------//
+
+  /**
+   * setUp - Attach event handlers to one autocomplete widget.
+   */
+  function setUp(widget) {
+    var input = widget.querySelector('.album-autocomplete-input');
+    var hidden = widget.querySelector('input[type="hidden"]');
+    var menu = widget.querySelector('.album-autocomplete-results');
+    var timer = null;
+    // Number of the latest request, so slow responses to earlier ones are
+    // ignored
+    var latest = 0;
+
+    input.addEventListener('input', function() {
+      // Typing clears the choice until a match is picked
+      hidden.value = '';
+      clearTimeout(timer);
+      timer = setTimeout(fetchMatches, delay);
+    });
+    input.addEventListener('keydown', function(event) {
+      if (event.key === 'Enter' && menu.classList.contains('show')) {
+        // Pick the first match rather than submitting the form
+        event.preventDefault();
+        var first = menu.querySelector('a');
+        if (first !== null) {
+          first.click();
+        }
+      } else if (event.key === 'Escape') {
+        menu.classList.remove('show');
+      }
+    });
+    document.addEventListener('click', function(event) {
+      if (!widget.contains(event.target)) {
+        menu.classList.remove('show');
+      }
+    });
+
+    function fetchMatches() {
+      var query = input.value.trim();
+      if (!query) {
+        menu.classList.remove('show');
+        return;
+      }
+      var request = ++latest;
+      var url = input.dataset.url + '?q=' + encodeURIComponent(query);
+      fetch(url, {credentials: 'same-origin'})
+        .then(function(response) { return response.json(); })
+        .then(function(data) {
+          if (request === latest) {
+            showMatches(data.results);
+          }
+        });
+    }
+
+    function showMatches(results) {
+      menu.textContent = '';
+      if (!results.length) {
+        var empty = document.createElement('span');
+        empty.className = 'dropdown-item-text text-muted';
+        empty.textContent = 'No matching albums';
+        menu.appendChild(empty);
+      }
+      results.forEach(function(result) {
+        var item = document.createElement('a');
+        item.className = 'dropdown-item';
+        item.href = '#';
+        item.textContent = result.label + ' (' + result.year + ')';
+        item.addEventListener('click', function(event) {
+          event.preventDefault();
+          hidden.value = result.id;
+          input.value = result.label;
+          menu.classList.remove('show');
+        });
+        menu.appendChild(item);
+      });
+      menu.classList.add('show');
+    }
+  }
+})();
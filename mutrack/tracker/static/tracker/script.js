@@ -1,249 +1,279 @@
 /*
 Javascript file for tracker application.
+
+The index page's album table is sent as columnar data (see
+api.album_table_payload) in the #album-table-data script element. Filters
+are compiled once per keystroke into tests on row numbers, then run in a
+single pass over the typed column arrays, and only matching rows are turned
+into HTML--a batch at a time, as the table is scrolled.
 */
 
-// Attach event handlers for search inputs
-$('#artist-search').keyup(filterRowsEvent);
-$('#album-search').keyup(filterRowsEvent);
-$('#year-search').keyup(filterRowsEvent);
-$('#rating-search').keyup(filterRowsEvent);
-$('#genre-search').keyup(filterRowsEvent);
-$('#plays-search').keyup(filterRowsEvent);
-$('#last-listen-search').keyup(filterRowsEvent);
+// Search input id -> column filtered
+const FILTER_INPUTS = {
+  'artist-search': 'artist',
+  'album-search': 'album',
+  'year-search': 'year',
+  'rating-search': 'rating',
+  'genre-search': 'genres',
+  'plays-search': 'plays',
+  'last-listen-search': 'last_listen',
+};
 
-// Run once when document is ready in case of back button
-$(document).ready(filterRows);
+// Rows rendered at a time
+const RENDER_BATCH = 200;
 
-/** Case-insensitive contains selector */
-jQuery.expr[':'].containsNoCase = function(a, i, m) {
-  return jQuery(a).text().toUpperCase()
-      .indexOf(m[3].toUpperCase()) >= 0;
-};
+const MS_PER_DAY = 24 * 60 * 60 * 1000;
 
-//-------------------------- Function definitions ---------------------------//
+var table = null;
+var visibleRows = [];
+var renderedCount = 0;
 
-/**
- * filterRowsEvent - Wrapper for filterRows in the form of an event handler.
- * Event object not necessary for the filtering.
- */
-function filterRowsEvent(event) {
-  filterRows();
+// Attach event handlers for search inputs
+for (let inputId in FILTER_INPUTS) {
+  $('#' + inputId).keyup(filterRowsEvent);
 }
 
-/**
- * filterRows - Filter table rows on index page based on search inputs
- */
-function filterRows() {
-  // Start by marking all rows as not filtered out
-  var allRows = $('.album-data-row');
-  for (i = 0; i < allRows.length; i++) {
-    let row = allRows[i];
-    row.setAttribute('filtered-out', 'false');
+// Load the table and run once when document is ready in case of back button
+$(document).ready(function() {
+  let data = document.getElementById('album-table-data');
+  if (data) {
+    table = loadTable(JSON.parse(data.textContent));
+    watchForScrolling();
+    filterRows();
   }
+});
 
-  //---- Mark rows as filtered out according to the search inputs
-  // Regular 'contains' filters for text cells
-  markRowsForFilter('artist-cell', $('#artist-search').val());
-  markRowsForFilter('album-cell', $('#album-search').val());
-  markRowsForFilter('genre-cell', $('#genre-search').val());
-
-  // Numeric fileters for year, rating, and plays
-  markRowsForFilterNumeric('year-cell', $('#year-search').val());
-  markRowsForFilterNumeric('rating-cell', $('#rating-search').val());
-  markRowsForFilterNumeric('plays-cell', $('#plays-search').val());
-
-  // Numeric date filter for last listen
-  markRowsForFilterNumeric(
-    'last-listen-cell', $('#last-listen-search').val(), date=true);
-
-  // Hide and show rows appropriately
-  $('tr[filtered-out="false"]').show();
-  $('tr[filtered-out="true"]').hide();
-}
+//-------------------------- Function definitions ---------------------------//
 
 /**
- * markRowsForFilter - Mark table rows for filtering based on string matching
- * some text
+ * loadTable - Turn the album table data from the server into typed column
+ * arrays
  *
- * Function looks for all HTML elements with the specified CSS class, and does
- * string matching on their contents. If the desired text is not found, parent
- * 'tr' elements are given the attribute 'filtered-out' with the value 'true'.
+ * Numbers go into typed arrays, with NaN standing for albums with no last
+ * listen date. Text for substring matching is made lazily, the first time a
+ * column is filtered on (see columnText).
  *
- * Multiple strings to match may be included using commas for 'and' operator or
- * pipes for 'or' behavior.
+ * @param {object} data - the album table data from the server
+ * @return {object} - the table
+ */
+function loadTable(data) {
+  let albums = data.albums;
+  let lastListen = new Float64Array(albums.last_listen.length);
+  for (let i = 0; i < lastListen.length; i++) {
+    let day = albums.last_listen[i];
+    lastListen[i] = day === null ? NaN : day;
+  }
+  return {
+    length: albums.id.length,
+    urls: data.urls,
+    strings: data.strings,
+    artistNames: data.artists.name,
+    artist: Int32Array.from(albums.artist),
+    name: albums.name,
+    year: Int32Array.from(albums.year),
+    rating: Float64Array.from(albums.rating),
+    plays: Int32Array.from(albums.plays),
+    last_listen: lastListen,
+    genres: Int32Array.from(albums.genres),
+    comments: Int32Array.from(albums.comments),
+    text: {},
+  };
+}
+
+/**
+ * columnText - Get the upper-cased text shown in each row's cell for a
+ * column, for case-insensitive substring matching
  *
- * E.g.:
- * - 'metal | rock' - matches any cell with 'metal' or 'rock' in it
- * - 'indie, post rock' - matches any cell with 'indie' and 'post rock' in it
+ * Made the first time it's needed and kept. The artist and genre columns
+ * give the text per artist and per unique string, with a function mapping
+ * rows to them.
  *
- * @param {string} cellClass - CSS class to search
- * @param {string} text - text to search for in cells (not case sensitive)
+ * @param {string} column - column name
+ * @return {function} - function from row number to upper-cased cell text
  */
-function markRowsForFilter(cellClass, text) {
-  text = text.trim();
-
-  // Split selections separated by commas and call function recursively
-  if (text.includes(',')) {
-    let textSplits = text.split(',');
-    for (let i = 0; i < textSplits.length; i++) {
-      markRowsForFilter(cellClass, textSplits[i]);
-    }
-  } else {
-
-    var selector = '.CLS:not('.replace('CLS', cellClass);
-
-    // Check for | for 'or'
-    if (text.includes('|')) {
-      let textSplits = text.split('|');
-
-      // Construct selector
-      for (let i = 0; i < textSplits.length; i++) {
-        let subText = textSplits[i].trim();
-        selector = selector.concat(
-          getIndividualFilterSelector(cellClass, subText));
-        if (i != textSplits.length-1) {
-          selector = selector.concat(', ');
-        }
-      }
-
+function columnText(column) {
+  if (!(column in table.text)) {
+    let upper = text => text.toUpperCase();
+    if (column == 'artist') {
+      let names = table.artistNames.map(upper);
+      table.text[column] = i => names[table.artist[i]];
+    } else if (column == 'genres') {
+      let strings = table.strings.map(upper);
+      table.text[column] = i => strings[table.genres[i]];
     } else {
-      // Find cells with given class that don't contain the text
-      selector = selector.concat(getIndividualFilterSelector(cellClass, text));
+      let cells = new Array(table.length);
+      for (let i = 0; i < table.length; i++) {
+        cells[i] = upper(cellText(column, i));
+      }
+      table.text[column] = i => cells[i];
     }
-
-    selector = selector.concat(')')
-
-    // Mark the rows using the 'filtered-out' attribute
-    let nomatch = $(selector);
-    let rowsToMark = nomatch.parents('tr');
-    rowsToMark.attr('filtered-out', 'true');
   }
+  return table.text[column];
 }
 
-
 /**
- * getIndividualFilterSelector - get selector for text filtering
+ * cellText - Get the text shown in a row's cell for a column
  *
- * Get a CSS selector (for jQuery) for selecting all elements of a given
- * class based on some text from a search input.
+ * Numbers and dates are shown the way the server used to render them, so
+ * substring filters match the same cells as the server-side filters in
+ * filters.py.
  *
- * Nominally, the selector will simply do case-insensitive string matching
- * based on filterText. This behavior is changed if filterText contains any
- * of the following special characters:
- * - If the text starts with '!', will return a selector for elements that
- *   do *not* contain the given text
- *
- * filterText should not have any leading/trailing whitespace
- *
- * @param  {string} cellClass  class of elements being filtered
- * @param  {string} filterText text we are filtering on
- * @return {type}            description
+ * @param {string} column - column name
+ * @param {number} i - row number
+ * @return {string} - the cell's text
  */
-function getIndividualFilterSelector(cellClass, filterText) {
-
-  // Put together base selector
-  if (filterText.startsWith('!')) {
-    filterText = filterText.substring(1);
-    var selector =
-      ".CLS:not(.CLS:containsNoCase('TEXT'))".replace('CLS', cellClass);
-  } else {
-    var selector = ".CLS:containsNoCase('TEXT')";
+function cellText(column, i) {
+  switch (column) {
+    case 'artist':
+      return table.artistNames[table.artist[i]];
+    case 'album':
+      return table.name[i];
+    case 'genres':
+      return table.strings[table.genres[i]];
+    case 'rating':
+      // As Python prints floats: 5.0, 4.5
+      let rating = table.rating[i];
+      return Number.isInteger(rating) ? rating.toFixed(1) : String(rating);
+    case 'last_listen':
+      if (table.plays[i] == 0) {
+        return 'No listens';
+      }
+      return formatDay(table.last_listen[i]);
+    default:
+      return String(table[column][i]);
   }
-  // Put in the filtering text and class
-  selector = selector.replace('TEXT', filterText);
-  selector = selector.replace('CLS', cellClass);
-
-  return selector;
 }
 
 /**
- * markRowsForFilterNumeric - Mark table rows for filtering based on numeric
- * values or dates
+ * formatDay - Format a day number (days since 1970-01-01) as M/D/YY
  *
- * Function looks for all HTML elements with the specified CSS class, and
- * filters based on the input text. If the input text starts with an operator
- * (<, >, <=, >=, or =), the appropriate comparison is done for the content of
- * each element. If no operator is present, defaults to case-insensitive string
- * matching.
- *
- * Multiple conditions may be imposed using commas for 'and' operator or using
- * pipes for 'or' behavior.
- * E.g.:
- *  - '>2016 | <2011' matches strings with numbers greater than 2016 or less
- *    than 2011
- * - '>=2000, <2005' matches strings with numbers between 2000 and 2004
- *   inclusive
+ * @param {number} day - day number, or NaN for an unknown date
+ * @return {string} - the formatted date
+ */
+function formatDay(day) {
+  if (isNaN(day)) {
+    return 'Unknown date';
+  }
+  let date = new Date(day * MS_PER_DAY);
+  let year = String(date.getUTCFullYear() % 100).padStart(2, '0');
+  return (date.getUTCMonth() + 1) + '/' + date.getUTCDate() + '/' + year;
+}
+
+/**
+ * parseDay - Parse a date typed into the last listen filter into a day
+ * number
  *
- * If the overall search condition is not met, parent 'tr' elements are given
- * the attribute 'filtered-out' with the value 'true'.
+ * Accepts the same formats as parse_date in filters.py: YYYY/MM/DD,
+ * YYYY-MM-DD, M/D/YYYY, M/D/YY (years below 50 are taken as 20YY) and YYYY.
  *
- * @param {string} cellClass - CSS class to match to elements
- * @param {string} text - text for filtering based on numerical comparison or
- *     text matching
- * @param {string} date=false - whether the contents of the elements being
- *     filtered should be interpreted as dates when text paramter contains an
- *     operator
+ * @param {string} text - the date text
+ * @return {number} - day number, or NaN if text isn't a valid date
  */
-function markRowsForFilterNumeric(cellClass, text, date=false) {
+function parseDay(text) {
   text = text.trim();
-
-  // Split multiple selections by comma, and recursively call function for each
-  if (text.includes(',')) {
-    let textSplits = text.split(',');
-    for (let i = 0; i < textSplits.length; i++) {
-      markRowsForFilterNumeric(cellClass, textSplits[i], date=date);
+  let year, month, day;
+  let match = text.match(/^(\d{4})[\/-](\d{1,2})[\/-](\d{1,2})$/);
+  if (match) {
+    [year, month, day] = match.slice(1).map(Number);
+  } else if ((match = text.match(/^(\d{1,2})\/(\d{1,2})\/(\d{2}|\d{4})$/))) {
+    [month, day, year] = match.slice(1).map(Number);
+    if (match[3].length == 2) {
+      year += year < 50 ? 2000 : 1900;
     }
+  } else if (/^\d{4}$/.test(text)) {
+    [year, month, day] = [Number(text), 1, 1];
   } else {
+    return NaN;
+  }
+  let date = new Date(Date.UTC(year, month - 1, day));
+  // Date.UTC rolls over invalid dates, e.g. 2/30 to 3/2
+  date.setUTCFullYear(year);
+  if (date.getUTCMonth() != month - 1 || date.getUTCDate() != day) {
+    return NaN;
+  }
+  return Math.round(date.getTime() / MS_PER_DAY);
+}
 
-    let allCells = $('.'.concat(cellClass));
-
-    let textList = text.split('|');
-    let testFunctions = [];
-
-    // Construct the testFn as a chain of or's
-    for (let i = 0; i < textList.length; i++) {
-      testFunctions.push(getComparisonFunction(textList[i].trim(), date=date));
-    }
+/**
+ * filterRowsEvent - Wrapper for filterRows in the form of an event handler.
+ * Event object not necessary for the filtering.
+ */
+function filterRowsEvent(event) {
+  filterRows();
+}
 
-    // Get the test function for determining whether a cell's contents meet
-    // the filter criteria
-    // let testFn = getComparisonFunction(text, date=date);
-    let testAllCriteria = function(text) {
-      for (let i = 0; i < testFunctions.length; i++) {
-        let testFn = testFunctions[i];
-        if (testFn(text)) {
-          return true;
-        }
-      }
-      return false;
+/**
+ * filterRows - Filter table rows on index page based on search inputs
+ *
+ * Compiles a test for each search input with text in, finds the rows passing
+ * all of them in one pass over the table, and renders the first batch.
+ */
+function filterRows() {
+  if (table === null) {
+    return;
+  }
+  let tests = [];
+  for (let inputId in FILTER_INPUTS) {
+    let test = compileFilter(FILTER_INPUTS[inputId],
+                             document.getElementById(inputId).value);
+    if (test !== null) {
+      tests.push(test);
     }
+  }
 
-    // Mark cells that fail the test function
-    for (let i = 0; i < allCells.length; i++) {
-      let cell = allCells[i];
-
-      if ( !(testAllCriteria(cell.text.trim())) ) {
-        let parentRow = $(cell).parents('tr');
-        parentRow.attr('filtered-out', 'true')
+  visibleRows = [];
+  rows: for (let i = 0; i < table.length; i++) {
+    for (let j = 0; j < tests.length; j++) {
+      if (!tests[j](i)) {
+        continue rows;
       }
     }
+    visibleRows.push(i);
   }
-}
 
+  document.getElementById('album-rows').textContent = '';
+  renderedCount = 0;
+  renderMoreRows();
+}
 
 /**
- * stringReplaceAll - Replace all instances of a substring in a string
+ * compileFilter - Compile the filter text for a column into a test on row
+ * numbers
  *
- * @param {string} text - text to do replacing on
- * @param {string} toReplace - substring to replace
- * @param {string} replaceWith - substring to put in place of toReplace
- * @return {string} - resulting string
+ * Multiple conditions may be included using commas for 'and' operator or
+ * pipes for 'or' behavior.
+ *
+ * E.g.:
+ * - 'metal | rock' - matches any cell with 'metal' or 'rock' in it
+ * - 'indie, post rock' - matches any cell with 'indie' and 'post rock' in it
+ * - '>=2000, <2005' matches numbers between 2000 and 2004 inclusive
+ *
+ * @param {string} column - column name
+ * @param {string} text - filter text for the column
+ * @return {function} - function taking a row number and returning whether
+ *   the row matches, or null if every row does
  */
-function stringReplaceAll(text, toReplace, replaceWith) {
-  while (text.includes(toReplace)) {
-    text = text.replace(toReplace, replaceWith);
+function compileFilter(column, text) {
+  let groups = [];
+  for (let group of text.trim().split(',')) {
+    let tests = group.trim().split('|').map(
+      condition => getComparisonFunction(column, condition.trim()));
+    // A condition matching everything makes the whole group match
+    if (!tests.includes(null)) {
+      groups.push(tests);
+    }
+  }
+  if (groups.length == 0) {
+    return null;
+  }
+  return function(i) {
+    for (let tests of groups) {
+      if (!tests.some(test => test(i))) {
+        return false;
+      }
+    }
+    return true;
   }
-  return text;
 }
 
 /**
@@ -258,80 +288,144 @@ function hasOperator(text) {
 }
 
 /**
- * getComparisonFunction - Get a comparison test function based on a particular
- * text input.
+ * getComparisonFunction - Get a test function on row numbers for a single
+ * condition on a column.
  *
- * E.g.: text = "> 3" --> returns a function which takes one string argument,
- * returning true if the value is greater than 3 and false otherwise.
+ * E.g.: column = 'year', text = "> 3" --> returns a function which takes a
+ * row number, returning true if the row's year is greater than 3 and false
+ * otherwise.
  *
- * If text starts with an operator, assumes input to the resulting function is
- * to be cast to a number. Input is treated as a date and cast to number using
- * Date.getTime if date=true (otherwise uses Number). If no operator is
- * present, resulting test function just does case-insensitive string matching.
- * Resulting test function always takes a string as an input. Operators
- * include: <, >, <=, >=, =.
+ * If text starts with an operator (<, >, <=, >=, =) and the column holds
+ * numbers or dates, the column's values are compared with the number or
+ * date following the operator. Otherwise the test does case-insensitive
+ * string matching on the cell text, or the opposite if text starts with '!'.
  *
  * Text should have no whitespace padding.
  *
- * @param {string} text - the text to create the comparison function from
- * @param {boolean} date=false - if true and operator is found, treat input to
- *   returned test function as date string
- * @returns {function} - resulting test function which takes one string as an
- *   argument and returns a boolean
+ * @param {string} column - column name
+ * @param {string} text - the condition
+ * @returns {function} - resulting test function, or null if the condition
+ *   matches every row
  */
-function getComparisonFunction(text, date=false) {
-
-  // Define the test function for filtering the cell
-  // If no operator is present in the text, just do case-insensitive string
-  // matching
-  let stringMatch = (!(hasOperator(text)));
-  if (stringMatch && text.startsWith('!')) {
-    text = text.substring(1);
-    var testFn =
-      cellStr => (!cellStr.toUpperCase().includes(text.toUpperCase()));
-  } else if (stringMatch) {
-    var testFn =
-      cellStr => cellStr.toUpperCase().includes(text.toUpperCase());
-  } else {
-    // Define function for casting text to number
-    if (date) {
-      var numCast = function(txt) {
-        let d = new Date(txt);
-        return d.getTime();
-      }
-    } else {
-      var numCast = function(txt) {
-        return Number(txt);
-      }
+function getComparisonFunction(column, text) {
+  let numeric = ['year', 'rating', 'plays', 'last_listen'].includes(column);
+  if (!(numeric && hasOperator(text))) {
+    let negate = text.startsWith('!');
+    if (negate) {
+      text = text.substring(1);
     }
+    let upperText = text.toUpperCase();
+    if (upperText == '' && !negate) {
+      return null;
+    }
+    let cells = columnText(column);
+    return i => cells(i).includes(upperText) != negate;
+  }
 
-    if (text.startsWith('<=')) {
-      var compareText = text.slice(2);
-      var testFn = cellStr => numCast(cellStr) <= numCast(compareText);
-
-    } else if (text.startsWith('>=')) {
-      var compareText = text.slice(2);
-      var testFn = cellStr => numCast(cellStr) >= numCast(compareText);
-
-    } else if (text.startsWith('<')) {
-      var compareText = text.slice(1);
-      var testFn = cellStr => numCast(cellStr) < numCast(compareText);
+  let operator = text.match(/^(<=|>=|<|>|=)/)[1];
+  let compareText = text.slice(operator.length);
+  // Nothing after the operator matches everything
+  if (!compareText.trim()) {
+    return null;
+  }
+  let values = table[column];
+  let value = column == 'last_listen' ? parseDay(compareText) :
+    Number(compareText);
+
+  switch (operator) {
+    case '<=':
+      return i => values[i] <= value;
+    case '>=':
+      return i => values[i] >= value;
+    case '<':
+      return i => values[i] < value;
+    case '>':
+      return i => values[i] > value;
+    default:
+      return i => values[i] === value;
+  }
+}
 
-    } else if (text.startsWith('>')) {
-      var compareText = text.slice(1);
-      var testFn = cellStr => numCast(cellStr) > numCast(compareText);
+/**
+ * renderMoreRows - Add the next batch of matching rows to the table
+ */
+function renderMoreRows() {
+  let rows = document.createDocumentFragment();
+  let end = Math.min(renderedCount + RENDER_BATCH, visibleRows.length);
+  for (; renderedCount < end; renderedCount++) {
+    rows.appendChild(renderRow(visibleRows[renderedCount]));
+  }
+  document.getElementById('album-rows').appendChild(rows);
+}
 
-    } else if (text.startsWith('=')) {
-      var compareText = text.slice(1);
-      var testFn = cellStr => numCast(cellStr) === numCast(compareText);
+/**
+ * watchForScrolling - Render more rows when the end of the table scrolls
+ * into view
+ */
+function watchForScrolling() {
+  let observer = new IntersectionObserver(function(entries) {
+    if (entries[0].isIntersecting && renderedCount < visibleRows.length) {
+      renderMoreRows();
     }
+  }, {rootMargin: '500px'});
+  observer.observe(document.getElementById('album-table-end'));
+}
 
-    // If text is empty after the operator, redefine testFn to always return
-    // true
-    if (!(compareText)) {
-      testFn = val => true;
+/**
+ * quoteName - Quote a name for use in URLs, as the server does
+ *
+ * Names are quoted like Python's urllib.parse.quote_plus (Artist.quoted_name
+ * and Album.quoted_name), and the % signs quoted again by Django's reverse.
+ *
+ * @param {string} name - artist or album name
+ * @return {string} - the name as it appears in URLs
+ */
+function quoteName(name) {
+  let quoted = encodeURIComponent(name)
+    .replace(/[!'()*]/g, c => '%' + c.charCodeAt(0).toString(16).toUpperCase())
+    .replace(/%20/g, '+');
+  return quoted.replace(/%/g, '%25');
+}
+
+/**
+ * renderRow - Make the table row for an album
+ *
+ * Every cell links to the album, except the artist, which links to the
+ * artist, and the last listen, which links to add a listen.
+ *
+ * @param {number} i - row number
+ * @return {HTMLElement} - the row
+ */
+function renderRow(i) {
+  let artist = quoteName(table.artistNames[table.artist[i]]);
+  let album = quoteName(table.name[i]);
+  let url = template => template.replace('ARTIST_NAME', artist)
+    .replace('ALBUM_NAME', album);
+  let albumUrl = url(table.urls.album);
+
+  let row = document.createElement('tr');
+  row.className = 'album-data-row';
+  row.title = table.strings[table.comments[i]];
+  let cells = [
+    ['artist', url(table.urls.artist)],
+    ['album', albumUrl],
+    ['year', albumUrl],
+    ['rating', albumUrl],
+    ['genres', albumUrl],
+    ['plays', albumUrl],
+    ['last_listen', url(table.urls.add_listen)],
+  ];
+  for (let [column, href] of cells) {
+    let link = document.createElement('a');
+    link.className = 'block-anchor';
+    link.href = href;
+    link.textContent = cellText(column, i);
+    if (column == 'last_listen') {
+      link.title = 'Add Listen';
     }
+    let cell = document.createElement('td');
+    cell.appendChild(link);
+    row.appendChild(cell);
   }
-
-  return testFn;
+  return row;
 }
@@ -0,0 +1,97 @@
+/*
+Type-ahead search box in the navigation bar, using the search API.
+*/
+
+(function() {
+  var form = document.getElementById('site-search');
+  if (form === null) {
+    return;
+  }
+  var input = form.querySelector('input');
+  var menu = document.getElementById('site-search-results');
+
+  // Wait for a pause in typing before searching
+  var delay = 150;
+  var timer = null;
+  // Number of the latest request, so slow responses to earlier ones are
+  // ignored
+  var latest = 0;
+
+  input.addEventListener('input', function() {
+    clearTimeout(timer);
+    timer = setTimeout(search, delay);
+  });
+  input.addEventListener('keydown', function(event) {
+    if (event.key === 'Enter') {
+      var first = menu.querySelector('a');
+      if (first !== null) {
+        window.location = first.href;
+      }
+    } else if (event.key === 'Escape') {
+      hide();
+    }
+  });
+  document.addEventListener('click', function(event) {
+    if (!form.contains(event.target)) {
+      hide();
+    }
+  });
+
+  //-------------------------- Function definitions -------------------------//
+
+  /**
+   * search - Fetch results for the current query and show them.
+   */
+  function search() {
+    var query = input.value.trim();
+    if (!query) {
+      hide();
+      return;
+    }
+    var request = ++latest;
+    var url = input.dataset.url + '?q=' + encodeURIComponent(query);
+    fetch(url, {credentials: 'same-origin'})
+      .then(function(response) { return response.json(); })
+      .then(function(data) {
+        if (request === latest) {
+          show(data.results);
+        }
+      });
+  }
+
+  /**
+   * show - Fill the dropdown with search results.
+   */
+  function show(results) {
+    menu.textContent = '';
+    if (!results.length) {
+      var empty = document.createElement('span');
+      empty.className = 'dropdown-item-text text-muted';
+      empty.textContent = 'No matches';
+      menu.appendChild(empty);
+    }
+    results.forEach(function(result) {
+      var item = document.createElement('a');
+      item.className = 'dropdown-item';
+      item.href = result.url;
+      if (result.kind === 'album') {
+        var name = document.createElement('i');
+        name.textContent = result.name;
+        item.appendChild(name);
+        item.appendChild(document.createTextNode(
+          ' by ' + result.artist + ' (' + result.year + ')'));
+      } else {
+        item.textContent = result.name;
+      }
+      menu.appendChild(item);
+    });
+    menu.classList.add('show');
+  }
+
+  /**
+   * hide - Hide the dropdown.
+   */
+  function hide() {
+    menu.classList.remove('show');
+  }
+})();
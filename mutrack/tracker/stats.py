@@ -0,0 +1,199 @@
+"""
+stats.py
+
+Listening statistics for the stats page.
+
+Everything here reads the rollup tables (see rollups.py) or the play counts
+stored on albums, never the Listen table, so the page costs the same however
+long the listen history gets.
+"""
+import datetime
+import heapq
+
+from django.db.models import Count, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .models import (Album, Artist, DailyAlbumListens, DailyGenreListens,
+                     PrimaryGenre)
+
+# Maps period -> number of periods shown, ending with the current one
+PERIODS = {
+    'day': 30,
+    'week': 26,
+    'month': 24,
+}
+DEFAULT_PERIOD = 'month'
+
+# Albums and artists listed for each period
+TOP_COUNT = 5
+
+
+def period_start(date, period):
+    """Return the first day of the period containing date."""
+    if period == 'week':
+        return date - datetime.timedelta(days=date.weekday())
+    if period == 'month':
+        return date.replace(day=1)
+    return date
+
+
+def previous_period_start(start, period):
+    """Return the first day of the period before the one starting on start.
+    """
+    if period == 'week':
+        return start - datetime.timedelta(weeks=1)
+    if period == 'month':
+        return (start - datetime.timedelta(days=1)).replace(day=1)
+    return start - datetime.timedelta(days=1)
+
+
+def period_starts(period, today=None):
+    """Return the first days of the periods shown, oldest first."""
+    start = period_start(today or timezone.localdate(), period)
+    starts = [start]
+    for _ in range(PERIODS[period] - 1):
+        starts.append(previous_period_start(starts[-1], period))
+    return starts[::-1]
+
+
+def period_label(start, period):
+    if period == 'month':
+        return start.strftime('%b %Y')
+    if period == 'week':
+        return 'Week of {:d}/{:d}/{:02d}'.format(start.month, start.day,
+                                                 start.year % 100)
+    return '{:d}/{:d}/{:02d}'.format(start.month, start.day,
+                                     start.year % 100)
+
+
+def truncate(period):
+    """Expression truncating a rollup's date to the start of its period."""
+    return Trunc('date', period, output_field=DailyAlbumListens.date.field)
+
+
+def listens_per_period(starts, period):
+    """Return [(start, listens)] for each period."""
+    totals = dict(
+        DailyAlbumListens.objects.filter(date__gte=starts[0]).order_by()
+        .annotate(start=truncate(period)).values_list('start')
+        .annotate(total=Sum('listens')).values_list('start', 'total'))
+    return [(start, totals.get(start, 0)) for start in starts]
+
+
+def top_per_period(starts, period, field, count):
+    """Return the ids of the most played values of a DailyAlbumListens field
+    in each period, with play counts.
+
+    Returns {start: [(id, total)]}, most played first. Ties go to the lower
+    id.
+    """
+    totals = (DailyAlbumListens.objects.filter(date__gte=starts[0]).order_by()
+              .annotate(start=truncate(period)).values_list('start', field)
+              .annotate(total=Sum('listens'))
+              .values_list('start', field, 'total'))
+    by_period = {}
+    for start, pk, total in totals:
+        by_period.setdefault(start, []).append((pk, total))
+    return {
+        start: heapq.nsmallest(count, items,
+                               key=lambda item: (-item[1], item[0]))
+        for start, items in by_period.items()
+    }
+
+
+def top_albums(starts, period, count=TOP_COUNT):
+    """Return [(start, [(album, listens)])] for each period, newest first,
+    with the period's most played albums.
+    """
+    tops = top_per_period(starts, period, 'album', count)
+    albums = Album.objects.select_related('artist').in_bulk(
+        {album_id for top in tops.values() for album_id, _ in top})
+    return [(start, [(albums[album_id], total)
+                     for album_id, total in tops.get(start, [])])
+            for start in reversed(starts)]
+
+
+def top_artists(starts, period, count=TOP_COUNT):
+    """Return [(start, [(artist, listens)])] for each period, newest first,
+    with the period's most played artists.
+    """
+    tops = top_per_period(starts, period, 'album__artist', count)
+    artists = Artist.objects.in_bulk(
+        {artist_id for top in tops.values() for artist_id, _ in top})
+    return [(start, [(artists[artist_id], total)
+                     for artist_id, total in tops.get(start, [])])
+            for start in reversed(starts)]
+
+
+def genre_share(starts, period, per_period):
+    """Return each primary genre's share of listens in each period, given
+    the total listens per period.
+
+    Returns (genres, rows), where rows holds (start, [percent per genre]).
+    An album in two genres counts towards both, so shares can add up to more
+    than 100.
+    """
+    genres = list(PrimaryGenre.objects.order_by('name'))
+    counts = (DailyGenreListens.objects.filter(date__gte=starts[0])
+              .order_by().annotate(start=truncate(period))
+              .values_list('start', 'genre').annotate(total=Sum('listens'))
+              .values_list('start', 'genre', 'total'))
+    by_period = {}
+    for start, genre_id, total in counts:
+        by_period.setdefault(start, {})[genre_id] = total
+
+    album_totals = dict(per_period)
+    rows = []
+    for start in starts:
+        listens = album_totals[start]
+        shares = by_period.get(start, {})
+        rows.append((start, [
+            round(100 * shares.get(genre.pk, 0) / listens) if listens else 0
+            for genre in genres]))
+    return genres, rows
+
+
+def rating_distribution():
+    """Return how play counts vary with rating.
+
+    Returns a row per rating with the number of albums, their total and
+    average play count, and how many have never been played.
+    """
+    rows = (Album.objects.order_by('-rating').values_list('rating')
+            .annotate(albums=Count('pk'), plays=Sum('play_count')))
+    unplayed = dict(Album.objects.filter(play_count=0).order_by()
+                    .values_list('rating').annotate(count=Count('pk')))
+    return [
+        {'rating': rating, 'albums': albums, 'plays': plays,
+         'average': plays / albums, 'unplayed': unplayed.get(rating, 0)}
+        for rating, albums, plays in rows
+    ]
+
+
+def dashboard(period=DEFAULT_PERIOD, today=None):
+    """Return everything shown on the stats page, for the given period
+    length (a key of PERIODS).
+    """
+    starts = period_starts(period, today)
+    per_period = listens_per_period(starts, period)
+    busiest = max(listens for _, listens in per_period) or 1
+    genres, genre_rows = genre_share(starts, period, per_period)
+    return {
+        'period': period,
+        'periods': list(PERIODS),
+        'since': starts[0],
+        'listens_per_period': [
+            {'label': period_label(start, period), 'listens': listens,
+             'percent': round(100 * listens / busiest)}
+            for start, listens in per_period],
+        'total_listens': sum(listens for _, listens in per_period),
+        'top_albums': [(period_label(start, period), top)
+                       for start, top in top_albums(starts, period)],
+        'top_artists': [(period_label(start, period), top)
+                        for start, top in top_artists(starts, period)],
+        'genres': genres,
+        'genre_share': [(period_label(start, period), shares)
+                        for start, shares in genre_rows],
+        'ratings': rating_distribution(),
+    }
@@ -0,0 +1,146 @@
+"""
+synthetic.py
+
+Generates synthetic libraries for benchmarking and load testing.
+
+Libraries are meant to look like a real listening history: a few artists
+have many albums, ratings cluster around 3-4, and plays follow a power law,
+with a handful of favourite albums played far more than the rest. The same
+seed always gives the same library.
+"""
+import datetime
+import itertools
+import random
+
+from django.db import transaction
+
+from .caching import data_changed
+from .genres import sync_genre_tags
+from .models import Album, Artist, Listen, PrimaryGenre, normalize_name
+from .rollups import rebuild_rollups
+from .search import get_index
+
+PRIMARY_GENRES = ('Rock', 'Electronic', 'Hip Hop', 'Jazz', 'Folk', 'Metal',
+                  'Pop', 'Classical')
+
+GENRE_WORDS = ('indie', 'post', 'art', 'dream', 'noise', 'ambient', 'free',
+               'progressive', 'experimental', 'psychedelic', 'chamber',
+               'garage', 'synth', 'math', 'slow', 'space')
+GENRE_STEMS = ('rock', 'pop', 'jazz', 'folk', 'metal', 'punk', 'wave',
+               'core', 'house', 'techno', 'soul', 'gaze')
+
+RATINGS = [x / 2 for x in range(11)]
+RATING_WEIGHTS = [1, 1, 2, 3, 6, 10, 16, 20, 16, 8, 3]
+
+BATCH_SIZE = 2000
+
+
+def zipf_weights(count, exponent):
+    """Return power-law weights for count items: 1, 1/2^s, 1/3^s, ...
+    """
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+def batched(iterable, size):
+    """Yield lists of up to size items from iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def generate_library(num_artists, num_albums, num_listens, seed=0,
+                     end_date=None, days=3650, play_skew=1.1):
+    """Fill the database with a synthetic library.
+
+    Parameters:
+        num_artists, num_albums, num_listens: how much to create
+        seed: random seed; the same seed gives the same library
+        end_date: date of the latest possible listen (default today)
+        days: listens are spread over this many days before end_date,
+            weighted towards recent ones
+        play_skew: exponent of the power law choosing which album each
+            listen is for
+
+    Writes with bulk_create, then refreshes the albums' stored stats and
+    rebuilds the daily rollups and search index.
+    Returns the number of (artists, albums, listens) created.
+    """
+    rng = random.Random(seed)
+    end_date = end_date or datetime.date.today()
+    # Prefix names with the seed so libraries from different seeds can
+    # share a database
+    prefix = 'Synthetic {}'.format(seed)
+
+    with transaction.atomic():
+        genres = [PrimaryGenre.objects.get_or_create(name=name)[0]
+                  for name in PRIMARY_GENRES]
+
+        # Objects from bulk_create don't get primary keys on SQLite, so
+        # they're fetched again afterwards (the names sort in creation order)
+        Artist.objects.bulk_create(
+            (Artist(name=name, name_key=normalize_name(name)) for name in
+             ('{} Artist {:06d}'.format(prefix, i)
+              for i in range(num_artists))),
+            batch_size=BATCH_SIZE)
+        artists = list(Artist.objects.filter(
+            name__startswith=prefix + ' Artist ').order_by('name'))
+
+        # A few prolific artists, many with one or two albums
+        artist_choices = rng.choices(artists,
+                                     weights=zipf_weights(num_artists, 0.8),
+                                     k=num_albums)
+        albums = []
+        for i, artist in enumerate(artist_choices):
+            name = '{} Album {:06d}'.format(prefix, i)
+            genres_text = ', '.join(
+                '{} {}'.format(rng.choice(GENRE_WORDS),
+                               rng.choice(GENRE_STEMS))
+                for _ in range(rng.randint(1, 3)))
+            albums.append(Album(
+                name=name, name_key=normalize_name(name), artist=artist,
+                sort_artist_name=artist.name,
+                year=rng.randint(1960, end_date.year),
+                rating=rng.choices(RATINGS, weights=RATING_WEIGHTS)[0],
+                secondary_genres=genres_text,
+                comments=rng.choice(('', '', 'Great on vinyl.',
+                                     'Side B is better.'))))
+        Album.objects.bulk_create(albums, batch_size=BATCH_SIZE)
+        albums = list(Album.objects.filter(
+            name__startswith=prefix + ' Album ').order_by('name'))
+        sync_genre_tags(albums)
+
+        Through = Album.primary_genres.through
+        Through.objects.bulk_create(
+            (Through(album_id=album.pk, primarygenre_id=genre.pk)
+             for album in albums
+             for genre in rng.sample(genres, rng.randint(1, 2))),
+            batch_size=BATCH_SIZE)
+
+        # Shuffle so the favourite albums aren't just the first ones created
+        favourites = list(albums)
+        rng.shuffle(favourites)
+        album_weights = list(itertools.accumulate(
+            zipf_weights(len(favourites), play_skew)))
+
+        def listens():
+            for _ in range(num_listens):
+                album = rng.choices(favourites, cum_weights=album_weights)[0]
+                # Triangular distribution: more listens recently
+                days_ago = int(rng.triangular(0, days, 0))
+                yield Listen(album_id=album.pk,
+                             listen_date=end_date
+                             - datetime.timedelta(days=days_ago))
+
+        for batch in batched(listens(), BATCH_SIZE):
+            Listen.objects.bulk_create(batch)
+
+        Album.objects.filter(
+            name__startswith=prefix + ' Album ').refresh_listen_stats()
+        rebuild_rollups()
+        get_index().rebuild()
+
+    data_changed()
+    return len(artists), len(albums), num_listens
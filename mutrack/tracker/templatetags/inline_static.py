@@ -0,0 +1,49 @@
+"""
+inline_static.py
+
+Template tag putting a small static file's contents straight into the page,
+saving the browser a request for it before it can render.
+"""
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.utils.safestring import mark_safe
+
+from mutrack.storage import MINIFIERS
+
+register = template.Library()
+
+_contents = {}
+
+
+def read_static(path):
+    """Return the text of a static file.
+
+    The collected (hashed and minified) copy is used if collectstatic has
+    been run, otherwise the file is found in the apps and minified here.
+    """
+    stored_name = staticfiles_storage.stored_name(path)
+    if stored_name != path or staticfiles_storage.exists(path):
+        with staticfiles_storage.open(stored_name) as f:
+            return f.read().decode()
+    filename = finders.find(path)
+    if filename is None:
+        raise template.TemplateSyntaxError(
+            'Static file {} not found.'.format(path))
+    with open(filename) as f:
+        text = f.read()
+    minify = MINIFIERS.get('.' + path.rsplit('.', 1)[-1])
+    return minify(text) if minify is not None else text
+
+
+@register.simple_tag
+def inline_static(path):
+    """Output the contents of a static file, e.g.
+    <style>{% inline_static 'tracker/style.css' %}</style>
+
+    Contents are read once per process, unless settings.DEBUG is on.
+    """
+    if settings.DEBUG or path not in _contents:
+        _contents[path] = read_static(path)
+    return mark_safe(_contents[path])
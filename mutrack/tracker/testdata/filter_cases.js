@@ -0,0 +1,42 @@
+/*
+Run the shared filter cases against compileFilter in script.js.
+
+Usage: node filter_cases.js CASES_FILE
+
+CASES_FILE is JSON with the album table data sent to the index page
+('payload', from api.album_table_payload) and the cases from
+filter_cases.json. script.js is run with stand-ins for jQuery and the
+document, since only its filter functions are used. Prints a JSON list of
+the cases whose matching albums differ, which is empty if they all pass.
+*/
+const fs = require('fs');
+const path = require('path');
+const vm = require('vm');
+
+const SCRIPT = path.join(__dirname, '..', 'static', 'tracker', 'script.js');
+
+let {payload, cases} = JSON.parse(fs.readFileSync(process.argv[2], 'utf8'));
+
+// Enough of jQuery for the event handlers script.js attaches on loading
+let jquery = () => ({keyup() {}, ready() {}});
+let context = vm.createContext({$: jquery, document: {}});
+vm.runInContext(fs.readFileSync(SCRIPT, 'utf8'), context, {filename: SCRIPT});
+
+// Its functions and its table variable are properties of the context
+let table = context.table = context.loadTable(payload);
+
+let failures = [];
+for (let c of cases) {
+  let test = context.compileFilter(c.column, c.filter);
+  let actual = [];
+  for (let i = 0; i < table.length; i++) {
+    if (test === null || test(i)) {
+      actual.push(table.name[i]);
+    }
+  }
+  let sorted = names => [...names].sort();
+  if (JSON.stringify(sorted(actual)) != JSON.stringify(sorted(c.expected))) {
+    failures.push(Object.assign({actual: actual}, c));
+  }
+}
+console.log(JSON.stringify(failures));
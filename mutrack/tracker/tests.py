@@ -1,3 +1,2195 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import importlib.util
+import io
+import json
+import math
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.core.paginator import EmptyPage
+from django.http import Http404
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Count, Max, Min
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.test import (Client, LiveServerTestCase, RequestFactory,
+                         SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from mutrack.backends.pool import ConnectionPool, PoolClosed, PoolTimeout
+from mutrack.backends.sqlite3.base import DatabaseWrapper as TunedSQLite
+from mutrack.storage import minify_css
+from mutrack.views import accepted_encodings, static
+
+from . import admin as tracker_admin
+from . import async_views, jobs, recommendations, similarity
+from .api import (ALBUM_TABLE_ORDERING, after_cursor, album_table_payload,
+                  encode_cursor)
+from .caching import SEARCH_VERSION_KEY, bump_data_version, bump_version
+from .benchmarks import compare_results, run_benchmarks
+from .genres import parse_genre_tags
+from .importer import (ListenImporter, ListenImportError, parse_listen_date,
+                       read_csv, read_json_array)
+from .filters import filter_albums, parse_date, parse_number
+from .models import (Album, Artist, DailyAlbumListens, DailyGenreListens,
+                     GenreTag, Job, Listen, PrimaryGenre, SimilarAlbum,
+                     SimilarArtist)
+from .rollups import rebuild_rollups
+from .search import (FTS5Index, PythonIndex, parse_document_id, search,
+                     tokenize)
+from .stats import PERIODS, period_starts
+from .synthetic import generate_library
+from .templatetags import inline_static
+
+TESTDATA_DIR = os.path.join(os.path.dirname(__file__), 'testdata')
+
+
+def make_library(num_artists, albums_per_artist, listens_per_album,
+                 prefix='Artist'):
+    """Create a small library of artists, albums and listens for testing.
+
+    If jobs run straight away, they're run once it's all saved instead,
+    merged into one per album as they would be in the background.
+    """
+    run_jobs = settings.TRACKER_JOBS == 'sync'
+    genre, _ = PrimaryGenre.objects.get_or_create(name='Rock')
+    start = datetime.date(2020, 1, 1)
+    with override_settings(TRACKER_JOBS='manual' if run_jobs
+                           else settings.TRACKER_JOBS):
+        for i in range(num_artists):
+            artist = Artist.objects.create(name='{} {}'.format(prefix, i))
+            for j in range(albums_per_artist):
+                album = Album.objects.create(name='Album {}'.format(j),
+                                             artist=artist, year=2000 + j,
+                                             rating=float(j % 6))
+                album.primary_genres.add(genre)
+                for k in range(listens_per_album):
+                    Listen.objects.create(
+                        album=album,
+                        listen_date=start + datetime.timedelta(days=k))
+    if run_jobs:
+        jobs.run_pending()
+
+
+def table_data(response):
+    """Get the album table data embedded in the index page."""
+    match = re.search(r'<script id="album-table-data" type="application/json">'
+                      r'(.*?)</script>', response.content.decode(), re.S)
+    return json.loads(match.group(1))
+
+
+# Jobs are left waiting, rather than run on threads the tests don't wait for
+@override_settings(TRACKER_JOBS='sync')
+class TrackerTestCase(TestCase):
+    """Base test case with a logged in user.
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('tester', password='secret')
+        self.client.force_login(self.user)
+
+    def count_queries(self, url):
+        """Request url and return the number of queries it took."""
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+
+class IndexViewTests(TrackerTestCase):
+
+    def test_query_count_independent_of_library_size(self):
+        url = reverse('tracker:index')
+        make_library(2, 2, 2)
+        small = self.count_queries(url)
+
+        make_library(10, 3, 4, prefix='More')
+        large = self.count_queries(url)
+
+        self.assertEqual(small, large)
+
+    def test_table_cached_until_data_changes(self):
+        url = reverse('tracker:index')
+        make_library(2, 2, 1)
+        uncached = self.count_queries(url)
+        cached = self.count_queries(url)
+        self.assertLess(cached, uncached)
+
+        album = Album.objects.first()
+        Listen.objects.create(album=album,
+                              listen_date=datetime.date(2021, 5, 6))
+        albums = table_data(self.client.get(url))['albums']
+        row = albums['id'].index(album.pk)
+        self.assertEqual(albums['last_listen'][row], 18753)
+
+    def test_table_cached_per_user_and_filter(self):
+        url = reverse('tracker:index')
+        make_library(2, 1, 0)
+        self.assertContains(self.client.get(url), 'Artist 1')
+        self.assertNotContains(self.client.get(url, {'artist': '0'}),
+                               'Artist 1')
+
+        other = User.objects.create_user('other', password='secret')
+        self.client.force_login(other)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        self.assertTrue(any('tracker_album' in query['sql']
+                            for query in context.captured_queries))
+
+    def test_table_data(self):
+        make_library(2, 2, 1)
+        Album.objects.update(comments='Same comment')
+        response = self.client.get(reverse('tracker:index'))
+        data = table_data(response)
+
+        self.assertEqual(data['artists']['name'], ['Artist 0', 'Artist 1'])
+        albums = data['albums']
+        self.assertEqual(albums['artist'], [0, 1, 0, 1])
+        self.assertEqual(albums['name'], ['Album 1', 'Album 1', 'Album 0',
+                                          'Album 0'])
+        self.assertEqual(albums['rating'], [1.0, 1.0, 0.0, 0.0])
+        self.assertEqual(albums['plays'], [1, 1, 1, 1])
+        # 2020-01-01
+        self.assertEqual(albums['last_listen'], [18262] * 4)
+        # Genres and comments are each stored once
+        self.assertEqual(data['strings'], ['', 'Same comment'])
+        self.assertEqual(albums['comments'], [1, 1, 1, 1])
+        self.assertEqual(data['urls']['album'],
+                         '/tracker/album/ARTIST_NAME/ALBUM_NAME')
+        # Rows are rendered in the browser
+        self.assertNotContains(response, 'album-data-row')
+
+    def test_plays_and_last_listen(self):
+        make_library(1, 1, 3)
+        Album.objects.create(name='Unheard', artist=Artist.objects.get(),
+                             year=1999, rating=3.0)
+
+        response = self.client.get(reverse('tracker:index'))
+
+        albums = {a.name: a for a in response.context['album_list']}
+        self.assertEqual(albums['Album 0'].number_of_plays(), 3)
+        self.assertEqual(albums['Album 0'].last_listen_date_mdy(), '1/3/20')
+        self.assertEqual(albums['Unheard'].number_of_plays(), 0)
+        self.assertEqual(albums['Unheard'].last_listen_date_mdy(),
+                         'No listens')
+
+
+@override_settings(TRACKER_JOBS='sync')
+class FilterTests(TestCase):
+    """Check the server-side filters against the table of cases shared with
+    the Javascript filters in script.js.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        with open(os.path.join(TESTDATA_DIR, 'filter_cases.json')) as f:
+            cls.table = json.load(f)
+
+        for row in cls.table['albums']:
+            artist, _ = Artist.objects.get_or_create(name=row['artist'])
+            album = Album.objects.create(name=row['album'], artist=artist,
+                                         year=row['year'],
+                                         rating=row['rating'],
+                                         secondary_genres=row['genres'])
+            for date in row['listens']:
+                Listen.objects.create(
+                    album=album,
+                    listen_date=date and datetime.date.fromisoformat(date))
+
+    def test_shared_cases(self):
+        for case in self.table['cases']:
+            with self.subTest(column=case['column'], filter=case['filter']):
+                albums = filter_albums(Album.objects.all(),
+                                       {case['column']: case['filter']})
+                self.assertCountEqual(albums.values_list('name', flat=True),
+                                      case['expected'])
+
+    @unittest.skipUnless(shutil.which('node'), 'Node.js not installed')
+    def test_javascript_cases(self):
+        """Run the same cases through compileFilter in script.js, with the
+        table data the index page sends.
+        """
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump({'payload': album_table_payload(Album.objects.all()),
+                       'cases': self.table['cases']}, f)
+            f.flush()
+            output = subprocess.run(
+                ['node', os.path.join(TESTDATA_DIR, 'filter_cases.js'),
+                 f.name], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(json.loads(output), [])
+
+    def test_index_view_filters(self):
+        user = User.objects.create_user('tester', password='secret')
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('tracker:index'),
+                                   {'artist': 'radiohead', 'year': '>1999'})
+
+        self.assertEqual([a.name for a in response.context['album_list']],
+                         ['Kid A'])
+
+    def test_parse_number(self):
+        self.assertEqual(parse_number(' 4.5 '), 4.5)
+        self.assertEqual(parse_number(''), 0)
+        self.assertEqual(parse_number('0x10'), 16)
+        self.assertTrue(math.isnan(parse_number('4,5')))
+
+    def test_parse_date(self):
+        self.assertEqual(parse_date('3/5/21'), datetime.date(2021, 3, 5))
+        self.assertEqual(parse_date('3/5/97'), datetime.date(1997, 3, 5))
+        self.assertEqual(parse_date('2021-03-05'), datetime.date(2021, 3, 5))
+        self.assertIsNone(parse_date('2/30/21'))
+
+
+class AlbumTableDataTests(TrackerTestCase):
+
+    def test_pages_follow_album_ordering(self):
+        make_library(5, 4, 1)
+        url = reverse('tracker:api-albums')
+        expected = [(a.artist.name, a.name) for a in
+                    Album.objects.select_related('artist')]
+
+        rows = []
+        page = self.client.get(url, {'limit': 3}).json()
+        while True:
+            self.assertLessEqual(len(page['albums']), 3)
+            rows.extend(page['albums'])
+            if page['next'] is None:
+                break
+            page = self.client.get(url, {'limit': 3,
+                                         'after': page['next']}).json()
+
+        self.assertEqual([(r['artist'], r['album']) for r in rows], expected)
+        self.assertEqual(rows[0]['plays'], 1)
+        self.assertEqual(rows[0]['last_listen'], '2020-01-01')
+
+    def test_deep_page_query_count(self):
+        make_library(5, 4, 1)
+        url = reverse('tracker:api-albums')
+        first = self.client.get(url, {'limit': 2}).json()
+
+        with CaptureQueriesContext(connection) as first_queries:
+            self.client.get(url, {'limit': 2})
+        with CaptureQueriesContext(connection) as later_queries:
+            self.client.get(url, {'limit': 2, 'after': first['next']})
+
+        self.assertEqual(len(first_queries), len(later_queries))
+
+    def test_filters_and_bad_cursor(self):
+        make_library(2, 3, 0)
+        url = reverse('tracker:api-albums')
+
+        page = self.client.get(url, {'artist': 'artist 1',
+                                     'year': '>2000'}).json()
+        self.assertEqual(len(page['albums']), 2)
+        self.assertEqual(self.client.get(url, {'after': 'x'}).status_code,
+                         400)
+
+
+class ListenStatsTests(TrackerTestCase):
+
+    def setUp(self):
+        super(ListenStatsTests, self).setUp()
+        artist = Artist.objects.create(name='Artist')
+        self.album = Album.objects.create(name='First', artist=artist,
+                                          year=2000, rating=4.0)
+        self.other = Album.objects.create(name='Second', artist=artist,
+                                          year=2001, rating=3.0)
+
+    def assertStats(self, album, plays, last_date):
+        album.refresh_from_db()
+        self.assertEqual((album.play_count, album.last_listen_date),
+                         (plays, last_date))
+
+    def test_create_edit_delete(self):
+        jan, feb = datetime.date(2021, 1, 1), datetime.date(2021, 2, 1)
+        listen = Listen.objects.create(album=self.album, listen_date=jan)
+        Listen.objects.create(album=self.album, listen_date=feb)
+        self.assertStats(self.album, 2, feb)
+
+        listen.album = self.other
+        listen.save()
+        self.assertStats(self.album, 1, feb)
+        self.assertStats(self.other, 1, jan)
+
+        self.album.listen_set.all().delete()
+        self.assertStats(self.album, 0, None)
+        self.assertEqual(self.album.last_listen_date_mdy(), 'No listens')
+
+    def test_listen_with_unknown_date(self):
+        Listen.objects.create(album=self.album, listen_date=None)
+        self.assertStats(self.album, 1, None)
+        self.assertEqual(self.album.last_listen_date_mdy(), 'Unknown date')
+
+    def test_listen_create_view(self):
+        url = reverse('tracker:listen-create-for-album',
+                      args=['Artist', 'First'])
+        self.client.post(url, {'album': self.album.pk,
+                               'listen_date': '2021-03-04'})
+        self.assertStats(self.album, 1, datetime.date(2021, 3, 4))
+
+    def test_rebuild_command(self):
+        Listen.objects.create(album=self.album,
+                              listen_date=datetime.date(2021, 1, 1))
+        Album.objects.filter(pk=self.album.pk).update(play_count=7)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_listen_stats', '--check',
+                         stdout=io.StringIO())
+
+        out = io.StringIO()
+        call_command('rebuild_listen_stats', stdout=out)
+        self.assertIn('1 had drifted', out.getvalue())
+        self.assertStats(self.album, 1, datetime.date(2021, 1, 1))
+        call_command('rebuild_listen_stats', '--check', stdout=io.StringIO())
+
+
+class NameLookupTests(TrackerTestCase):
+
+    def setUp(self):
+        super(NameLookupTests, self).setUp()
+        self.artist = Artist.objects.create(name='Sigur Rós')
+        self.album = Album.objects.create(name='Ágætis Byrjun',
+                                          artist=self.artist, year=1999,
+                                          rating=4.5)
+
+    def test_keys_set_on_save(self):
+        self.assertEqual(self.artist.name_key, 'sigur rós')
+        self.album.name = 'Takk...'
+        self.album.save()
+        self.assertEqual(
+            Album.objects.lookup('SIGUR RÓS', 'takk...').get(), self.album)
+
+    def test_views_resolve_names_ignoring_case(self):
+        album_url = reverse('tracker:album',
+                            args=['sigur+RÓS', 'ágætis+byrjun'])
+        response = self.client.get(album_url)
+        self.assertEqual(response.context['album'], self.album)
+
+        response = self.client.get(reverse('tracker:artist',
+                                           args=['SIGUR+rós']))
+        self.assertEqual(response.context['artist'], self.artist)
+        self.assertEqual(list(response.context['albums_by_artist']),
+                         [self.album])
+
+        url = reverse('tracker:listen-create-for-album',
+                      args=['sigur+rós', 'ágætis+byrjun'])
+        response = self.client.get(url)
+        self.assertEqual(response.context['form'].initial['album'],
+                         self.album)
+
+    def test_unknown_names_404(self):
+        for url in (reverse('tracker:album', args=['sigur+rós', 'nope']),
+                    reverse('tracker:album-update', args=['nope', 'nope']),
+                    reverse('tracker:artist', args=['nope']),
+                    reverse('tracker:artist-update', args=['nope']),
+                    reverse('tracker:listen-create-for-album',
+                            args=['nope', 'nope'])):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class AlbumDetailTests(TrackerTestCase):
+
+    def setUp(self):
+        super(AlbumDetailTests, self).setUp()
+        make_library(1, 2, 3)
+        self.url = reverse('tracker:album', args=['Artist+0', 'Album+0'])
+        self.album = Album.objects.get(name='Album 0')
+
+    def add_listens(self, count):
+        start = datetime.date(2021, 1, 1)
+        Listen.objects.bulk_create(
+            Listen(album=self.album,
+                   listen_date=start + datetime.timedelta(days=i))
+            for i in range(count))
+        Album.objects.refresh_listen_stats()
+
+    def listen_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in context.captured_queries
+                          if 'tracker_listen' in query['sql']]
+
+    def test_bounded_queries(self):
+        small = self.count_queries(self.url)
+        self.add_listens(500)
+        large = self.count_queries(self.url)
+        self.assertEqual(small, large)
+
+        response, queries = self.listen_queries(self.url)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('LIMIT 5', queries[0])
+        self.assertContains(response, 'Last 5 listens:')
+        self.assertContains(response, 'Total number of plays: 503')
+        self.assertEqual(
+            [listen.listen_date for listen in
+             response.context['recent_listens']],
+            [datetime.date(2022, 5, 15) - datetime.timedelta(days=i)
+             for i in range(5)])
+
+    @override_settings(TRACKER_RECENT_LISTENS=2)
+    def test_recent_listens_configurable(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Last 2 listens:')
+        self.assertEqual(len(response.context['recent_listens']), 2)
+        self.assertContains(response, reverse('tracker:album-listens',
+                                              args=['Artist+0', 'Album+0']))
+
+        self.assertEqual(len(self.album.recent_listens(10)), 3)
+        self.assertEqual(self.album.last_five_listens_label(),
+                         'Last 3 listens:')
+
+    @override_settings(TRACKER_LISTEN_HISTORY_PAGE_SIZE=10)
+    def test_listen_history(self):
+        self.add_listens(22)
+        url = reverse('tracker:album-listens', args=['Artist+0', 'Album+0'])
+        dates = []
+        for page in (1, 2, 3):
+            response, queries = self.listen_queries(
+                '{}?page={}'.format(url, page))
+            # Paged using the stored play count, without counting listens
+            self.assertEqual(len(queries), 1)
+            self.assertNotIn('COUNT(', queries[0])
+            dates.extend(listen.listen_date
+                         for listen in response.context['listens'])
+        self.assertEqual(response.context['paginator'].num_pages, 3)
+        self.assertEqual(len(dates), 25)
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+        self.assertEqual(self.client.get(url + '?page=4').status_code, 404)
+        self.assertEqual(self.client.get(reverse(
+            'tracker:album-listens', args=['Artist+0', 'Nope'])).status_code,
+            404)
+
+
+class ConditionalGetTests(TrackerTestCase):
+
+    def setUp(self):
+        super(ConditionalGetTests, self).setUp()
+        make_library(1, 1, 1)
+        self.urls = [reverse('tracker:index'),
+                     reverse('tracker:album', args=['Artist+0', 'Album+0']),
+                     reverse('tracker:artist', args=['Artist+0'])]
+
+    def test_not_modified_without_touching_albums(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertFalse(any('tracker_' in query['sql']
+                                     for query in context.captured_queries))
+
+    def test_modified_after_change(self):
+        response = self.client.get(self.urls[0])
+        Listen.objects.create(album=Album.objects.get())
+
+        response = self.client.get(
+            self.urls[0], HTTP_IF_NONE_MATCH=response['ETag'],
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_differs_between_users(self):
+        etag = self.client.get(self.urls[0])['ETag']
+        other = User.objects.create_user('other', password='secret')
+        self.client.force_login(other)
+        response = self.client.get(self.urls[0], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(TRACKER_JOBS='manual')
+class ImportListensTests(TestCase):
+
+    def setUp(self):
+        self.artist = Artist.objects.create(name='Slowdive')
+        self.album = Album.objects.create(name='Souvlaki', artist=self.artist,
+                                          year=1993, rating=4.5)
+
+    def write_file(self, name, text):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def run_import(self, name, text, *args):
+        with tempfile.TemporaryDirectory() as self.tmpdir:
+            out = io.StringIO()
+            call_command('import_listens', self.write_file(name, text),
+                         *args, stdout=out)
+        return out.getvalue()
+
+    def test_csv_import(self):
+        out = self.run_import('listens.csv', (
+            'artist,album,date\n'
+            'SLOWDIVE,souvlaki,2021-03-05\n'
+            'Slowdive,Souvlaki,\n'
+            'Slowdive,Pygmalion,2021-03-06\n'), '--batch-size', '1')
+
+        self.assertIn('Imported 2 listens', out)
+        self.assertIn('rows/s', out)
+        self.assertIn("unknown album 'Pygmalion'", out)
+        self.album.refresh_from_db()
+        self.assertEqual(self.album.play_count, 2)
+        self.assertEqual(self.album.last_listen_date,
+                         datetime.date(2021, 3, 5))
+        # Enqueued by each batch
+        self.assertEqual(Job.objects.get(task='similarities',
+                                         object_id=self.album.pk).requests,
+                         2)
+
+    def test_scrobbles_create_missing(self):
+        out = self.run_import('scrobbles.csv', (
+            'Slowdive,Pygmalion,Rutti,06 Mar 2021 10:00\n'
+            'Slowdive,Pygmalion,Crazy for You,06 Mar 2021 10:10\n'
+            'Low,Double Negative,Quorum,07 Mar 2021 11:00\n'),
+            '--columns', 'artist,album,track,date', '--create-missing')
+
+        self.assertIn('Imported 2 listens', out)
+        self.assertIn('Created 1 artists and 2 albums', out)
+        album = Album.objects.lookup('low', 'double negative').get()
+        self.assertEqual(album.play_count, 1)
+
+    def test_json_lines_dry_run(self):
+        out = self.run_import('listens.jsonl', (
+            '{"artist": {"#text": "Slowdive"}, "album": {"#text": "Souvlaki"},'
+            ' "date": {"uts": "1614988800"}}\n'
+            '{"artist": "New", "album": "Album", "listen_date": "2021-01-01"}'
+            '\n'), '--dry-run', '--create-missing')
+
+        self.assertIn('Would import 2 listens', out)
+        self.assertIn('Would create 1 artists and 1 albums', out)
+        self.assertEqual(Listen.objects.count(), 0)
+        self.assertEqual(Artist.objects.count(), 1)
+
+    def test_json_array(self):
+        out = self.run_import('listens.json', (
+            '[{"artist": "Slowdive", "album": "Souvlaki", "date": "2021-03-05"'
+            '},\n {"artist": {"#text": "Slowdive"}, "album": "Souvlaki"}]'))
+        self.assertIn('Imported 2 listens', out)
+
+        # Decoded a small chunk at a time
+        stream = io.StringIO(json.dumps(
+            [{'artist': 'Artist {}'.format(i), 'album': 'Album {{}}'}
+             for i in range(20)], indent=2))
+        records = list(read_json_array(stream, chunk_size=7))
+        self.assertEqual([record['artist'] for record in records],
+                         ['Artist {}'.format(i) for i in range(20)])
+        self.assertEqual(list(read_json_array(io.StringIO(' [ ] '))), [])
+        for text in ('{"artist": "A"}', '[{"artist": "A"} {}]',
+                     '[{"artist": "A"},', '[{"artist": "A'):
+            with self.subTest(text=text):
+                with self.assertRaises(ListenImportError):
+                    list(read_json_array(io.StringIO(text), chunk_size=4))
+
+    def test_json_error_where_found(self):
+        item = '{"artist": "Slowdive", "album": "Souvlaki"}'
+        text = ('[\n{},\n  {{"artist": "Slowdive" "album": "Souvlaki"}},\n'
+                '{}]'.format(item, ',\n'.join([item] * 1000)))
+        stream = io.StringIO(text)
+        records = read_json_array(stream, chunk_size=16)
+        self.assertEqual(next(records)['album'], 'Souvlaki')
+        with self.assertRaisesRegex(
+                ListenImportError,
+                r'^Invalid JSON in item 2 at line 3 column 25: '
+                r"Expecting ',' delimiter\.$"):
+            next(records)
+        # Without reading the rest of the file first
+        self.assertLess(stream.tell(), 200)
+
+        # Strings, however long, may be cut off by the end of a chunk
+        stream = io.StringIO(json.dumps(
+            [{'artist': 'Slowdive', 'album': 'x' * 100}]))
+        self.assertEqual(
+            len(list(read_json_array(stream, chunk_size=16))[0]['album']),
+            100)
+
+    def test_bad_records_skipped(self):
+        out = self.run_import('listens.json', (
+            '[{"artist": "Slowdive", "album": "Souvlaki"}, 1,\n'
+            ' {"artist": "Slowdive", "album": "Souvlaki"}]'))
+        self.assertIn('Imported 2 listens', out)
+        self.assertIn('Row 2: Item 2 is not a JSON object.', out)
+
+        out = self.run_import('listens.jsonl', (
+            '{"artist": "Slowdive", "album": "Souvlaki"}\n'
+            '{"artist": "Slowdive",\n'
+            '["Slowdive", "Souvlaki"]\n'
+            '{"artist": "Slowdive", "album": "Souvlaki"}\n'))
+        self.assertIn('Imported 2 listens', out)
+        self.assertIn('Row 2: Invalid JSON on line 2', out)
+        self.assertIn('Row 3: Line 3 is not a JSON object.', out)
+
+        # Albums which aren't valid, or which the database won't create
+        create = Album.objects.create
+
+        def create_album(**fields):
+            if fields['name'] == 'Rejected':
+                raise IntegrityError('rejected')
+            return create(**fields)
+
+        with mock.patch.object(Album.objects, 'create',
+                               side_effect=create_album):
+            out = self.run_import('listens.csv', (
+                'artist,album,date,rating\n'
+                'Low,Rejected,2021-03-05,\n'
+                'Low,Too Good,2021-03-05,9\n'
+                'Low,Double Negative,2021-03-06,\n'
+                'Low,Rejected,2021-03-07,\n'
+                'Slowdive,Souvlaki,2021-03-08,\n'),
+                '--create-missing', '--batch-size', '2')
+        self.assertIn('Imported 2 listens', out)
+        self.assertIn('Created 1 artists and 1 albums', out)
+        self.assertIn('Skipped 3 rows', out)
+        self.assertIn("Row 1: couldn't create album 'Rejected': rejected",
+                      out)
+        self.assertIn("Row 2: invalid album 'Too Good': Value not between 0 "
+                      "and 5.", out)
+        self.assertIn("Row 4: couldn't create album 'Rejected'", out)
+        self.assertEqual(
+            Album.objects.lookup('low', 'double negative').get().play_count,
+            1)
+        self.assertFalse(Album.objects.filter(name='Rejected').exists())
+        self.assertEqual(Listen.objects.count(), 6)
+
+    def test_created_in_batch_transaction(self):
+        with mock.patch.object(Listen.objects, 'bulk_create',
+                               side_effect=ValueError('Disk full')):
+            with self.assertRaises(ValueError):
+                self.run_import('listens.csv', (
+                    'artist,album,date\n'
+                    'Low,Things We Lost in the Fire,2021-03-05\n'),
+                    '--create-missing')
+        self.assertFalse(Artist.objects.filter(name='Low').exists())
+
+        # Created with the batch of their first listen
+        out = self.run_import('listens.csv', (
+            'artist,album,date\n'
+            'Slowdive,Souvlaki,2021-03-04\n'
+            'Low,Things We Lost in the Fire,2021-03-05\n'
+            'Low,Things We Lost in the Fire,2021-03-06\n'
+            'Low,Double Negative,2021-03-07\n'),
+            '--create-missing', '--batch-size', '2')
+        self.assertIn('Created 1 artists and 2 albums', out)
+        self.assertEqual(
+            Album.objects.lookup('low', 'things we lost in the fire').get()
+            .play_count, 2)
+        self.assertEqual(
+            Album.objects.lookup('low', 'double negative').get().play_count,
+            1)
+
+    def test_parse_listen_date(self):
+        self.assertEqual(parse_listen_date('3/5/21'),
+                         datetime.date(2021, 3, 5))
+        self.assertEqual(parse_listen_date('2021-03-05T23:30:00+00:00'),
+                         datetime.date(2021, 3, 5))
+        self.assertIsNone(parse_listen_date(''))
+
+
+class ExportLibraryTests(TrackerTestCase):
+
+    def setUp(self):
+        super(ExportLibraryTests, self).setUp()
+        make_library(3, 2, 2)
+        Listen.objects.create(album=Album.objects.first(), listen_date=None)
+
+    def library_snapshot(self):
+        albums = Album.objects.values_list(
+            'artist__name', 'name', 'year', 'rating', 'play_count',
+            'last_listen_date', 'primary_genres__name')
+        listens = Listen.objects.values_list('album__artist__name',
+                                             'album__name', 'listen_date')
+        return sorted(albums), sorted(listens, key=str)
+
+    def export_and_reload(self, export_format, reload):
+        before = self.library_snapshot()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'library.' + export_format)
+            call_command('export_library', '--format', export_format,
+                         '--chunk-size', '3', '-o', path)
+            Artist.objects.all().delete()
+            PrimaryGenre.objects.all().delete()
+            reload(path)
+        return before, self.library_snapshot()
+
+    def test_jsonl_round_trip(self):
+        before, after = self.export_and_reload(
+            'jsonl', lambda path: call_command('loaddata', path,
+                                               verbosity=0))
+        self.assertEqual(before, after)
+        self.assertEqual(Album.objects.lookup('artist 0', 'album 1').count(),
+                         1)
+
+    def test_json_round_trip(self):
+        before, after = self.export_and_reload(
+            'json', lambda path: call_command('loaddata', path,
+                                              verbosity=0))
+        self.assertEqual(before, after)
+
+    def test_csv_round_trip(self):
+        before, after = self.export_and_reload(
+            'csv', lambda path: call_command('import_listens', path,
+                                             '--create-missing',
+                                             stdout=io.StringIO()))
+        # Genres aren't part of the listen history
+        self.assertEqual([row[:-1] for row in before[0]],
+                         [row[:-1] for row in after[0]])
+        self.assertEqual(before[1], after[1])
+
+    def test_download_streams(self):
+        response = self.client.get(reverse('tracker:export'),
+                                   {'format': 'csv'})
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment', response['Content-Disposition'])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'artist,album,year,rating,date')
+        self.assertEqual(len(lines), Listen.objects.count() + 1)
+
+        self.client.logout()
+        response = self.client.get(reverse('tracker:export'))
+        self.assertEqual(response.status_code, 302)
+
+
+class TimingMiddlewareTests(TrackerTestCase):
+
+    @override_settings(TRACKER_TIMING_ENABLED=True)
+    def test_server_timing_header_and_log(self):
+        make_library(1, 2, 1)
+        with self.assertLogs('tracker.timing', 'INFO') as logs:
+            response = self.client.get(reverse('tracker:index'))
+
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertRegex(timing, r'tpl;dur=[\d.]+')
+        self.assertIn('view;desc="IndexView"', timing)
+        self.assertIn('view=IndexView', logs.output[0])
+        self.assertIn('status=200', logs.output[0])
+
+    @override_settings(TRACKER_TIMING_ENABLED=False)
+    def test_can_be_turned_off(self):
+        client = Client()
+        client.force_login(self.user)
+        response = client.get(reverse('tracker:index'))
+        self.assertNotIn('Server-Timing', response)
+
+
+@override_settings(TRACKER_JOBS='manual')
+class BenchmarkTests(TestCase):
+
+    def test_generate_library(self):
+        counts = generate_library(5, 20, 300, seed=1)
+        self.assertEqual(counts, (5, 20, 300))
+        self.assertEqual(Album.objects.count(), 20)
+        self.assertEqual(Listen.objects.count(), 300)
+        # Stored stats are refreshed after bulk_create
+        self.assertEqual(sum(Album.objects.values_list('play_count',
+                                                       flat=True)), 300)
+        # Same seed, same library
+        names = list(Album.objects.order_by('pk').values_list(
+            'name', 'artist__name', 'rating'))
+        Album.objects.all().delete()
+        Artist.objects.all().delete()
+        generate_library(5, 20, 300, seed=1)
+        self.assertEqual(list(Album.objects.order_by('pk').values_list(
+            'name', 'artist__name', 'rating')), names)
+
+    def test_run_and_compare(self):
+        generate_library(3, 10, 50)
+        results = run_benchmarks(repeat=1)
+        self.assertIn('view:index', results)
+        self.assertGreater(results['view:index']['queries'], 0)
+
+        old = {'sizes': {'tiny': {'results': results}}}
+        self.assertEqual(compare_results(old, old), [])
+        slower = json.loads(json.dumps(old))
+        slower['sizes']['tiny']['results']['view:index']['median_ms'] += 100
+        slower['sizes']['tiny']['results']['view:album']['queries'] += 1
+        self.assertEqual(len(compare_results(old, slower)), 2)
+
+
+class RollupTests(TrackerTestCase):
+
+    def rollups(self):
+        return (
+            sorted(DailyAlbumListens.objects.values_list(
+                'album__name', 'date', 'listens')),
+            sorted(DailyGenreListens.objects.values_list(
+                'genre__name', 'date', 'listens')),
+        )
+
+    def assertRollupsCorrect(self):
+        """Check the incrementally updated rollups match a full rebuild."""
+        incremental = self.rollups()
+        rebuild_rollups()
+        self.assertEqual(incremental, self.rollups())
+
+    def test_updated_as_listens_change(self):
+        make_library(1, 2, 3)
+        album, other = Album.objects.order_by('name')
+        day = datetime.date(2020, 1, 1)
+        self.assertEqual(
+            DailyAlbumListens.objects.get(album=album, date=day).listens, 1)
+        self.assertEqual(
+            DailyGenreListens.objects.get(date=day).listens, 2)
+
+        listen = Listen.objects.create(album=album, listen_date=day)
+        self.assertEqual(
+            DailyAlbumListens.objects.get(album=album, date=day).listens, 2)
+        self.assertRollupsCorrect()
+
+        listen.album = other
+        listen.listen_date = datetime.date(2021, 1, 1)
+        listen.save()
+        self.assertRollupsCorrect()
+
+        listen.delete()
+        Listen.objects.create(album=album, listen_date=None)
+        self.assertRollupsCorrect()
+
+    def test_updated_as_genres_change(self):
+        make_library(1, 2, 2)
+        album = Album.objects.first()
+        jazz = PrimaryGenre.objects.create(name='Jazz')
+
+        album.primary_genres.add(jazz)
+        self.assertRollupsCorrect()
+        album.primary_genres.clear()
+        self.assertRollupsCorrect()
+        jazz.album_set.add(*Album.objects.all())
+        self.assertRollupsCorrect()
+        album.delete()
+        self.assertRollupsCorrect()
+
+    def test_import_updates_rollups(self):
+        make_library(1, 1, 0)
+        stream = io.StringIO(
+            'artist,album,date\n'
+            'Artist 0,Album 0,2021-02-03\n'
+            'Artist 0,Album 0,2021-02-03\n')
+        ListenImporter().run(read_csv(stream))
+        self.assertEqual(DailyAlbumListens.objects.get().listens, 2)
+        self.assertRollupsCorrect()
+
+    def test_rebuild_command(self):
+        make_library(2, 2, 2)
+        expected = self.rollups()
+        DailyAlbumListens.objects.all().delete()
+        DailyGenreListens.objects.all().delete()
+        out = io.StringIO()
+        call_command('rebuild_rollups', stdout=out)
+        self.assertEqual(self.rollups(), expected)
+        self.assertIn('Rebuilt 8 album and 2 genre', out.getvalue())
+
+
+class StatsViewTests(TrackerTestCase):
+
+    def test_stats_page(self):
+        today = datetime.date.today()
+        make_library(2, 2, 0)
+        album = Album.objects.get(name='Album 1', artist__name='Artist 0')
+        for _ in range(3):
+            Listen.objects.create(album=album, listen_date=today)
+        Listen.objects.create(album=Album.objects.exclude(pk=album.pk)[0],
+                              listen_date=today - datetime.timedelta(days=1))
+
+        response = self.client.get(reverse('tracker:stats'),
+                                   {'period': 'day'})
+
+        context = response.context
+        self.assertEqual(context['total_listens'], 4)
+        self.assertEqual(context['listens_per_period'][-1]['listens'], 3)
+        self.assertEqual(context['listens_per_period'][-1]['percent'], 100)
+        # Newest period first, each with its own most played
+        other = Album.objects.exclude(pk=album.pk)[0]
+        label, top = context['top_albums'][0]
+        self.assertEqual(top, [(album, 3)])
+        label, top = context['top_albums'][1]
+        self.assertEqual(top, [(other, 1)])
+        self.assertEqual(context['top_albums'][2][1], [])
+        self.assertEqual(len(context['top_albums']), PERIODS['day'])
+        self.assertEqual(context['top_artists'][0][1], [(album.artist, 3)])
+        self.assertEqual(context['top_artists'][1][1], [(other.artist, 1)])
+        self.assertEqual(context['genre_share'][-1][1], [100])
+        self.assertContains(response, 'Listens per day')
+
+        response = self.client.get(reverse('tracker:stats'),
+                                   {'period': 'year'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_query_count_independent_of_history(self):
+        url = reverse('tracker:stats')
+        make_library(2, 2, 2)
+        small = self.count_queries(url)
+
+        cache.clear()
+        make_library(4, 3, 10, prefix='More')
+        large = self.count_queries(url)
+
+        self.assertEqual(small, large)
+        self.assertEqual(small, self.count_queries(url + '?period=week'))
+
+    def test_period_starts(self):
+        starts = period_starts('month', datetime.date(2021, 3, 15))
+        self.assertEqual(len(starts), PERIODS['month'])
+        self.assertEqual(starts[-1], datetime.date(2021, 3, 1))
+        self.assertEqual(starts[0], datetime.date(2019, 4, 1))
+        starts = period_starts('week', datetime.date(2021, 3, 17))
+        self.assertEqual(starts[-1], datetime.date(2021, 3, 15))
+
+
+class SearchTests(TrackerTestCase):
+
+    def setUp(self):
+        super(SearchTests, self).setUp()
+        rock = PrimaryGenre.objects.create(name='Rock')
+        radiohead = Artist.objects.create(name='Radiohead')
+        bjork = Artist.objects.create(name='Björk')
+        self.kid_a = Album.objects.create(
+            name='Kid A', artist=radiohead, year=2000, rating=5,
+            secondary_genres='electronic, art rock', comments='Cold.')
+        self.kid_a.primary_genres.add(rock)
+        Album.objects.create(name='Homogenic', artist=bjork, year=1997,
+                             rating=4.5, secondary_genres='art pop',
+                             comments='Kid-friendly strings.')
+
+    def search(self, query):
+        return [(r['kind'], r['name']) for r in search(query)]
+
+    def test_ranking_and_prefixes(self):
+        self.assertEqual(self.search('radio')[0], ('artist', 'Radiohead'))
+        self.assertEqual(self.search('radiohead kid'),
+                         [('album', 'Kid A')])
+        # A name match beats a comment match
+        self.assertEqual(self.search('kid'),
+                         [('album', 'Kid A'), ('album', 'Homogenic')])
+        self.assertEqual(self.search('bjork'), [('artist', 'Björk'),
+                                                ('album', 'Homogenic')])
+        self.assertEqual(self.search('rock cold'), [('album', 'Kid A')])
+        self.assertEqual(self.search('"*'), [])
+
+    def test_index_follows_changes(self):
+        self.kid_a.name = 'Amnesiac'
+        self.kid_a.save()
+        self.assertEqual(self.search('amnes'), [('album', 'Amnesiac')])
+
+        artist = Artist.objects.get(name='Radiohead')
+        artist.name = 'On A Friday'
+        artist.save()
+        self.assertEqual(self.search('friday'), [('artist', 'On A Friday'),
+                                                 ('album', 'Amnesiac')])
+
+        jazz = PrimaryGenre.objects.create(name='Jazz')
+        jazz.album_set.add(self.kid_a)
+        self.assertEqual(self.search('jazz'), [('album', 'Amnesiac')])
+        jazz.delete()
+        self.assertEqual(self.search('jazz'), [])
+
+        artist.delete()
+        self.assertEqual(self.search('friday'), [])
+
+    def test_python_index_matches_fts5(self):
+        if not FTS5Index.exists(connection):
+            self.skipTest('FTS5 not available')
+        fts5 = FTS5Index()
+        python = PythonIndex()
+        for query in ('radio', 'kid', 'art', 'bjo', 'rock cold', 'zzz'):
+            words = tokenize(query)
+            with self.subTest(query=query):
+                expected = fts5.search(words, 10)
+                actual = python.search(words, 10)
+                self.assertEqual([doc_id for doc_id, _ in actual],
+                                 [doc_id for doc_id, _ in expected])
+                for (_, score), (_, expected_score) in zip(actual, expected):
+                    self.assertAlmostEqual(score, expected_score, places=6)
+
+    def test_search_view(self):
+        response = self.client.get(reverse('tracker:api-search'),
+                                   {'q': 'kid a', 'limit': 1})
+        data = response.json()
+        self.assertEqual(data['query'], 'kid a')
+        self.assertEqual(len(data['results']), 1)
+        result = data['results'][0]
+        self.assertEqual(result['artist'], 'Radiohead')
+        self.assertEqual(result['url'], self.kid_a.get_absolute_url())
+
+        response = self.client.get(reverse('tracker:api-search'),
+                                   {'q': 'kid', 'limit': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(TRACKER_JOBS='sync')
+class PythonIndexUpdateTests(TransactionTestCase):
+    """The in-memory index applies changes once they're committed, which
+    needs real transactions.
+    """
+    def setUp(self):
+        cache.clear()
+        make_library(2, 2, 1)
+        self.index = PythonIndex()
+        patcher = mock.patch('tracker.search.get_index',
+                             return_value=self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def search(self, query):
+        return [parse_document_id(doc_id)
+                for doc_id, _ in self.index.search(tokenize(query), 10)]
+
+    def test_changes_applied_in_place(self):
+        album = Album.objects.get(name='Album 1', artist__name='Artist 0')
+        with mock.patch.object(self.index, 'load',
+                               wraps=self.index.load) as load:
+            self.assertIn(('album', album.pk), self.search('album 1'))
+            Listen.objects.create(album=album,
+                                  listen_date=datetime.date.today())
+            album.name = 'Wildflowers'
+            album.save()
+            self.assertEqual(self.search('wild'), [('album', album.pk)])
+            self.assertNotIn(('album', album.pk), self.search('album 1'))
+            artist = album.artist
+            artist.name = 'Heartbreakers'
+            artist.save()
+            self.assertEqual(
+                sorted(self.search('heart')),
+                sorted([('artist', artist.pk)] + [
+                    ('album', pk) for pk in
+                    artist.album_set.values_list('pk', flat=True)]))
+            album.delete()
+            self.assertEqual(self.search('wild'), [])
+            self.assertNotIn('wildflowers', self.index.words)
+            self.assertEqual(load.call_count, 1)
+
+        # Matches an index read from scratch
+        fresh = PythonIndex()
+        for query in ('heart', 'album', 'artist 1', 'rock'):
+            with self.subTest(query=query):
+                self.assertEqual(
+                    self.index.search(tokenize(query), 10),
+                    fresh.search(tokenize(query), 10))
+
+    def test_rolled_back_changes_ignored(self):
+        album = Album.objects.get(name='Album 1', artist__name='Artist 0')
+        self.search('album')
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                album.name = 'Wildflowers'
+                album.save()
+                raise ValueError
+        self.assertEqual(self.search('wild'), [])
+
+    def test_other_process_changes(self):
+        self.search('album')
+        Artist.objects.filter(name='Artist 1').update(name='Petty')
+        # As if another process had changed it
+        bump_version(SEARCH_VERSION_KEY)
+        # The artist and their two albums
+        self.assertEqual(len(self.search('petty')), 3)
+
+    def test_concurrent_searches(self):
+        album = Album.objects.get(name='Album 1', artist__name='Artist 0')
+        self.search('album')
+        errors = []
+
+        def searches():
+            try:
+                for i in range(200):
+                    self.index.search(['album', 'a'], 10)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=searches) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for i in range(20):
+            album.name = 'Album 1 take {}'.format(i)
+            album.save()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+class AlbumAutocompleteTests(TrackerTestCase):
+
+    def autocomplete(self, query, **params):
+        response = self.client.get(reverse('tracker:api-album-autocomplete'),
+                                   dict(params, q=query))
+        return [r['label'] for r in response.json()['results']]
+
+    def test_prefix_matches(self):
+        make_library(2, 2, 0, prefix='Band')
+        Album.objects.create(name='Band Practice',
+                             artist=Artist.objects.get(name='Band 1'),
+                             year=2001, rating=3)
+
+        self.assertEqual(self.autocomplete('band 1'), [
+            'Band 1 – Album 0', 'Band 1 – Album 1',
+            'Band 1 – Band Practice'])
+        self.assertEqual(self.autocomplete('BAND P'),
+                         ['Band 1 – Band Practice'])
+        self.assertEqual(self.autocomplete('band 0 - album 1'),
+                         ['Band 0 – Album 1'])
+        self.assertEqual(self.autocomplete('band 1 – b'),
+                         ['Band 1 – Band Practice'])
+        self.assertEqual(len(self.autocomplete('band', limit=2)), 2)
+        self.assertEqual(len(self.autocomplete('album 1')), 2)
+        self.assertEqual(self.autocomplete('zzz'), [])
+        self.assertEqual(self.autocomplete(''), [])
+
+    def test_listen_form_doesnt_list_albums(self):
+        url = reverse('tracker:listen-create')
+        make_library(2, 2, 0)
+        small = self.count_queries(url)
+        make_library(5, 5, 0, prefix='More')
+        self.assertEqual(self.count_queries(url), small)
+
+        response = self.client.get(url)
+        self.assertNotContains(response, 'Album 0')
+        self.assertContains(response, 'tracker/autocomplete.js')
+
+    def test_listen_form_submission(self):
+        make_library(1, 1, 0)
+        album = Album.objects.get()
+        url = reverse('tracker:listen-create')
+
+        response = self.client.post(url, {'album': album.pk,
+                                          'listen_date': '2021-03-04'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(album.listen_set.get().listen_date,
+                         datetime.date(2021, 3, 4))
+
+        # Redisplayed with the chosen album's label
+        response = self.client.post(url, {'album': album.pk,
+                                          'listen_date': 'not a date'})
+        self.assertContains(response, 'value="Artist 0 – Album 0"')
+        response = self.client.post(url, {'album': '',
+                                          'listen_date': '2021-03-04'})
+        self.assertContains(response, 'This field is required.')
+
+
+class GenreTagTests(TrackerTestCase):
+
+    def tags(self, album):
+        return list(album.albumgenretag_set.values_list('tag__name',
+                                                        flat=True))
+
+    def test_parse_genre_tags(self):
+        self.assertEqual(parse_genre_tags(' Art  Rock, idm,, art rock , '),
+                         ['art rock', 'idm'])
+        self.assertEqual(parse_genre_tags(''), [])
+
+    def test_tags_follow_secondary_genres(self):
+        make_library(1, 1, 0)
+        album = Album.objects.get()
+        album.secondary_genres = 'Dream Pop, shoegaze'
+        album.save()
+        self.assertEqual(self.tags(album), ['dream pop', 'shoegaze'])
+
+        album.secondary_genres = 'shoegaze'
+        album.save()
+        self.assertEqual(self.tags(album), ['shoegaze'])
+
+        out = io.StringIO()
+        call_command('rebuild_genre_tags', stdout=out)
+        self.assertIn('deleted 1 unused tag', out.getvalue())
+        self.assertEqual(list(GenreTag.objects.values_list('name', flat=True)),
+                         ['shoegaze'])
+
+    def test_filter_uses_tags(self):
+        make_library(1, 1, 0)
+        album = Album.objects.get()
+        album.secondary_genres = 'art rock, electronic'
+        album.save()
+        albums = filter_albums(Album.objects.all(),
+                               {'genres': 'ROCK, !jazz | electr'})
+        where = str(albums.query).split(' WHERE ', 1)[1]
+        self.assertNotIn('secondary_genres', where)
+        self.assertIn('tracker_albumgenretag', where)
+        self.assertEqual(list(albums), [album])
+
+    def test_facets(self):
+        make_library(1, 3, 0)
+        for album, genres in zip(Album.objects.order_by('name'),
+                                 ['rock, jazz', 'rock', 'jazz, rock, pop']):
+            album.secondary_genres = genres
+            album.save()
+
+        url = reverse('tracker:api-genres')
+        data = self.client.get(url).json()
+        self.assertEqual(data['tags'], [
+            {'name': 'rock', 'albums': 3}, {'name': 'jazz', 'albums': 2},
+            {'name': 'pop', 'albums': 1}])
+        self.assertEqual(data['primary'], [{'name': 'Rock', 'albums': 3}])
+
+        data = self.client.get(url, {'genres': 'jazz', 'limit': 2}).json()
+        self.assertEqual(data['tags'], [
+            {'name': 'jazz', 'albums': 2}, {'name': 'rock', 'albums': 2}])
+        self.assertEqual(data['primary'], [{'name': 'Rock', 'albums': 2}])
+
+
+def query_plan(queryset):
+    """Get SQLite's query plan for a queryset, as a list of its steps."""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'Reads SQLite plans')
+class QueryPlanTests(TrackerTestCase):
+    """The main queries should be answered from indexes, without scanning
+    whole tables or sorting rows.
+    """
+    def setUp(self):
+        super(QueryPlanTests, self).setUp()
+        make_library(3, 3, 4)
+        self.album = Album.objects.first()
+
+    def assertIndexed(self, queryset, search=True):
+        """Check a queryset's plan, which must also look rows up by index
+        (rather than read a whole index in order) if search is true.
+        """
+        plan = query_plan(queryset)
+        for step in plan:
+            self.assertNotRegex(step, r'^SCAN \w+$', plan)
+            self.assertNotIn('TEMP B-TREE', step, plan)
+        if search:
+            self.assertRegex(plan[0], r'^SEARCH \w+ USING', plan)
+
+    def test_album_table(self):
+        self.assertIndexed(Album.objects.for_table(), search=False)
+        albums = Album.objects.for_table().order_by(*ALBUM_TABLE_ORDERING)
+        self.assertIndexed(albums[:100], search=False)
+        cursor = encode_cursor(self.album)
+        self.assertIndexed(albums.filter(after_cursor(cursor))[:100])
+
+    def test_listens(self):
+        self.assertIndexed(self.album.all_listens()[:5])
+        self.assertIndexed(self.album.listen_set.all())
+        self.assertIndexed(Listen.objects.filter(
+            listen_date__range=(datetime.date(2020, 1, 2),
+                                datetime.date(2020, 1, 3))))
+        self.assertIndexed(
+            Listen.objects.exclude(listen_date=None).order_by()
+            .values_list('album_id', 'listen_date').annotate(Count('pk')),
+            search=False)
+
+    def test_lookups(self):
+        # Unordered, as at most one artist or album matches
+        self.assertIndexed(
+            Album.objects.lookup('artist 1', 'album 2').order_by())
+        self.assertIndexed(
+            Artist.objects.filter(name_key='artist 1').order_by())
+
+    def test_sort_artist_name(self):
+        self.assertEqual(self.album.sort_artist_name, self.album.artist.name)
+        artist = Artist.objects.get(name='Artist 0')
+        artist.name = 'Z Artist'
+        artist.save()
+        self.assertEqual(set(Album.objects.filter(artist=artist).values_list(
+            'sort_artist_name', flat=True)), {'Z Artist'})
+        self.assertEqual(
+            list(Album.objects.all()),
+            list(Album.objects.order_by('-rating', 'artist__name', 'name')))
+
+
+class RecommendationTests(TrackerTestCase):
+
+    def setUp(self):
+        super(RecommendationTests, self).setUp()
+        today = datetime.date.today()
+        rock = PrimaryGenre.objects.create(name='Rock')
+        jazz = PrimaryGenre.objects.create(name='Jazz')
+        artist = Artist.objects.create(name='Artist')
+
+        def album(name, rating, genre, tags, *days_ago):
+            album = Album.objects.create(name=name, artist=artist, year=2000,
+                                         rating=rating, secondary_genres=tags)
+            album.primary_genres.add(genre)
+            for days in days_ago:
+                Listen.objects.create(
+                    album=album,
+                    listen_date=today - datetime.timedelta(days=days))
+            return album
+
+        self.recent = album('Recent', 4.0, rock, 'Shoegaze', 1, 2, 3)
+        self.old = album('Old', 3.0, rock, 'Shoegaze, Noise', 400)
+        self.unheard_rock = album('Unheard Rock', 2.0, rock, 'Noise')
+        self.unheard_jazz = album('Unheard Jazz', 5.0, jazz, 'Bebop')
+
+    def ranked(self, **weights):
+        params = dict.fromkeys(recommendations.COMPONENTS, '0')
+        params.update((name, str(weight)) for name, weight in weights.items())
+        response = self.client.get(reverse('tracker:api-recommendations'),
+                                   params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def names(self, **weights):
+        return [album['album'] for album in self.ranked(**weights)]
+
+    def test_components(self):
+        self.assertEqual(self.names(rating=1), ['Unheard Jazz', 'Recent',
+                                                'Old', 'Unheard Rock'])
+        self.assertEqual(self.names(plays=1)[:2], ['Recent', 'Old'])
+        self.assertEqual(self.names(recency=1)[:3],
+                         ['Unheard Rock', 'Unheard Jazz', 'Old'])
+        self.assertEqual(self.names(genre=1), ['Recent', 'Old',
+                                               'Unheard Rock',
+                                               'Unheard Jazz'])
+
+        results = {album['album']: album for album in self.ranked(rating=1)}
+        components = results['Old']['components']
+        self.assertAlmostEqual(components['rating'], 0.6)
+        self.assertAlmostEqual(components['plays'], math.log(2) / math.log(4))
+        self.assertAlmostEqual(components['recency'],
+                               1 - math.exp(-400 / 180))
+        # Cosine similarity of (rock, shoegaze, noise) with the three recent
+        # listens of (rock, shoegaze)
+        self.assertAlmostEqual(components['genre'], 2 / math.sqrt(6))
+        self.assertEqual(results['Unheard Jazz']['components']['genre'], 0)
+
+    def test_weights(self):
+        with override_settings(TRACKER_RECOMMENDATION_WEIGHTS={'rating': 1}):
+            self.assertEqual(recommendations.parse_weights({}),
+                             {'rating': 1, 'plays': 0.0, 'recency': 0.0,
+                              'genre': 0.0})
+        self.assertEqual(self.names(rating=1, genre=2)[0], 'Recent')
+        self.assertEqual(self.names(rating=-1)[0], 'Unheard Rock')
+        self.assertEqual(len(self.ranked(limit=2, rating=1)), 2)
+
+        for weight in ('x', 'nan', 'inf'):
+            response = self.client.get(
+                reverse('tracker:api-recommendations'), {'genre': weight})
+            self.assertEqual(response.status_code, 400)
+
+    def test_page(self):
+        response = self.client.get(reverse('tracker:recommendations'),
+                                   {'recency': '2'})
+        self.assertContains(response, 'Unheard Rock')
+        self.assertContains(response, 'value="2.0"')
+        data = self.client.get(reverse('tracker:api-recommendations'),
+                               {'recency': '2'}).json()
+        self.assertEqual(response.context['results'], data['results'])
+
+    def test_cached_until_data_changes(self):
+        url = reverse('tracker:recommendations')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        tracker_queries = [query for query in context.captured_queries
+                           if 'tracker_' in query['sql']]
+        # Just the albums shown
+        self.assertEqual(len(tracker_queries), 1)
+
+        self.unheard_jazz.rating = 0.5
+        self.unheard_jazz.save()
+        self.assertEqual(self.names(rating=1)[0], 'Recent')
+
+    def test_query_count_independent_of_library_size(self):
+        url = reverse('tracker:recommendations')
+        small = self.count_queries(url)
+        make_library(10, 3, 4)
+        cache.clear()
+        self.assertEqual(self.count_queries(url), small)
+
+
+@override_settings(TRACKER_JOBS='manual')
+class RecommendationUpdateTests(TransactionTestCase):
+    """New listens update the recommender once committed, which needs real
+    transactions.
+    """
+    def setUp(self):
+        cache.clear()
+        make_library(2, 2, 1)
+        jobs.run_pending()
+
+    def test_listen_updates_in_place(self):
+        recommender = recommendations.get_recommender()
+        loads = recommender.loads
+        album = Album.objects.get(name='Album 1', artist__name='Artist 0')
+        row = recommender.rows[album.pk]
+        Listen.objects.create(album=album, listen_date=datetime.date.today())
+
+        recommender = recommendations.get_recommender()
+        self.assertEqual(recommender.loads, loads)
+        self.assertEqual(recommender.plays[row], 2)
+        self.assertEqual(recommender.last_day[row],
+                         datetime.date.today().toordinal())
+        self.assertEqual(recommender.recent_listens[row], 1)
+
+        # The listen's jobs update the play counts and rollups it loads
+        jobs.run_pending()
+        recommender = recommendations.get_recommender()
+        self.assertEqual(recommender.loads, loads + 1)
+        self.assertEqual(recommender.plays[row], 2)
+
+        Album.objects.filter(pk=album.pk).update(rating=1.0)
+        album.save()
+        recommender = recommendations.get_recommender()
+        self.assertEqual(recommender.loads, loads + 2)
+        self.assertEqual(recommender.rating[row], 1.0)
+
+    def test_other_changes_not_adopted(self):
+        recommender = recommendations.get_recommender()
+        loads = recommender.loads
+        album = Album.objects.get(name='Album 1', artist__name='Artist 0')
+        row = recommender.rows[album.pk]
+        with transaction.atomic():
+            Listen.objects.create(album=album,
+                                  listen_date=datetime.date.today())
+            # Another process changing an album while the listen is saved
+            Album.objects.filter(pk=album.pk).update(rating=1.0)
+            bump_data_version()
+
+        recommender = recommendations.get_recommender()
+        self.assertEqual(recommender.loads, loads + 1)
+        self.assertEqual(recommender.rating[row], 1.0)
+
+
+@override_settings(TRACKER_JOBS='sync')
+class SimilarityTests(TrackerTestCase):
+
+    def setUp(self):
+        super(SimilarityTests, self).setUp()
+        self.day = datetime.date(2021, 3, 1)
+        self.rock = PrimaryGenre.objects.create(name='Rock')
+        self.jazz = PrimaryGenre.objects.create(name='Jazz')
+
+    def album(self, artist, name, genre, tags='', *days):
+        artist, _ = Artist.objects.get_or_create(name=artist)
+        album = Album.objects.create(name=name, artist=artist, year=2000,
+                                     rating=3.0, secondary_genres=tags)
+        album.primary_genres.add(genre)
+        for day in days:
+            self.listen(album, day)
+        return album
+
+    def listen(self, album, day):
+        Listen.objects.create(
+            album=album, listen_date=self.day + datetime.timedelta(days=day))
+
+    def similar(self, album):
+        return [similar.similar for similar in album.similar_albums.all()]
+
+    def test_colistens_beat_genre(self):
+        # Artists' names in the opposite order to their ids
+        quiet = self.album('Z', 'Quiet', self.rock, '', 0, 10)
+        loud = self.album('Y', 'Loud', self.jazz, '', 1, 11)
+        other = self.album('X', 'Other', self.rock, '', 30)
+        far = self.album('W', 'Far', self.jazz, '', 12)
+        similarity.rebuild_similarities()
+
+        self.assertEqual(self.similar(quiet), [loud, other])
+        # Two days apart isn't the same session
+        self.assertEqual(self.similar(far), [loud])
+        scores = {similar.similar: similar.score
+                  for similar in quiet.similar_albums.all()}
+        # Two of two days each, against the genre weight
+        self.assertAlmostEqual(scores[loud], 1)
+        self.assertAlmostEqual(scores[other], 0.5)
+        artists = [(similar.similar.name, similar.score)
+                   for similar in quiet.artist.similar_artists.all()]
+        self.assertEqual([name for name, _ in artists], ['Y', 'X'])
+        self.assertAlmostEqual(artists[0][1], 1)
+
+    def test_genre_tags(self):
+        bebop = self.album('A', 'Bebop', self.jazz, 'Bebop, Cool Jazz')
+        cool = self.album('B', 'Cool', self.jazz, 'Cool Jazz')
+        swing = self.album('C', 'Swing', self.jazz, 'Swing')
+        self.album('D', 'Rock', self.rock)
+        similarity.rebuild_similarities()
+
+        self.assertEqual(self.similar(bebop), [cool, swing])
+        # Cool has fewer other genres
+        self.assertEqual(self.similar(swing), [cool, bebop])
+
+    def test_generic_genres_left_out(self):
+        first = self.album('A', 'First', self.rock)
+        second = self.album('B', 'Second', self.rock)
+        with mock.patch.object(similarity, 'GENERIC_GENRE_ALBUMS', 1):
+            similarity.rebuild_similarities()
+        self.assertEqual(self.similar(first), [])
+        similarity.rebuild_similarities()
+        self.assertEqual(self.similar(first), [second])
+
+    def test_similar_count(self):
+        albums = [self.album('A', str(i), self.rock) for i in range(5)]
+        with override_settings(TRACKER_SIMILAR_COUNT=2):
+            similarity.rebuild_similarities()
+        self.assertEqual(self.similar(albums[0]), albums[1:3])
+        self.assertEqual([similar.rank for similar
+                          in albums[0].similar_albums.all()], [0, 1])
+
+    def snapshot(self):
+        return ({(similar.album_id, similar.similar_id):
+                 round(similar.score, 9)
+                 for similar in SimilarAlbum.objects.all()},
+                {(similar.artist_id, similar.similar_id):
+                 round(similar.score, 9)
+                 for similar in SimilarArtist.objects.all()})
+
+    @override_settings(TRACKER_SIMILAR_COUNT=100)
+    def test_changes_match_rebuild(self):
+        # Artists' names in the opposite order to their ids
+        albums = [self.album('Artist {}'.format(9 - i % 4), str(i),
+                             (self.rock, self.jazz)[i % 2],
+                             ('Noise', 'Bebop', '')[i % 3], i % 5, i * 2)
+                  for i in range(12)]
+        similarity.rebuild_similarities()
+        for i, album in enumerate(albums):
+            self.listen(album, 7 * i % 11)
+        self.listen(albums[3], 7 * 3 % 11)
+        self.listen(albums[0], 40)
+        self.listen(albums[5], 40)
+
+        updated = self.snapshot()
+        similarity.rebuild_similarities()
+        self.assertEqual(updated, self.snapshot())
+        self.assertTrue(updated[0] and updated[1])
+
+        albums[0].listen_set.filter(listen_date__gt=self.day).delete()
+        listen = albums[4].listen_set.first()
+        listen.album = albums[7]
+        listen.save()
+        albums[2].primary_genres.set([self.jazz])
+        albums[6].secondary_genres = 'Noise'
+        albums[6].save()
+        updated = self.snapshot()
+        similarity.rebuild_similarities()
+        self.assertEqual(updated, self.snapshot())
+
+    def test_pages(self):
+        quiet = self.album('A', 'Quiet', self.rock, '', 0)
+        loud = self.album('B', 'Loud', self.rock, '', 0)
+        album_url = reverse('tracker:album', args=('A', 'Quiet'))
+        artist_url = reverse('tracker:artist', args=('A',))
+        album_queries = self.count_queries(album_url)
+        artist_queries = self.count_queries(artist_url)
+
+        call_command('build_similarities', stdout=io.StringIO())
+        self.assertEqual(self.similar(quiet), [loud])
+        response = self.client.get(album_url)
+        self.assertContains(response, 'Similar albums')
+        self.assertContains(response, reverse('tracker:album',
+                                              args=('B', 'Loud')))
+        response = self.client.get(artist_url)
+        self.assertContains(response, 'Similar artists')
+        self.assertContains(response, reverse('tracker:artist', args=('B',)))
+        self.assertEqual(self.count_queries(album_url), album_queries)
+        self.assertEqual(self.count_queries(artist_url), artist_queries)
+
+
+@override_settings(TRACKER_JOBS='manual')
+class JobTests(TrackerTestCase):
+
+    def setUp(self):
+        super(JobTests, self).setUp()
+        genre = PrimaryGenre.objects.create(name='Rock')
+        self.albums = []
+        for name in ('A', 'B'):
+            artist = Artist.objects.create(name=name)
+            album = Album.objects.create(name=name, artist=artist,
+                                         year=2000, rating=3.0)
+            album.primary_genres.add(genre)
+            self.albums.append(album)
+
+    def pending(self):
+        return sorted(Job.objects.values_list('task', 'object_id',
+                                              'requests'))
+
+    def test_saves_enqueue_merged_jobs(self):
+        first, second = self.albums
+        genre = PrimaryGenre.objects.get()
+        # Created, then added to a genre
+        self.assertEqual(self.pending(), sorted(
+            [('genre_rollups', genre.pk, 2), ('index_genre', genre.pk, 1)]
+            + [('index_artist', album.artist_id, 1) for album in self.albums]
+            + [job for album in self.albums for job in (
+                ('genre_tags', album.pk, 1), ('index_album', album.pk, 2),
+                ('similarities', album.pk, 1))]))
+
+        Job.objects.all().delete()
+        Listen.objects.create(album=first,
+                              listen_date=datetime.date(2021, 1, 1))
+        listen = Listen.objects.create(album=first,
+                                       listen_date=datetime.date(2021, 1, 1))
+        listen.album = second
+        listen.save()
+        self.assertEqual(self.pending(), [
+            ('listen_stats', first.pk, 3), ('listen_stats', second.pk, 1),
+            ('rollups', first.pk, 3), ('rollups', second.pk, 1)])
+        # Nothing derived is updated in the request
+        first.refresh_from_db()
+        self.assertEqual(first.play_count, 0)
+        self.assertFalse(DailyAlbumListens.objects.exists())
+
+        output = io.StringIO()
+        call_command('run_jobs', stdout=output)
+        # Then the similarities of both, enqueued by their rollups
+        self.assertIn('Ran 6 jobs.', output.getvalue())
+        self.assertEqual(self.pending(), [])
+        first.refresh_from_db()
+        self.assertEqual(first.play_count, 1)
+        self.assertEqual(DailyAlbumListens.objects.count(), 2)
+        self.assertEqual([similar.similar for similar
+                          in first.similar_albums.all()], [second])
+
+    def test_enqueued_while_running(self):
+        first = self.albums[0]
+        job = Job.objects.get(task='similarities', object_id=first.pk)
+        with mock.patch.dict(jobs.TASKS, similarities=lambda album_id:
+                             jobs.enqueue('similarities', album_id)):
+            self.assertTrue(jobs.run_job(job))
+        # Runs again for the new request
+        self.assertEqual(Job.objects.get(task='similarities',
+                                         object_id=first.pk).requests,
+                         job.requests + 1)
+
+    def test_failures_kept(self):
+        Job.objects.exclude(task='similarities').delete()
+
+        def fail(album_id):
+            Album.objects.filter(pk=album_id).delete()
+            raise ValueError('No luck')
+        with mock.patch.dict(jobs.TASKS, similarities=fail), \
+                self.assertLogs('tracker.jobs', 'ERROR'):
+            self.assertEqual(jobs.run_pending(), (0, 2))
+            self.assertEqual(jobs.run_pending(), (0, 2))
+            self.assertEqual(jobs.run_pending(), (0, 2))
+            self.assertEqual(jobs.run_pending(), (0, 0))
+        # Rolled back
+        self.assertEqual(Album.objects.count(), 2)
+        job = Job.objects.get(object_id=self.albums[0].pk)
+        self.assertEqual(job.attempts, jobs.MAX_ATTEMPTS)
+        self.assertIn('No luck', job.error)
+
+        # Enqueueing again retries it
+        jobs.enqueue('similarities', self.albums[0].pk)
+        self.assertEqual(jobs.run_pending(), (1, 0))
+
+    def test_unknown_task(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue('nothing', 1)
+
+
+@override_settings(TRACKER_JOBS='thread', TRACKER_JOB_THREADS=1)
+class JobRunnerTests(TransactionTestCase):
+    """Jobs run on the runner's threads once the transaction commits.
+    """
+    def setUp(self):
+        cache.clear()
+
+    def test_jobs_run_in_background(self):
+        with transaction.atomic():
+            make_library(3, 2, 2)
+            self.assertTrue(Job.objects.filter(task='rollups').exists())
+        runner = jobs.get_runner()
+        self.assertTrue(runner.wait(30))
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(Album.objects.filter(play_count=2).count(), 6)
+        self.assertEqual(DailyAlbumListens.objects.count(), 12)
+        self.assertTrue(SimilarAlbum.objects.exists())
+
+    def test_submitted_while_running(self):
+        runner = jobs.JobRunner(1)
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def task(album_id):
+            calls.append(album_id)
+            started.set()
+            release.wait(10)
+        with mock.patch.dict(jobs.TASKS, similarities=task):
+            Job.objects.create(task='similarities', object_id=1)
+            runner.submit('similarities', 1)
+            started.wait(10)
+            # Enqueued again, so run again once it's finished, but only once
+            Job.objects.update(requests=2)
+            runner.submit('similarities', 1)
+            runner.submit('similarities', 1)
+            release.set()
+            self.assertTrue(runner.wait(10))
+        self.assertEqual(calls, [1, 1])
+        self.assertFalse(Job.objects.exists())
+        runner.executor.shutdown()
+
+
+@override_settings(TRACKER_JOBS='manual')
+class AdminTests(TrackerTestCase):
+
+    def setUp(self):
+        super(AdminTests, self).setUp()
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        make_library(3, 2, 3)
+
+    def test_listen_list_queries_independent_of_size(self):
+        urls = [reverse('admin:tracker_listen_changelist') + query
+                for query in ('', '?listen_date__year=2020')]
+        small = [self.count_queries(url) for url in urls]
+        make_library(20, 3, 3, prefix='More')
+        self.assertEqual([self.count_queries(url) for url in urls], small)
+
+    def test_album_list_queries_independent_of_size(self):
+        url = reverse('admin:tracker_album_changelist')
+        small = self.count_queries(url)
+        make_library(20, 3, 0, prefix='More')
+        self.assertEqual(self.count_queries(url), small)
+
+    def test_listen_dates(self):
+        Listen.objects.create(album=Album.objects.first(),
+                              listen_date=datetime.date(2018, 12, 31))
+        Listen.objects.create(album=Album.objects.first(), listen_date=None)
+        plain = models.QuerySet(Listen)
+        for kind in ('year', 'month', 'week', 'day'):
+            for order in ('ASC', 'DESC'):
+                with self.assertNumQueries(1):
+                    dates = list(Listen.objects.dates('listen_date', kind,
+                                                      order))
+                self.assertEqual(
+                    dates, list(plain.dates('listen_date', kind, order)))
+        self.assertEqual(
+            Listen.objects.filter(album__name='Album 0').dates(
+                'listen_date', 'month'),
+            list(plain.filter(album__name='Album 0').dates('listen_date',
+                                                           'month')))
+
+        with self.assertNumQueries(2):
+            dates = Listen.objects.aggregate(first=Min('listen_date'),
+                                             last=Max('listen_date'))
+        self.assertEqual(dates, {'first': datetime.date(2018, 12, 31),
+                                 'last': datetime.date(2020, 1, 3)})
+
+    def test_estimated_count(self):
+        paginator = tracker_admin.EstimatedCountPaginator
+        estimated_count = tracker_admin.estimated_count
+        Listen.objects.filter(listen_date=datetime.date(2020, 1, 2)).delete()
+        listens = Listen.objects.all()
+        # The highest rowid until the table's analyzed
+        self.assertEqual(estimated_count(listens),
+                         listens.aggregate(Max('pk'))['pk__max'])
+        self.assertIsNone(estimated_count(listens.filter(album=None)))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertEqual(estimated_count(listens), 12)
+        album = Album.objects.first()
+        for i in range(6):
+            Listen.objects.create(album=album,
+                                  listen_date=datetime.date(2021, 1, 1))
+        # As of the last ANALYZE
+        self.assertEqual(estimated_count(listens), 12)
+        # Counted, under ESTIMATED_COUNT_MIN
+        self.assertEqual(paginator(listens, 10).count, 18)
+
+        with mock.patch.object(tracker_admin, 'ESTIMATED_COUNT_MIN', 1):
+            listens = paginator(Listen.objects.order_by('pk'), 5)
+            self.assertEqual(listens.num_pages, 3)
+            # Counted once a page past the estimated end is asked for
+            self.assertEqual(len(listens.page(4)), 3)
+            self.assertEqual(listens.count, 18)
+            self.assertEqual(listens.num_pages, 4)
+
+            url = reverse('admin:tracker_listen_changelist')
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse([query for query in queries
+                              if 'COUNT(' in query['sql']
+                              and 'tracker_listen' in query['sql']])
+        Listen.objects.filter(listen_date=datetime.date(2021, 1, 1)).delete()
+
+        with mock.patch.object(tracker_admin, 'estimated_count',
+                               return_value=50000):
+            listens = paginator(Listen.objects.order_by('pk'), 5)
+            self.assertEqual(listens.count, 50000)
+            self.assertEqual(len(listens.page(2)), 5)
+            # Counted once a page past the end is asked for
+            self.assertEqual(len(listens.page(3)), 2)
+            self.assertEqual(listens.count, 12)
+            self.assertEqual(listens.num_pages, 3)
+
+            listens = paginator(Listen.objects.order_by('pk'), 5)
+            with self.assertRaises(EmptyPage):
+                listens.page(4)
+
+    def test_album_search(self):
+        url = reverse('admin:tracker_album_changelist')
+
+        def search(term):
+            response = self.client.get(url, {'q': term})
+            return {(album.artist.name, album.name)
+                    for album in response.context['cl'].result_list}
+
+        self.assertEqual(search('ARTIST'), set(
+            Album.objects.values_list('artist__name', 'name')))
+        self.assertEqual(search('alb'), search('ARTIST'))
+        # Anywhere in the names
+        Album.objects.create(name='The Dark Side of the Moon',
+                             artist=Artist.objects.get(name='Artist 1'),
+                             year=1973, rating=5.0)
+        self.assertEqual(search('dark'),
+                         {('Artist 1', 'The Dark Side of the Moon')})
+        # Whether or not a name starts with the term too
+        Album.objects.create(name='Dark Was the Night',
+                             artist=Artist.objects.create(name='Various'),
+                             year=2009, rating=4.0)
+        self.assertEqual(search('dark'),
+                         {('Artist 1', 'The Dark Side of the Moon'),
+                          ('Various', 'Dark Was the Night')})
+        # Prefixes ignoring case beyond ASCII
+        Album.objects.create(name='Homogenic',
+                             artist=Artist.objects.create(name='Björk'),
+                             year=1997, rating=5.0)
+        self.assertEqual(search('BJÖRK'), {('Björk', 'Homogenic')})
+        # Word by word with more than one
+        self.assertEqual(search('side moon'),
+                         {('Artist 1', 'The Dark Side of the Moon')})
+        self.assertEqual(search('album 1 artist 2'),
+                         {('Artist 2', 'Album 1')})
+        self.assertEqual(search('zzz'), set())
+
+        response = self.client.get(
+            reverse('admin:tracker_album_autocomplete'), {'term': 'artist 2'})
+        self.assertEqual(
+            sorted(result['text'] for result in response.json()['results']),
+            ['Album 0 [Artist 2]', 'Album 1 [Artist 2]'])
+        response = self.client.get(reverse('admin:tracker_listen_add'))
+        self.assertContains(response, 'admin-autocomplete')
+
+
+@override_settings(TRACKER_JOBS='manual')
+class DatabaseProfileTests(TransactionTestCase):
+
+    def test_sqlite_pragmas(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            wrapper = TunedSQLite(dict(
+                connection.settings_dict,
+                NAME=os.path.join(tmp, 'test.sqlite3'),
+                OPTIONS={'pragmas': {'journal_mode': 'WAL',
+                                     'synchronous': 'NORMAL'}}))
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone(), ('wal',))
+                    cursor.execute('PRAGMA synchronous')
+                    # NORMAL
+                    self.assertEqual(cursor.fetchone(), (1,))
+            finally:
+                wrapper.close()
+
+            wrapper.settings_dict['OPTIONS']['pragmas'] = {
+                'journal_mode': 'WAL; DROP TABLE x'}
+            with self.assertRaises(ImproperlyConfigured):
+                wrapper.ensure_connection()
+
+
+class FakeConnection:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+
+    def test_threads_wait_for_connections(self):
+        opened = []
+        in_use = []
+        most_in_use = [0]
+        lock = threading.Lock()
+
+        def connect():
+            connection = FakeConnection()
+            opened.append(connection)
+            return connection
+
+        pool = ConnectionPool(connect, 2, timeout=10)
+        errors = []
+
+        def work():
+            try:
+                for i in range(20):
+                    connection = pool.getconn()
+                    with lock:
+                        in_use.append(connection)
+                        most_in_use[0] = max(most_in_use[0], len(in_use))
+                    time.sleep(0.001)
+                    with lock:
+                        in_use.remove(connection)
+                    pool.putconn(connection)
+            except Exception as e:
+                errors.append(e)
+
+        # More threads than connections
+        threads = [threading.Thread(target=work) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(most_in_use[0], 2)
+        self.assertEqual(len(opened), 2)
+
+    def test_timeout(self):
+        pool = ConnectionPool(FakeConnection, 1, timeout=0.01)
+        connection = pool.getconn()
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+        pool.putconn(connection)
+        self.assertIs(pool.getconn(), connection)
+
+    def test_broken_connections_replaced(self):
+        pool = ConnectionPool(FakeConnection, 1,
+                              reset=lambda connection: False)
+        connection = pool.getconn()
+        pool.putconn(connection)
+        self.assertTrue(connection.closed)
+        self.assertIsNot(pool.getconn(), connection)
+
+    def test_close_with_connections_in_use(self):
+        pool = ConnectionPool(FakeConnection, 2)
+        in_use = pool.getconn()
+        idle = pool.getconn()
+        pool.putconn(idle)
+        pool.close()
+        self.assertTrue(idle.closed)
+        self.assertFalse(in_use.closed)
+        # Closed when it's returned
+        pool.putconn(in_use)
+        self.assertTrue(in_use.closed)
+        with self.assertRaises(PoolClosed):
+            pool.getconn()
+
+
+@override_settings(TRACKER_JOBS='manual', TRACKER_TIMING_ENABLED=False)
+class LoadTestScriptTests(LiveServerTestCase):
+    """The client half of scripts/load_test.py, against the live test
+    server rather than one in a process of its own.
+    """
+    def test_run_clients(self):
+        spec = importlib.util.spec_from_file_location(
+            'load_test', os.path.join(settings.BASE_DIR, '..', 'scripts',
+                                      'load_test.py'))
+        load_test = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(load_test)
+
+        generate_library(2, 5, 20)
+        self.client.force_login(User.objects.create_user('loadtest'))
+        cookie = '{}={}'.format(
+            settings.SESSION_COOKIE_NAME,
+            self.client.cookies[settings.SESSION_COOKIE_NAME].value)
+        results = load_test.run_clients(
+            self.live_server_url, [reverse('tracker:index')], threads=2,
+            duration=0.5, cookie=cookie)
+        self.assertEqual(results['errors'], 0, results['first_error'])
+        self.assertGreater(results['requests'], 0)
+
+
+@override_settings(ROOT_URLCONF='mutrack.async_urls')
+@override_settings(TRACKER_JOBS='sync')
+class AsyncViewTests(TransactionTestCase):
+    """The async views run their queries on other threads, which only see
+    committed data.
+    """
+    def setUp(self):
+        make_library(2, 2, 3)
+        self.user = User.objects.create_user('user', password='password')
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+
+    def tearDown(self):
+        async_views.shutdown_executor()
+
+    def test_same_as_sync_views(self):
+        album = Album.objects.first()
+        urls = [
+            reverse('tracker:index'),
+            reverse('tracker:api-albums') + '?limit=2',
+            reverse('tracker:api-search') + '?q=album',
+            reverse('tracker:stats'),
+            album.get_absolute_url(),
+            album.artist.get_absolute_url(),
+        ]
+        for url in urls:
+            with override_settings(ROOT_URLCONF='mutrack.urls'):
+                expected = self.client.get(url)
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(response.content, expected.content, url)
+
+    async def test_asgi(self):
+        url = reverse('tracker:api-search')
+        # Django 3.1's AsyncClient ignores data for GET requests
+        response = await self.async_client.get(url + '?q=artist+1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['name'], 'Artist 1')
+        response = await self.async_client.get(url + '?limit=x')
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.post(url)
+        self.assertEqual(response.status_code, 405)
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.get(reverse('tracker:api-albums'))
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(reverse('tracker:stats'))
+        self.assertEqual(response.status_code, 302)
+
+    @override_settings(TRACKER_TIMING_ENABLED=True)
+    def test_timing_counts_queries(self):
+        response = self.client.get(reverse('tracker:api-albums'))
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries"')
+
+    def test_concurrent_requests(self):
+        url = reverse('tracker:api-albums')
+
+        async def get_all():
+            return await asyncio.gather(
+                *[self.async_client.get(url) for _ in range(8)])
+        responses = async_to_sync(get_all)()
+        self.assertEqual([response.status_code for response in responses],
+                         [200] * 8)
+
+
+class StaticAssetTests(TrackerTestCase):
+
+    def setUp(self):
+        super(StaticAssetTests, self).setUp()
+        inline_static._contents.clear()
+        self.static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_root)
+        self.addCleanup(inline_static._contents.clear)
+
+    def collectstatic(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings(''), {})
+        self.assertEqual(accepted_encodings('gzip, deflate, br'),
+                         {'gzip': 1.0, 'deflate': 1.0, 'br': 1.0})
+        self.assertEqual(accepted_encodings('GZIP;q=0.5, br;Q=0'),
+                         {'gzip': 0.5})
+        self.assertEqual(accepted_encodings('x-gzip'), {'x-gzip': 1.0})
+        self.assertEqual(accepted_encodings('gzip;q=high, br;q=2'), {})
+        self.assertEqual(accepted_encodings('br;q=0, *;q=0.2'),
+                         {'*': 0.2, 'gzip': 0.2})
+
+    def test_minify_css(self):
+        css = ('/* comment */\n.a  :hover ,\n.b > .c {\n  color: red;\n'
+               '  content: "x  ;  y";\n}\n')
+        self.assertEqual(minify_css(css),
+                         '.a :hover,.b>.c{color: red;content: "x  ;  y"}')
+
+    def test_collectstatic(self):
+        with override_settings(STATIC_ROOT=self.static_root):
+            self.collectstatic()
+            name = staticfiles_storage.stored_name('tracker/script.js')
+            self.assertRegex(name, r'^tracker/script\.[0-9a-f]{12}\.js$')
+            self.assertTrue(staticfiles_storage.is_hashed(name))
+            self.assertFalse(staticfiles_storage.is_hashed(
+                'tracker/script.js'))
+
+            css_name = staticfiles_storage.stored_name('tracker/style.css')
+            with staticfiles_storage.open(css_name) as f:
+                css = f.read()
+            self.assertNotIn(b'\n', css.strip())
+            with staticfiles_storage.open(css_name + '.gz') as f:
+                self.assertEqual(gzip.decompress(f.read()), css)
+
+            response = self.client.get(reverse('tracker:index'))
+            self.assertContains(response, '/static/' + name)
+            self.assertContains(response,
+                                '<style>{}</style>'.format(css.decode()))
+
+    def test_inline_without_manifest(self):
+        with override_settings(STATIC_ROOT=self.static_root):
+            response = self.client.get(reverse('tracker:stats'))
+        self.assertContains(response, '<style>.')
+        self.assertNotContains(response, 'tracker/style.css')
+
+    def test_inlined_on_every_page(self):
+        css = inline_static.inline_static('tracker/style.css')
+        for url in [reverse('tracker:index'), reverse('tracker:stats'),
+                    reverse('tracker:recommendations'),
+                    reverse('tracker:album-create'), reverse('login')]:
+            response = self.client.get(url)
+            self.assertContains(response, '<style>' + css, count=1)
+        # Page-specific rules go in the same style element
+        response = self.client.get(reverse('tracker:stats'))
+        self.assertContains(response, '.stats-bar {', count=1)
+        self.assertRegex(response.content.decode(),
+                         r'<style>[^<]*\.stats-bar \{[^<]*</style>')
+        self.assertNotContains(
+            self.client.get(reverse('tracker:index')), '.stats-bar')
+
+    def test_serve(self):
+        factory = RequestFactory()
+        with override_settings(STATIC_ROOT=self.static_root):
+            self.collectstatic()
+            name = staticfiles_storage.stored_name('tracker/script.js')
+            with staticfiles_storage.open(name) as f:
+                script = f.read()
+
+            response = static(factory.get('/', HTTP_ACCEPT_ENCODING='gzip'),
+                              name)
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertRegex(response['Content-Type'], r'/javascript$')
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertEqual(
+                gzip.decompress(b''.join(response.streaming_content)), script)
+            gzip_modified = response['Last-Modified']
+
+            response = static(factory.get('/'), 'tracker/script.js')
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertNotIn('immutable', response['Cache-Control'])
+            self.assertEqual(b''.join(response.streaming_content), script)
+
+            response = static(factory.get(
+                '/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']),
+                'tracker/script.js')
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            self.assertNotIn('immutable', response['Cache-Control'])
+
+            response = static(factory.get(
+                '/', HTTP_ACCEPT_ENCODING='gzip',
+                HTTP_IF_MODIFIED_SINCE=gzip_modified), name)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            self.assertIn('immutable', response['Cache-Control'])
+
+            # Not 'gzip' in 'x-gzip', nor refused with q=0
+            for header in ('x-gzip', 'gzip;q=0', 'gzip; q=0.000, br;q=0',
+                           '*;q=0', 'identity'):
+                response = static(
+                    factory.get('/', HTTP_ACCEPT_ENCODING=header), name)
+                self.assertFalse(response.has_header('Content-Encoding'),
+                                 header)
+            response = static(
+                factory.get('/', HTTP_ACCEPT_ENCODING='identity, *;q=0.5'),
+                name)
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+
+            for path in ('missing.js', '../settings.py'):
+                with self.assertRaises(Http404):
+                    static(factory.get('/'), path)
 
-# Create your tests here.
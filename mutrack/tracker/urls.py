@@ -5,6 +5,17 @@ from . import views
 app_name = 'tracker'
 urlpatterns = [
     url(r'^$', views.IndexView.as_view(), name='index'),
+    url(r'^api/albums/?$', views.AlbumTableData.as_view(), name='api-albums'),
+    url(r'^api/albums/autocomplete/?$', views.AlbumAutocomplete.as_view(),
+        name='api-album-autocomplete'),
+    url(r'^api/genres/?$', views.GenreFacets.as_view(), name='api-genres'),
+    url(r'^api/search/?$', views.Search.as_view(), name='api-search'),
+    url(r'^api/recommendations/?$', views.RecommendationData.as_view(),
+        name='api-recommendations'),
+    url(r'^export/?$', views.LibraryExport.as_view(), name='export'),
+    url(r'^stats/?$', views.StatsView.as_view(), name='stats'),
+    url(r'^recommendations/?$', views.RecommendationsView.as_view(),
+        name='recommendations'),
 
     url(r'^artist/add/?$', views.ArtistCreate.as_view(), name='artist-create'),
     url(r'^artist/(?P<artist_name>[^/\s]+)/?$', views.ArtistView.as_view(),
@@ -17,6 +28,8 @@ urlpatterns = [
     url(r'^album/add/?$', views.AlbumCreate.as_view(), name='album-create'),
     url(r'^album/(?P<artist_name>[^/\s]+)/(?P<album_name>[^/\s]+)/edit/?$',
         views.AlbumUpdate.as_view(), name='album-update'),
+    url(r'^album/(?P<artist_name>[^/\s]+)/(?P<album_name>[^/\s]+)/listens/?$',
+        views.ListenHistoryView.as_view(), name='album-listens'),
 
     url(r'^add-listen/?$', views.ListenCreate.as_view(), name='listen-create'),
     url(r'^add-listen/(?P<artist_name>[^/\s]+)/(?P<album_name>[^/\s]+)/?$',
@@ -1,14 +1,70 @@
 
 import copy
+import datetime
+import hashlib
 from urllib.parse import unquote_plus
 
+from django.conf import settings
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, quote_etag
 from django.views import generic
 from django.contrib.auth.mixins import LoginRequiredMixin
 
-from .models import Album, Artist, Listen
+from .models import Album, Artist, Listen, normalize_name
 from .forms import ListenForm, ListenFormForAlbum
+from .filters import filter_albums
+from .api import (InvalidParameter, album_autocomplete, album_table_page,
+                  album_table_payload, genre_facet_counts,
+                  recommendation_results, search_results)
+from .caching import data_last_modified, data_version
+from .exporter import EXPORT_FORMATS, export_library
+from .stats import DEFAULT_PERIOD, PERIODS, dashboard
+
+def first_or_404(queryset):
+    """Return the first object in queryset, or raise Http404 if it's empty.
+    """
+    obj = queryset.first()
+    if obj is None:
+        raise Http404('No {} found matching the query.'.format(
+            queryset.model._meta.verbose_name))
+    return obj
+
+
+class ConditionalGetMixin:
+    """Mixin answering repeat GET requests with 304 Not Modified.
 
-class IndexView(LoginRequiredMixin, generic.ListView):
+    ETag and Last-Modified come from the tracker's data version (see
+    caching.py), the user and the requested URL, so checking them needs
+    neither the view's queryset nor its template. Should come after
+    LoginRequiredMixin.
+    """
+    def get_etag(self, request):
+        """Return the ETag for the current data, user and URL."""
+        key = '{}:{}:{}'.format(data_version(), request.user.pk,
+                                request.get_full_path())
+        return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+    def get(self, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        last_modified = data_last_modified()
+
+        response = get_conditional_response(request, etag=etag,
+                                            last_modified=last_modified)
+        if response is None:
+            response = super(ConditionalGetMixin, self).get(
+                request, *args, **kwargs)
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        # Pages differ between users, and browsers should always check back
+        patch_vary_headers(response, ('Cookie',))
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class IndexView(LoginRequiredMixin, ConditionalGetMixin, generic.ListView):
     """Index view for the tracker application.
     """
     template_name = 'tracker/index.html'
@@ -17,13 +73,176 @@ class IndexView(LoginRequiredMixin, generic.ListView):
     def get_queryset(self):
         """Get the list of albums to display by default on the index page.
 
+        Artists are fetched along with the albums, and play counts and last
+        listen dates are stored on them, so the table doesn't need extra
+        queries per row. Column filters
+        given as query parameters (see filters.py) are applied in the database.
+        """
+        return filter_albums(Album.objects.for_table(), self.request.GET)
+
+    def album_table(self):
+        """Get the album table data the page's script renders the table from
+        (see api.album_table_payload).
+        """
+        return album_table_payload(self.object_list)
+
+    def get_context_data(self, **kwargs):
+        """Get context data for the view.
+
+        The album table data is cached per user and filter, under the current
+        data version. The template only calls album_table when the cache is
+        empty, so when the cached data is used the albums are never fetched.
         """
-        return Album.objects.all()
+        context = super(IndexView, self).get_context_data(**kwargs)
+        context['table_version'] = data_version()
+        context['table_cache_timeout'] = settings.TRACKER_TABLE_CACHE_TIMEOUT
+        return context
+
+
+class AlbumTableData(LoginRequiredMixin, generic.View):
+    """JSON view serving the index page's album table one page at a time.
+
+    Accepts the same column filters as IndexView, plus 'limit' and the
+    'after' cursor from the previous page (see api.py).
+    """
+    raise_exception = True
+
+    def get(self, request, *args, **kwargs):
+        try:
+            data = album_table_page(request.GET)
+        except InvalidParameter as err:
+            return JsonResponse({'error': str(err)}, status=400)
+        return JsonResponse(data)
+
+
+class GenreFacets(LoginRequiredMixin, generic.View):
+    """JSON view counting albums per genre tag and primary genre.
+
+    Accepts the same column filters as IndexView, to count only the albums
+    they match, and 'limit' for the number of tags.
+    """
+    raise_exception = True
+
+    def get(self, request, *args, **kwargs):
+        try:
+            data = genre_facet_counts(request.GET)
+        except InvalidParameter as err:
+            return JsonResponse({'error': str(err)}, status=400)
+        return JsonResponse(data)
+
+
+class AlbumAutocomplete(LoginRequiredMixin, generic.View):
+    """JSON view listing albums whose names start with what's been typed,
+    for AlbumAutocompleteWidget.
+
+    Takes the partly typed label as 'q' and the number of results as 'limit'.
+    """
+    raise_exception = True
+
+    def get(self, request, *args, **kwargs):
+        try:
+            data = album_autocomplete(request.GET)
+        except InvalidParameter as err:
+            return JsonResponse({'error': str(err)}, status=400)
+        return JsonResponse(data)
+
+
+class Search(LoginRequiredMixin, generic.View):
+    """JSON view searching artists and albums, for type-ahead.
+
+    Takes the query as 'q' and the number of results as 'limit'.
+    """
+    raise_exception = True
+
+    def get(self, request, *args, **kwargs):
+        try:
+            data = search_results(request.GET)
+        except InvalidParameter as err:
+            return JsonResponse({'error': str(err)}, status=400)
+        return JsonResponse(data)
+
+
+class RecommendationData(LoginRequiredMixin, generic.View):
+    """JSON view ranking albums by what to listen to next.
+
+    Takes weights for the parts of the score (see recommendations.py) and
+    the number of albums as 'limit'.
+    """
+    raise_exception = True
+
+    def get(self, request, *args, **kwargs):
+        try:
+            data = recommendation_results(request.GET)
+        except InvalidParameter as err:
+            return JsonResponse({'error': str(err)}, status=400)
+        return JsonResponse(data)
+
+
+class RecommendationsView(LoginRequiredMixin, generic.TemplateView):
+    """Albums to listen to next, best first.
+
+    Takes the same parameters as RecommendationData. Scored from arrays kept
+    in memory (see recommendations.py), so the page costs about the same
+    however many albums there are.
+    """
+    template_name = 'tracker/recommendations.html'
+
+    def get_context_data(self, **kwargs):
+        try:
+            data = recommendation_results(self.request.GET)
+        except InvalidParameter as err:
+            raise Http404(str(err))
+
+        context = super(RecommendationsView, self).get_context_data(**kwargs)
+        context.update(data)
+        return context
+
+
+class LibraryExport(LoginRequiredMixin, generic.View):
+    """Download the whole library, streamed a chunk of rows at a time.
+
+    The format (see exporter.py) is given by the 'format' query parameter and
+    defaults to jsonl.
+    """
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get('format', 'jsonl')
+        if export_format not in EXPORT_FORMATS:
+            raise Http404('Unknown export format.')
+
+        response = StreamingHttpResponse(
+            export_library(export_format),
+            content_type=EXPORT_FORMATS[export_format])
+        filename = 'mutrack-library-{}.{}'.format(
+            datetime.date.today().isoformat(), export_format)
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+            filename)
+        return response
+
+
+class StatsView(LoginRequiredMixin, ConditionalGetMixin,
+                generic.TemplateView):
+    """Listening statistics over the last few days, weeks or months.
+
+    The length of period is given by the 'period' query parameter (see
+    stats.py). Built from the rollup tables, so it renders in a fixed number
+    of queries whatever the size of the listen history.
+    """
+    template_name = 'tracker/stats.html'
+
+    def get_context_data(self, **kwargs):
+        period = self.request.GET.get('period', DEFAULT_PERIOD)
+        if period not in PERIODS:
+            raise Http404('Unknown period.')
+
+        context = super(StatsView, self).get_context_data(**kwargs)
+        context.update(dashboard(period))
+        return context
 
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Album-related views ~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 
-class AlbumView(LoginRequiredMixin, generic.DetailView):
+class AlbumView(LoginRequiredMixin, ConditionalGetMixin,
+                generic.DetailView):
     """Detail view for an individual album.
     """
     model = Album
@@ -38,10 +257,8 @@ class AlbumView(LoginRequiredMixin, generic.DetailView):
         album_name = unquote_plus(self.kwargs['album_name'])
         super_qset = super(AlbumView, self).get_queryset()
 
-        filterset = super_qset.filter(artist__name__iexact=artist_name,
-                                      name__iexact=album_name)
-
-        return filterset[0]
+        return first_or_404(super_qset.select_related('artist')
+                            .lookup(artist_name, album_name))
 
     def get_context_data(self, **kwargs):
         """Get context data for the view.
@@ -56,6 +273,50 @@ class AlbumView(LoginRequiredMixin, generic.DetailView):
                                f'{querystr}')
         context['youtube_search_link'] = youtube_search_link
 
+        # Fetched once here, with a bounded query, for the template's uses
+        context['recent_listens'] = self.object.recent_listens()
+        # The precomputed similar albums, in one indexed query
+        context['similar_albums'] = self.object.similar_albums.select_related(
+            'similar__artist')
+
+        return context
+
+
+class ListenHistoryView(LoginRequiredMixin, ConditionalGetMixin,
+                        generic.ListView):
+    """Paginated list of all listens of an album, most recent first.
+    """
+    template_name = 'tracker/listen_history.html'
+    context_object_name = 'listens'
+
+    def get_paginate_by(self, queryset):
+        return settings.TRACKER_LISTEN_HISTORY_PAGE_SIZE
+
+    def get_album(self):
+        """Get the album named in the URL, looking it up only once.
+        """
+        if not hasattr(self, 'album'):
+            self.album = first_or_404(
+                Album.objects.select_related('artist').lookup(
+                    unquote_plus(self.kwargs['artist_name']),
+                    unquote_plus(self.kwargs['album_name'])))
+        return self.album
+
+    def get_queryset(self):
+        return self.get_album().all_listens()
+
+    def get_paginator(self, *args, **kwargs):
+        paginator = super(ListenHistoryView, self).get_paginator(
+            *args, **kwargs)
+        # The album's stored play count saves counting its listens
+        paginator.count = self.get_album().play_count
+        return paginator
+
+    def get_context_data(self, **kwargs):
+        """Get context data for the view.
+        """
+        context = super(ListenHistoryView, self).get_context_data(**kwargs)
+        context['album'] = self.get_album()
         return context
 
 
@@ -92,9 +353,7 @@ class AlbumUpdate(LoginRequiredMixin, generic.edit.UpdateView):
         album_name = unquote_plus(self.kwargs['album_name'])
         super_qset = super(AlbumUpdate, self).get_queryset()
 
-        filterset = super_qset.filter(artist__name__iexact=artist_name,
-                                      name__iexact=album_name)
-        return filterset[0]
+        return first_or_404(super_qset.lookup(artist_name, album_name))
 
     def get_context_data(self, **kwargs):
         """Get context data for this view.
@@ -108,7 +367,8 @@ class AlbumUpdate(LoginRequiredMixin, generic.edit.UpdateView):
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~ Artist-related views ~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 
-class ArtistView(LoginRequiredMixin, generic.DetailView):
+class ArtistView(LoginRequiredMixin, ConditionalGetMixin,
+                 generic.DetailView):
     """Detail view for an Artist.
     """
     model = Artist
@@ -118,9 +378,9 @@ class ArtistView(LoginRequiredMixin, generic.DetailView):
         """
         artist_name = unquote_plus(self.kwargs['artist_name'])
         super_qset = super(ArtistView, self).get_queryset()
-        filterset = super_qset.filter(name__iexact=artist_name)
 
-        return filterset[0]
+        return first_or_404(
+            super_qset.filter(name_key=normalize_name(artist_name)))
 
     def get_context_data(self, **kwargs):
         """Get context data for the view.
@@ -128,8 +388,9 @@ class ArtistView(LoginRequiredMixin, generic.DetailView):
         # Call super
         context = super(ArtistView, self).get_context_data(**kwargs)
 
-        context['albums_by_artist'] = Album.objects.filter(
-            artist__name__iexact=unquote_plus(self.kwargs['artist_name']))
+        context['albums_by_artist'] = self.object.album_set.all()
+        context['similar_artists'] = (
+            self.object.similar_artists.select_related('similar'))
 
         return context
 
@@ -163,9 +424,9 @@ class ArtistUpdate(LoginRequiredMixin, generic.edit.UpdateView):
         """
         artist_name = unquote_plus(self.kwargs['artist_name'])
         super_qset = super(ArtistUpdate, self).get_queryset()
-        filterset = super_qset.filter(name__iexact=artist_name)
 
-        return filterset[0]
+        return first_or_404(
+            super_qset.filter(name_key=normalize_name(artist_name)))
 
     def get_context_data(self, **kwargs):
         """Get context data for this view.
@@ -217,13 +478,21 @@ class ListenCreateForAlbum(LoginRequiredMixin, generic.edit.CreateView):
         context['model_name'] = 'Listen'
 
         # Add the album name to the context (currently using Album.__str__)
-        context['album'] = str(self.get_initial()['album'])
+        context['album'] = str(self.get_album())
 
         return context
 
+    def get_album(self):
+        """Get the album named in the URL, looking it up only once.
+        """
+        if not hasattr(self, 'album'):
+            self.album = first_or_404(
+                Album.objects.select_related('artist').lookup(
+                    unquote_plus(self.kwargs['artist_name']),
+                    unquote_plus(self.kwargs['album_name'])))
+        return self.album
+
     def get_initial(self):
         initial = copy.copy(self.initial)
-        initial['album'] = Album.objects.get(
-            name__iexact=unquote_plus(self.kwargs['album_name']),
-            artist__name__iexact=unquote_plus(self.kwargs['artist_name']))
+        initial['album'] = self.get_album()
         return initial
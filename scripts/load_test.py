@@ -0,0 +1,311 @@
+"""
+load_test.py
+
+Measures requests per second and latency with many clients at once, to
+compare WSGI with ASGI serving, database profiles (see MUTRACK_DB_PROFILE in
+mutrack/settings.py) and CONN_MAX_AGE values.
+
+Each server runs in a process of its own, as it would be deployed:
+
+- wsgi: Gunicorn, one worker process with a thread per client, so each
+  thread keeps its own database connection between requests when
+  CONN_MAX_AGE allows
+- asgi: Uvicorn running the async views (see tracker/async_views.py), with
+  MUTRACK_ASYNC_THREADS database threads, one per client
+
+This script is the client. It fills a throwaway database with a synthetic
+library, then for each server and CONN_MAX_AGE starts the server and requests
+the pages from several threads for a fixed time, one request at a time per
+thread.
+
+Run from the repository root, with gunicorn and uvicorn installed and the
+server's settings (e.g. MUTRACK_SECRET_KEY) in the environment:
+
+    python scripts/load_test.py --size small --threads 8 --duration 10
+
+SQLite profiles use a temporary database file. With the postgres profile,
+--database names a scratch database to migrate and fill; anything already in
+it may be changed.
+"""
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+MUTRACK_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'mutrack')
+
+HOST = '127.0.0.1'
+
+# Maps server -> (module to run, function returning its arguments given the
+# port and number of threads)
+SERVERS = {
+    'wsgi': ('gunicorn', lambda port, threads: [
+        'mutrack.wsgi', '--workers', '1', '--threads', str(threads),
+        '--bind', '{}:{}'.format(HOST, port), '--log-level', 'warning']),
+    'asgi': ('uvicorn', lambda port, threads: [
+        'mutrack.asgi:application', '--host', HOST, '--port', str(port),
+        '--log-level', 'warning', '--no-access-log']),
+}
+
+DEFAULT_THREADS = 8
+DEFAULT_DURATION = 10.0
+
+# Seconds to wait for a server to start listening
+STARTUP_TIMEOUT = 30
+
+
+def percentile(values, fraction):
+    """Return the value below which the given fraction of values fall."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_clients(server_url, paths, threads=DEFAULT_THREADS,
+                duration=DEFAULT_DURATION, cookie=None):
+    """Request paths from a server with several clients for duration seconds.
+
+    Each client thread requests the paths in turn, starting at a different
+    one, and waits for each response before sending the next request.
+    Returns a dict of results.
+    """
+    host, port = server_url.split('://')[1].split(':')
+    headers = {}
+    if cookie is not None:
+        headers['Cookie'] = cookie
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(offset):
+        times = []
+        failures = []
+        i = offset
+        while time.monotonic() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            start = time.perf_counter()
+            conn = http.client.HTTPConnection(host, int(port), timeout=30)
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException) as e:
+                status = str(e)
+            finally:
+                conn.close()
+            if status == 200:
+                times.append(time.perf_counter() - start)
+            else:
+                failures.append('{}: {}'.format(path, status))
+        with lock:
+            latencies.extend(times)
+            errors.extend(failures)
+
+    start = time.monotonic()
+    clients = [threading.Thread(target=client, args=[i])
+               for i in range(threads)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'seconds': elapsed,
+        'requests_per_second': len(latencies) / elapsed,
+        'median_ms': statistics.median(latencies) * 1000 if latencies else 0,
+        'p95_ms': percentile(latencies, 0.95) * 1000 if latencies else 0,
+    }
+
+
+def free_port():
+    """Return a port nothing is listening on."""
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process):
+    """Wait until a server process is accepting connections on port."""
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('The server exited with status {}.'.format(
+                process.returncode))
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('The server did not start listening in {}s.'.format(
+        STARTUP_TIMEOUT))
+
+
+def run_server_test(server, paths, threads, duration, conn_max_age, cookie,
+                    env):
+    """Start a server process, load it with client threads, and stop it.
+    """
+    module, arguments = SERVERS[server]
+    port = free_port()
+    env = dict(env, MUTRACK_DB_CONN_MAX_AGE=str(conn_max_age),
+               MUTRACK_ASYNC_THREADS=str(threads))
+    process = subprocess.Popen(
+        [sys.executable, '-m', module] + arguments(port, threads),
+        cwd=MUTRACK_DIR, env=env)
+    try:
+        wait_for_port(port, process)
+        results = {'server': server, 'conn_max_age': conn_max_age}
+        results.update(run_clients('http://{}:{}'.format(HOST, port), paths,
+                                   threads, duration, cookie))
+        return results
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def set_up_database(size, paths):
+    """Migrate the database, fill it with a synthetic library, and return
+    the paths to request and a session cookie for them.
+    """
+    sys.path.insert(0, MUTRACK_DIR)
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from django.db import connection, connections
+    from django.test import Client
+    from django.urls import reverse
+
+    from tracker.benchmarks import LIBRARY_SIZES
+    from tracker.models import Album
+    from tracker.synthetic import generate_library
+
+    call_command('migrate', verbosity=0)
+    generate_library(*LIBRARY_SIZES[size])
+    if not paths:
+        album = Album.objects.select_related('artist').first()
+        paths = [
+            reverse('tracker:index'),
+            reverse('tracker:api-albums') + '?limit=100',
+            str(album.get_absolute_url()),
+            reverse('tracker:stats'),
+        ]
+
+    user, _ = User.objects.get_or_create(username='loadtest')
+    client = Client()
+    client.force_login(user)
+    cookie = '{}={}'.format(
+        settings.SESSION_COOKIE_NAME,
+        client.cookies[settings.SESSION_COOKIE_NAME].value)
+    vendor = connection.vendor
+    connections.close_all()
+    return paths, cookie, vendor
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve the tracker with real servers and measure '
+                    'requests per second with many clients at once, for each '
+                    'server and CONN_MAX_AGE given.')
+    parser.add_argument('--size', default='small',
+                        choices=['tiny', 'small', 'medium', 'large'],
+                        help='Size of the synthetic library to load.')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                        help='Client threads, and server worker threads.')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION,
+                        help='Seconds to run each test for.')
+    parser.add_argument(
+        '--servers', default=','.join(SERVERS),
+        help='Comma-separated servers to compare, from: {}.'.format(
+            ', '.join(SERVERS)))
+    parser.add_argument(
+        '--conn-max-age', default='0,60',
+        help='Comma-separated CONN_MAX_AGE values to compare.')
+    parser.add_argument(
+        '--paths',
+        help='Comma-separated paths to request. Defaults to the index, '
+             'album table data, an album and the stats page.')
+    parser.add_argument(
+        '--database',
+        help='Scratch database to use with the postgres profile.')
+    parser.add_argument('-o', '--output',
+                        help='Write results to this JSON file.')
+    args = parser.parse_args()
+
+    try:
+        ages = [int(age) for age in args.conn_max_age.split(',')]
+    except ValueError:
+        parser.error('--conn-max-age takes whole numbers of seconds.')
+    servers = args.servers.split(',')
+    unknown = set(servers) - set(SERVERS)
+    if unknown:
+        parser.error('Unknown servers: {}'.format(', '.join(unknown)))
+    for server in servers:
+        module = SERVERS[server][0]
+        if importlib.util.find_spec(module) is None:
+            parser.error('The {} server needs {}: pip install {}'.format(
+                server, module, module))
+
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='mutrack.settings',
+               MUTRACK_TIMING='0')
+    test_dir = None
+    if env.get('MUTRACK_DB_PROFILE', 'sqlite').startswith('sqlite'):
+        # On disk, as served in production, rather than in memory
+        test_dir = tempfile.mkdtemp()
+        env['MUTRACK_DB_NAME'] = os.path.join(test_dir, 'loadtest.sqlite3')
+    elif args.database:
+        env['MUTRACK_DB_NAME'] = args.database
+    else:
+        parser.error('--database is needed with the postgres profile.')
+    os.environ.update(env)
+
+    try:
+        paths, cookie, vendor = set_up_database(
+            args.size, args.paths.split(',') if args.paths else None)
+        print('{} database, {} threads, {:g}s per test'.format(
+            vendor, args.threads, args.duration))
+        runs = []
+        for server in servers:
+            for age in ages:
+                result = run_server_test(server, paths, args.threads,
+                                         args.duration, age, cookie, env)
+                runs.append(result)
+                print('  {} CONN_MAX_AGE={:<4d} {:8.1f} req/s  median '
+                      '{:7.1f}ms  p95 {:7.1f}ms  {} errors'.format(
+                          server, age, result['requests_per_second'],
+                          result['median_ms'], result['p95_ms'],
+                          result['errors']))
+                if result['first_error']:
+                    print('    first error: ' + result['first_error'])
+    finally:
+        if test_dir is not None:
+            # Including any WAL files left behind
+            shutil.rmtree(test_dir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'vendor': vendor, 'size': args.size,
+                       'threads': args.threads, 'paths': paths,
+                       'runs': runs}, f, indent=2)
+        print('Results written to {}.'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()